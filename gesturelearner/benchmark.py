@@ -0,0 +1,286 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from gesturelearner import checkpointing, data, graph, image_augmentation, inference, stroke_augmentation, weights
+from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH, NUM_LABEL_INDEXES
+import train_distributed
+
+
+@click.group()
+def main():
+    pass
+
+
+@main.command('input')
+@click.argument('training-file')
+@click.option('--steps', default=500)
+@click.option('--warmup-steps', default=50)
+@click.option('--batch-size', default=50)
+@click.option('--shuffle-buffer', default=1000)
+@click.option('--num-parallel-calls', type=int)
+def input_pipeline(training_file, steps, warmup_steps, batch_size, shuffle_buffer, num_parallel_calls):
+    """Compare training steps/sec of the queue-runner input path with the tf.data pipeline."""
+    results = []
+
+    for mode, cache in [('queue', None), ('dataset', None), ('dataset', 'memory')]:
+        with tf.Graph().as_default():
+            if mode == 'queue':
+                train_images, train_labels = data.queue_input([training_file], batch_size)
+                images_input = tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+                labels_input = tf.placeholder(tf.float32, [None, NUM_LABEL_INDEXES])
+            else:
+                train_images, train_labels = data.dataset_input([training_file], batch_size, shuffle_buffer, cache,
+                                                                num_parallel_calls)
+                images_input = train_images
+                labels_input = train_labels
+
+            predicted_labels, variables = graph.make_network(images_input)
+            cross_entropy = tf.reduce_mean(
+                tf.nn.softmax_cross_entropy_with_logits(labels=labels_input, logits=predicted_labels))
+            train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
+
+            with tf.Session() as sess:
+                sess.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+
+                coord = tf.train.Coordinator()
+                threads = tf.train.start_queue_runners(coord=coord)
+
+                def run_step():
+                    if mode == 'queue':
+                        next_images, next_labels = sess.run([train_images, train_labels])
+                        sess.run(train_step, {variables['keep_prob']: 0.5, images_input: next_images,
+                                              labels_input: next_labels})
+                    else:
+                        sess.run(train_step, {variables['keep_prob']: 0.5})
+
+                try:
+                    for _ in range(warmup_steps):
+                        run_step()
+
+                    start = time.time()
+                    for _ in range(steps):
+                        run_step()
+                    elapsed = time.time() - start
+                finally:
+                    coord.request_stop()
+                    coord.join(threads)
+
+        name = mode if cache is None else '%s (cache=%s)' % (mode, cache)
+        results.append((name, steps / elapsed))
+        print('%s: %.1f steps/sec, %.0f examples/sec' % (name, steps / elapsed, steps * batch_size / elapsed))
+
+    baseline = results[0][1]
+    print()
+    print('%-24s %12s %10s' % ('input path', 'steps/sec', 'speedup'))
+    for name, steps_per_second in results:
+        print('%-24s %12.1f %9.2fx' % (name, steps_per_second, steps_per_second / baseline))
+
+
+@main.command('strokes')
+@click.argument('drawings-file')
+@click.option('--steps', default=200)
+@click.option('--warmup-steps', default=20)
+@click.option('--batch-size', default=50)
+@click.option('--workers', type=int)
+def stroke_augmentation_throughput(drawings_file, steps, warmup_steps, batch_size, workers):
+    """Check that stroke augmentation of a .dataset file keeps up with training."""
+    augmenter = stroke_augmentation.StrokeAugmenter(stroke_augmentation.Drawings.load(drawings_file))
+    batches = augmenter.batches(batch_size)
+
+    start = time.time()
+    for _ in range(steps):
+        next(batches)
+    elapsed = time.time() - start
+    print('augmentation, one process: %.1f batches/sec, %.0f examples/sec'
+          % (steps / elapsed, steps * batch_size / elapsed))
+
+    fixed_images, fixed_labels = next(batches)
+    fixed_steps_per_second = training_steps_per_second(lambda: (tf.constant(fixed_images), tf.constant(fixed_labels)),
+                                                       steps, warmup_steps)
+    print('training, fixed batch: %.1f steps/sec' % fixed_steps_per_second)
+
+    augmented_steps_per_second = training_steps_per_second(
+        lambda: data.drawings_input(drawings_file, batch_size, workers), steps, warmup_steps)
+    print('training, augmented: %.1f steps/sec' % augmented_steps_per_second)
+
+    print()
+    print('Training with augmented drawings runs at %.0f%% of the speed of the training step alone.'
+          % (100. * augmented_steps_per_second / fixed_steps_per_second))
+
+
+@main.command('augment')
+@click.argument('training-file')
+@click.option('--steps', default=200)
+@click.option('--warmup-steps', default=20)
+@click.option('--batch-size', default=50)
+@click.option('--num-parallel-calls', type=int)
+def image_augmentation_throughput(training_file, steps, warmup_steps, batch_size, num_parallel_calls):
+    """Check that image augmentation doesn't slow down training on a .tfrecords file."""
+    augmenter = image_augmentation.ImageAugmenter()
+
+    with tf.Graph().as_default():
+        images, _ = data.dataset_input([training_file], batch_size)
+
+        with tf.Session() as sess:
+            batch = sess.run(images)
+
+    augmenter.augment(batch)
+    start = time.time()
+    for _ in range(steps):
+        augmenter.augment(batch)
+    elapsed = time.time() - start
+    print('augmentation, one thread: %.1f batches/sec, %.0f examples/sec'
+          % (steps / elapsed, steps * batch_size / elapsed))
+
+    results = []
+
+    for name, step_augmenter in [('without augmentation', None), ('with augmentation', augmenter)]:
+        steps_per_second = training_steps_per_second(
+            lambda: data.dataset_input([training_file], batch_size, num_parallel_calls=num_parallel_calls,
+                                       augmenter=step_augmenter),
+            steps, warmup_steps)
+        results.append(steps_per_second)
+        print('training, %s: %.1f steps/sec' % (name, steps_per_second))
+
+    print()
+    print('Training with image augmentation runs at %.0f%% of the speed without it.' % (100. * results[1] / results[0]))
+
+
+@main.command('scaling')
+@click.argument('training-file')
+@click.option('--workers', default='1,2,4,8', help='Comma-separated numbers of workers to try.')
+@click.option('--sync/--async', 'synchronous', default=True)
+@click.option('--steps', default=300, help='Global steps of each run.')
+@click.option('--warmup-steps', default=20)
+@click.option('--batch-size', default=50)
+@click.option('--threads-per-worker', type=int)
+def scaling(training_file, workers, synchronous, steps, warmup_steps, batch_size, threads_per_worker):
+    """Measure how the throughput of train_distributed.py scales with the number of workers on this machine."""
+    results = []
+
+    for num_workers in [int(n) for n in workers.split(',')]:
+        # A fresh directory for each run, which would otherwise resume from the previous run's checkpoint.
+        directory = tempfile.mkdtemp()
+
+        try:
+            throughputs = train_distributed.launch_local(
+                training_file, num_workers, model_out=os.path.join(directory, 'model.ckpt'), synchronous=synchronous,
+                batch_size=batch_size, learning_rate=1e-4, max_steps=steps, save_steps=steps,
+                threads_per_worker=threads_per_worker, warmup_steps=warmup_steps)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if len(throughputs) < num_workers:
+            print('%d workers: only %d of them reported their throughput.' % (num_workers, len(throughputs)))
+            continue
+
+        results.append((num_workers, sum(throughputs)))
+        print('%d workers: %.0f examples/sec' % (num_workers, sum(throughputs)))
+
+    if not results:
+        return
+
+    baseline_workers, baseline = results[0]
+    print()
+    print('%-10s %14s %10s %12s' % ('workers', 'examples/sec', 'speedup', 'efficiency'))
+    for num_workers, examples_per_second in results:
+        speedup = examples_per_second / baseline
+        print('%-10d %14.0f %9.2fx %11.0f%%'
+              % (num_workers, examples_per_second, speedup, 100. * speedup * baseline_workers / num_workers))
+
+
+@main.command('inference')
+@click.argument('test-file')
+@click.option('--model', default='model.ckpt')
+@click.option('--batch-size', default=256, help='The batch size for measuring throughput.')
+@click.option('--repeats', default=200, help='Single images classified for measuring latency.')
+@click.option('--tolerance', default=1e-4, help='The largest allowed difference between the probabilities.')
+def inference_engine(test_file, model, batch_size, repeats, tolerance):
+    """Check that the NumPy inference engine matches the TensorFlow graph and compare their speed."""
+    checkpoint = checkpointing.latest(model)
+
+    if checkpoint is None:
+        print('Couldn\'t find model "%s".' % model)
+        return
+
+    test_images, test_labels = data.read_test_file(test_file)
+    label_indexes = np.argmax(test_labels, 1)
+
+    start = time.time()
+    network = inference.Network(weights.load_checkpoint(checkpoint), batch_size)
+    numpy_setup = time.time() - start
+
+    with tf.Graph().as_default():
+        start = time.time()
+        images_input = tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        predicted_labels, variables = graph.make_network(images_input,
+                                                         **weights.checkpoint_network_options(checkpoint))
+        probabilities = tf.nn.softmax(predicted_labels)
+
+        with tf.Session() as sess:
+            checkpointing.restore(sess, checkpoint)
+            tf_setup = time.time() - start
+
+            def tf_predict(images):
+                return sess.run(probabilities, {images_input: images, variables['keep_prob']: 1.0})
+
+            tf_probabilities = np.concatenate([tf_predict(test_images[start:start + batch_size])
+                                               for start in range(0, len(test_images), batch_size)])
+            tf_results = inference.measure_speed(tf_predict, test_images, batch_size, repeats)
+
+    numpy_probabilities = network.predict(test_images)
+    numpy_results = inference.measure_speed(network.predict, test_images, batch_size, repeats)
+
+    difference = np.abs(numpy_probabilities - tf_probabilities).max()
+    agreement = np.mean(np.argmax(numpy_probabilities, 1) == np.argmax(tf_probabilities, 1))
+
+    print('largest difference in probability: %g (tolerance %g)' % (difference, tolerance))
+    print('same predicted label: %.2f%% of %d images' % (100. * agreement, len(test_images)))
+    print('testing accuracy: TensorFlow %.4f, NumPy %.4f'
+          % (np.mean(np.argmax(tf_probabilities, 1) == label_indexes),
+             np.mean(np.argmax(numpy_probabilities, 1) == label_indexes)))
+
+    print()
+    print('%-12s %10s %14s %16s' % ('engine', 'setup (s)', 'latency (ms)', 'images/sec'))
+    for name, setup, (latency, throughput) in [('TensorFlow', tf_setup, tf_results),
+                                               ('NumPy', numpy_setup, numpy_results)]:
+        print('%-12s %10.2f %14.2f %16.0f' % (name, setup, 1000. * latency, throughput))
+
+    if difference > tolerance:
+        print('The NumPy engine doesn\'t match the TensorFlow graph.')
+
+
+def training_steps_per_second(make_input, steps, warmup_steps):
+    """Time training steps in a new graph whose input tensors are returned by make_input."""
+    with tf.Graph().as_default():
+        train_images, train_labels = make_input()
+
+        predicted_labels, variables = graph.make_network(train_images)
+        cross_entropy = tf.reduce_mean(
+            tf.nn.softmax_cross_entropy_with_logits(labels=train_labels, logits=predicted_labels))
+        train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+
+            for _ in range(warmup_steps):
+                sess.run(train_step, {variables['keep_prob']: 0.5})
+
+            start = time.time()
+            for _ in range(steps):
+                sess.run(train_step, {variables['keep_prob']: 0.5})
+            return steps / (time.time() - start)
+
+
+if __name__ == '__main__':
+    main()
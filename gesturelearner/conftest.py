@@ -0,0 +1,33 @@
+"""pytest puts this directory on sys.path, so the tests import gesturelearner and protobuf like the scripts do."""
+
+import numpy as np
+import pytest
+
+from gesturelearner.constants import *
+
+
+def random_weights(random_state, conv_channels=CONV_CHANNELS):
+    """Weights of the shapes make_network gives them, scaled so that the activations stay around 1."""
+    input_channels = (1,) + tuple(conv_channels[:-1])
+    shapes = {}
+
+    for i, (layer_input, layer_output) in enumerate(zip(input_channels, conv_channels)):
+        shapes['W_conv%d' % (i + 1)] = (3, 3, layer_input, layer_output)
+        shapes['b_conv%d' % (i + 1)] = (layer_output,)
+
+    shapes.update({'W_fc1': (6 * 6 * conv_channels[-1], 1024), 'b_fc1': (1024,),
+                   'W_fc2': (1024, NUM_LABEL_INDEXES), 'b_fc2': (NUM_LABEL_INDEXES,)})
+
+    return dict((name, (random_state.randn(*shape) / np.sqrt(np.prod(shape[:-1]) if len(shape) > 1 else 10))
+                 .astype(np.float32))
+                for name, shape in shapes.items())
+
+
+@pytest.fixture
+def weights():
+    return random_weights(np.random.RandomState(0))
+
+
+@pytest.fixture
+def images():
+    return np.random.RandomState(1).uniform(-0.5, 0.5, (5, IMAGE_HEIGHT, IMAGE_WIDTH, 1)).astype(np.float32)
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import os
 import sys
 
@@ -9,42 +10,318 @@ import click
 import numpy as np
 import tensorflow as tf
 
+from gesturelearner import dedup, framed, label_index, packed, records
 import protobuf.touches_pb2 as touches_pb2
 
 
 @click.command()
 @click.argument('in-file')
 @click.option('--out-file')
-def main(in_file, out_file):
+@click.option('--format', 'out_format', type=click.Choice(['tfrecords', 'packed']), default='tfrecords')
+@click.option('--num-shards', default=1, help='Split the output into this many name-NNNNN-of-NNNNN.tfrecords files.')
+@click.option('--workers', type=int, help='Number of processes writing shards. Defaults to one per CPU.')
+@click.option('--follow', is_flag=True,
+              help='Convert a framed in-file while it is still being written, until its writer closes it.')
+@click.option('--follow-timeout', default=300.0,
+              help='With --follow, give up when the in-file hasn\'t grown for this many seconds.')
+@click.option('--include-with-label', type=int, multiple=True, help='Only convert the images with these labels.')
+@click.option('--incremental', is_flag=True,
+              help='Only convert images added since the last --incremental run, into name-incNNNNN.tfrecords shards.')
+@click.option('--verify-index', is_flag=True, help='Check the label index against a checksum of the whole file rather '
+                                                   'than its size, modification time and first and last blocks.')
+def main(in_file, out_file, out_format, num_shards, workers, follow, follow_timeout, include_with_label,
+         incremental, verify_index):
     if out_file is None:
         file_name = os.path.splitext(in_file)[0]
-        out_file = file_name + ".tfrecords"
+        out_file = file_name + "." + out_format
+
+    if num_shards > 1 and (out_format == 'packed' or follow):
+        print('--num-shards only applies to the tfrecords format without --follow.', file=sys.stderr)
+        return
+
+    if follow:
+        scanned_images = framed.follow(in_file, timeout=follow_timeout)
+
+        try:
+            if out_format == 'packed':
+                count = save_packed(scanned_images, out_file)
+            else:
+                count = write_records(scanned_images, out_file)
+        except framed.FollowTimeoutError as e:
+            print('%s "%s" is incomplete.' % (e, out_file), file=sys.stderr)
+            return
+
+        print('Saved %s images to "%s".' % (count, out_file))
+        sys.stdout.flush()
+        return
 
     try:
-        f = open(in_file, 'rb')
-        training_set = touches_pb2.TrainingSet()
-        training_set.ParseFromString(f.read())
-        f.close()
+        source = records.open_records(in_file)
     except FileNotFoundError:
         print('Could not find in-file "' + in_file + '"')
         return
 
-    writer = tf.python_io.TFRecordWriter(out_file)
+    settings = ','.join(str(label) for label in sorted(include_with_label))
+
+    if incremental and out_format != 'tfrecords':
+        print('--incremental only supports the tfrecords format.', file=sys.stderr)
+        return
+
+    # The label index gives the offsets of the records to convert without scanning the file, except the first time.
+    index = label_index.load_or_build(in_file, source, verify_index)
+
+    if incremental:
+        manifest = load_manifest(out_file)
+
+        if manifest is not None and manifest['checksum'] == index.checksum and manifest['settings'] == settings:
+            print('"%s" is unchanged since the last conversion.' % in_file)
+            source.close()
+            return
+
+    if len(include_with_label) > 0:
+        offsets = index.offsets_for(include_with_label)
+    else:
+        offsets = index.offsets
+
+    if out_format == 'packed':
+        count = save_packed((source.record_at(int(offset)) for offset in offsets), out_file)
+        source.close()
+        print('Saved %s images to "%s".' % (count, out_file))
+        sys.stdout.flush()
+        return
+
+    if incremental:
+        convert_incremental(source, in_file, index.checksum, offsets, out_file, num_shards, workers, settings, manifest)
+        source.close()
+        return
+
+    source.close()
+
+    num_shards = max(1, min(num_shards, len(offsets)))
+
+    if num_shards == 1:
+        write_shard((out_file, in_file, offsets))
+        print('Saved %s images to "%s".' % (len(offsets), out_file))
+        sys.stdout.flush()
+        return
 
-    for labelled_image in training_set.labelledImages:
-        feature = {
-            'height': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(labelled_image.image.height)])),
-            'width': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(labelled_image.image.width)])),
-            'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(compress_label(labelled_image.label))])),
-            'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[labelled_image.image.values]))
+    # Each worker reads its own records from the input file, so nothing but file names and offsets is sent between
+    # processes.
+    tasks = [(shard_file_name(out_file, shard, num_shards), in_file, offsets_chunk)
+             for shard, offsets_chunk in enumerate(split(offsets, num_shards))]
+
+    run_tasks(tasks, workers)
+
+
+def convert_incremental(source, in_file, file_checksum, offsets, out_file, num_shards, workers, settings, manifest):
+    """Bring the shards listed in out_file's manifest up to date with in_file.
+
+    Records are matched by content hash. Shards that lost records are rewritten, and records that aren't in any shard
+    yet are written to new shards. A change of settings (the converted labels) starts over from scratch.
+    """
+    keys = unique_keys(np.array([dedup.record_hash(record.label, record.height, record.width, record.values)
+                                 for record in (source.record_at(int(offset)) for offset in offsets)],
+                                dtype=np.uint64))
+
+    if manifest is None or manifest['settings'] != settings:
+        if manifest is not None:
+            for shard_name in manifest['shard_names']:
+                remove_if_exists(os.path.join(os.path.dirname(out_file), shard_name))
+
+        manifest = {
+            'keys': np.zeros(0, dtype=np.uint64),
+            'shard_ids': np.zeros(0, dtype=np.int64),
+            'shard_names': [],
+            'next_shard': 0
         }
 
-        example = tf.train.Example(features=tf.train.Features(feature=feature))
+    old_keys = manifest['keys']
+    old_shard_ids = manifest['shard_ids']
+    shard_names = list(manifest['shard_names'])
+    directory = os.path.dirname(out_file)
+
+    key_order = np.argsort(keys)
+    is_still_present = np.isin(old_keys, keys)
+    is_new = ~np.isin(keys, old_keys)
+
+    # Rewrite the shards that lost records with the records they have left.
+    tasks = []
+    removed_shard_ids = []
+
+    for shard_id in np.unique(old_shard_ids[~is_still_present]):
+        remaining_keys = old_keys[(old_shard_ids == shard_id) & is_still_present]
+        shard_file = os.path.join(directory, shard_names[shard_id])
+
+        if len(remaining_keys) == 0:
+            remove_if_exists(shard_file)
+            removed_shard_ids.append(shard_id)
+            print('Removed "%s".' % shard_file)
+            continue
+
+        remaining_offsets = offsets[key_order[np.searchsorted(keys, remaining_keys, sorter=key_order)]]
+        tasks.append((shard_file, in_file, np.sort(remaining_offsets)))
+
+    rewritten_shard_count = len(tasks)
+    kept = is_still_present & ~np.isin(old_shard_ids, removed_shard_ids)
+    new_keys = [old_keys[kept]]
+    new_shard_ids = [old_shard_ids[kept]]
+
+    # Write the new records to new shards.
+    new_offsets = offsets[is_new]
+    next_shard = manifest['next_shard']
+
+    for positions in split(np.flatnonzero(is_new), max(1, min(num_shards, len(new_offsets)))):
+        if len(positions) == 0:
+            continue
+
+        shard_names.append(incremental_shard_file_name(out_file, next_shard))
+        next_shard += 1
+        tasks.append((os.path.join(directory, shard_names[-1]), in_file, offsets[positions]))
+        new_keys.append(keys[positions])
+        new_shard_ids.append(np.full(len(positions), len(shard_names) - 1, dtype=np.int64))
+
+    print('%s new images, %s removed images, %s shards to rewrite.'
+          % (len(new_offsets), (~is_still_present).sum(), rewritten_shard_count))
+
+    if len(tasks) > 0:
+        run_tasks(tasks, workers)
+
+    save_manifest(out_file, {
+        'keys': np.concatenate(new_keys),
+        'shard_ids': np.concatenate(new_shard_ids),
+        'shard_names': shard_names,
+        'next_shard': next_shard,
+        'checksum': file_checksum,
+        'settings': settings
+    })
+
 
+def unique_keys(hashes):
+    """Make repeated hashes unique, so identical records still count separately.
+
+    Each hash is offset by a multiple of a large odd constant: the number of times it occurred before.
+    """
+    order = np.argsort(hashes, kind='mergesort')
+    sorted_hashes = hashes[order]
+    group_starts = np.flatnonzero(np.concatenate([[True], sorted_hashes[1:] != sorted_hashes[:-1]]))
+    group_sizes = np.diff(np.concatenate([group_starts, [len(hashes)]]))
+    occurrences = np.arange(len(hashes)) - np.repeat(group_starts, group_sizes)
+
+    keys = np.empty_like(hashes)
+    keys[order] = sorted_hashes + occurrences.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    return keys
+
+
+def manifest_file_name(out_file):
+    return out_file + '.manifest'
+
+
+def load_manifest(out_file):
+    try:
+        with np.load(manifest_file_name(out_file)) as arrays:
+            return {
+                'keys': arrays['keys'],
+                'shard_ids': arrays['shard_ids'],
+                'shard_names': [str(name) for name in arrays['shard_names']],
+                'next_shard': int(arrays['next_shard']),
+                'checksum': str(arrays['checksum']),
+                'settings': str(arrays['settings'])
+            }
+    except (IOError, OSError, KeyError):
+        return None
+
+
+def save_manifest(out_file, manifest):
+    temporary_file = manifest_file_name(out_file) + '.tmp'
+
+    with open(temporary_file, 'wb') as f:
+        np.savez(f, keys=manifest['keys'], shard_ids=manifest['shard_ids'],
+                 shard_names=np.array(manifest['shard_names'], dtype=np.str_), next_shard=manifest['next_shard'],
+                 checksum=np.array(manifest['checksum']), settings=np.array(manifest['settings']))
+
+    os.rename(temporary_file, manifest_file_name(out_file))
+
+
+def remove_if_exists(file_name):
+    if os.path.exists(file_name):
+        os.remove(file_name)
+
+
+def split(array, count):
+    return [array[i * len(array) // count:(i + 1) * len(array) // count] for i in range(count)]
+
+
+def run_tasks(tasks, workers):
+    if len(tasks) == 1:
+        shard_file, count = write_shard(tasks[0])
+        print('Saved %s images to "%s".' % (count, shard_file))
+        sys.stdout.flush()
+        return
+
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+    try:
+        for shard_file, count in pool.imap_unordered(write_shard, tasks):
+            print('Saved %s images to "%s".' % (count, shard_file))
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+
+def shard_file_name(out_file, shard, num_shards):
+    [file_name, extension] = os.path.splitext(out_file)
+    return '%s-%05d-of-%05d%s' % (file_name, shard, num_shards, extension)
+
+
+def incremental_shard_file_name(out_file, shard):
+    """The base name of an incremental shard, which is relative to the directory of out_file."""
+    [file_name, extension] = os.path.splitext(os.path.basename(out_file))
+    return '%s-inc%05d%s' % (file_name, shard, extension)
+
+
+def make_example(values, height, width, compressed_label):
+    feature = {
+        'height': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(height)])),
+        'width': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(width)])),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[np.int64(compressed_label)])),
+        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[values]))
+    }
+
+    return tf.train.Example(features=tf.train.Features(feature=feature))
+
+
+def write_shard(task):
+    shard_file, in_file, offsets = task
+
+    # Write to a temporary file first, since a shard being rewritten must not be left half-written.
+    with records.open_records(in_file) as source:
+        count = write_records((source.record_at(int(offset)) for offset in offsets), shard_file + '.tmp')
+
+    os.rename(shard_file + '.tmp', shard_file)
+
+    return shard_file, count
+
+
+def write_records(scanned_images, file_name):
+    writer = tf.python_io.TFRecordWriter(file_name)
+    count = 0
+
+    for record in scanned_images:
+        example = make_example(bytes(record.values), record.height, record.width, compress_label(record.label))
         writer.write(example.SerializeToString())
+        count += 1
 
     writer.close()
-    sys.stdout.flush()
+
+    return count
+
+
+def save_packed(scanned_images, file_name):
+    with packed.PackedWriter(file_name) as writer:
+        for record in scanned_images:
+            writer.write(record.values, record.height, record.width, compress_label(record.label))
+
+    return writer.count
 
 
 def compress_label(label):
@@ -0,0 +1,186 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+import sys
+import time
+
+import click
+import tensorflow as tf
+
+from gesturelearner import checkpointing, data, evaluation, graph, weights
+from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH, NUM_LABEL_INDEXES
+import protobuf.touches_pb2 as touches_pb2
+
+
+@click.command()
+@click.argument('test-file')
+@click.option('--model', default='model.ckpt', help='The model_out of the train.py run to follow.')
+@click.option('--metrics-log', help='The file to append results to. Defaults to the model name + .metrics.jsonl.')
+@click.option('--batch-size', default=500)
+@click.option('--poll-interval', default=5.0, help='Seconds between checks for a new checkpoint.')
+@click.option('--once', is_flag=True, help='Evaluate the checkpoints that haven\'t been scored yet and exit.')
+def main(test_file, model, metrics_log, batch_size, poll_interval, once):
+    """Score each checkpoint train.py saves on the test set, in a separate process from training."""
+    if metrics_log is None:
+        metrics_log = model + '.metrics.jsonl'
+
+    test_images, test_labels = data.read_test_file(test_file)
+    label_names = [touches_pb2.Label.Name(value) for value in touches_pb2.Label.values()]
+
+    directory = os.path.dirname(os.path.abspath(model))
+
+    # The checkpoints already scored, with the time they were scored. A checkpoint written after that (train.py
+    # rewrites the same path without --async-checkpoints) is scored again.
+    scored = load_scored(metrics_log)
+
+    # A network for each shape of checkpoint seen, since train.py can follow a factorized (factorize.py) or pruned
+    # (prune.py) model.
+    networks = {}
+
+    try:
+        while True:
+            versions = checkpoint_versions(directory)
+
+            # Oldest first, so that no checkpoint is skipped when several were saved since the last poll.
+            for path, mtime in versions:
+                if path in scored and mtime <= scored[path]:
+                    continue
+
+                try:
+                    network_options = weights.checkpoint_network_options(path)
+                    key = tuple(sorted(network_options.items()))
+
+                    if key not in networks:
+                        networks[key] = build_network(network_options, test_images, test_labels, batch_size)
+
+                    result, step, latency = evaluate_checkpoint(networks[key], path)
+                except (tf.errors.NotFoundError, tf.errors.DataLossError, tf.errors.InvalidArgumentError) as e:
+                    # The checkpoint is being rewritten (or was just deleted). Try again at the next poll.
+                    print('Could not read checkpoint "%s": %s' % (path, e.message), file=sys.stderr)
+                else:
+                    scored[path] = mtime
+                    append_result(metrics_log, path, step, result, latency, label_names)
+                    print('step %d, testing accuracy %g, testing loss %g (%.2f s)'
+                          % (step, result.accuracy, result.loss, latency))
+                    sys.stdout.flush()
+
+            if once:
+                if len(versions) == 0:
+                    print('Couldn\'t find a checkpoint in "%s".' % directory, file=sys.stderr)
+                return
+
+            time.sleep(poll_interval)
+    finally:
+        for network in networks.values():
+            network['sess'].close()
+
+
+def build_network(network_options, test_images, test_labels, batch_size):
+    """Build the network with the given make_network options and its evaluator in a new graph and session."""
+    with tf.Graph().as_default() as network_graph:
+        images_input = tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        labels_input = tf.placeholder(tf.float32, [None, NUM_LABEL_INDEXES])
+        predicted_labels, variables = graph.make_network(images_input, **network_options)
+        global_step = tf.train.get_or_create_global_step()
+
+        evaluator = evaluation.Evaluator(images_input, labels_input, predicted_labels, test_images, test_labels,
+                                         batch_size)
+
+        sess = tf.Session(graph=network_graph)
+        sess.run(tf.local_variables_initializer())
+
+    return {'sess': sess, 'evaluator': evaluator, 'variables': variables, 'global_step': global_step}
+
+
+def checkpoint_versions(directory):
+    """Return the path and modification time of each checkpoint recorded in directory's checkpoint state file, oldest
+    first.
+
+    train.py saves to the same path every time without --async-checkpoints, so the path alone doesn't tell whether
+    the checkpoint changed.
+    """
+    state = tf.train.get_checkpoint_state(directory)
+
+    if state is None or not state.model_checkpoint_path:
+        return []
+
+    paths = list(state.all_model_checkpoint_paths)
+
+    if state.model_checkpoint_path not in paths:
+        paths.append(state.model_checkpoint_path)
+
+    versions = []
+
+    for path in paths:
+        if not os.path.isabs(path):
+            path = os.path.join(directory, path)
+
+        try:
+            versions.append((path, os.path.getmtime(path + '.index')))
+        except OSError:
+            # Deleted by checkpoint retention.
+            pass
+
+    return versions
+
+
+def load_scored(metrics_log):
+    """Return the checkpoints in metrics_log and the last time each was scored, so a restarted evaluate.py doesn't
+    score them again."""
+    scored = {}
+
+    try:
+        with open(metrics_log) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                scored[entry['checkpoint']] = max(scored.get(entry['checkpoint'], 0), entry['time'])
+    except (IOError, OSError):
+        pass
+
+    return scored
+
+
+def evaluate_checkpoint(network, checkpoint):
+    """Restore the checkpoint into a network made by build_network and evaluate it. Returns the EvaluationResult, the
+    global step and the latency."""
+    start = time.time()
+    sess = network['sess']
+
+    with sess.graph.as_default():
+        # Checkpoints without a global step count as step 0.
+        sess.run(network['global_step'].initializer)
+        checkpointing.restore(sess, checkpoint)
+
+        result = network['evaluator'].evaluate(sess, {network['variables']['keep_prob']: 1.0})
+
+    return result, int(sess.run(network['global_step'])), time.time() - start
+
+
+def append_result(metrics_log, checkpoint, step, result, latency, label_names):
+    recall = result.recall()
+    counts = result.confusion_matrix.sum(axis=1)
+
+    line = {
+        'time': time.time(),
+        'checkpoint': checkpoint,
+        'step': step,
+        'accuracy': float(result.accuracy),
+        'loss': float(result.loss),
+        'recall': dict((label_names[i], float(recall[i])) for i in range(len(label_names)) if counts[i] > 0),
+        'latency': latency,
+        'examples': int(counts.sum())
+    }
+
+    with open(metrics_log, 'a') as f:
+        f.write(json.dumps(line, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
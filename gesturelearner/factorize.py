@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+import click
+import numpy as np
+
+from gesturelearner import checkpointing, data, fine_tuning, graph, inference, weights
+
+
+@click.command()
+@click.argument('model-in')
+@click.argument('training-file')
+@click.argument('test-file')
+@click.option('--ranks', default='32,64,128,256', help='Comma-separated ranks to factorize fc1 to.')
+@click.option('--fc2-rank', type=int, help='Also factorize fc2 to this rank.')
+@click.option('--fine-tune-steps', default=1000)
+@click.option('--learning-rate', default=1e-5)
+@click.option('--batch-size', default=50)
+@click.option('--eval-batch-size', default=500)
+@click.option('--out-dir', default='.', help='Where to save the factorized checkpoints and Core ML models.')
+@click.option('--protobuf', is_flag=True,
+              help='Write the Core ML models with save_mlmodel_using_protobuf instead of coremltools\' builder.')
+@click.option('--repeats', default=200, help='Single images classified for measuring latency.')
+def main(model_in, training_file, test_file, ranks, fc2_rank, fine_tune_steps, learning_rate, batch_size,
+         eval_batch_size, out_dir, protobuf, repeats):
+    """Factorize the fc1 weights of a model into two thin matrices at each rank, fine-tune and compare.
+
+    Each factorized model is saved as OUT_DIR/model-rankR.ckpt and OUT_DIR/model-rankR.mlmodel. The table compares
+    their parameters, Core ML model size, test accuracy before and after fine-tuning, and latency with the NumPy
+    engine.
+    """
+    checkpoint = checkpointing.latest(model_in)
+
+    if checkpoint is None:
+        print('Couldn\'t find model "%s".' % model_in, file=sys.stderr)
+        return
+
+    model_weights = weights.load_checkpoint(checkpoint)
+
+    if any(rank is not None for rank in weights.ranks(model_weights)):
+        print('"%s" is already factorized.' % checkpoint, file=sys.stderr)
+        return
+
+    test_images, test_labels = data.read_test_file(test_file)
+    label_indexes = np.argmax(test_labels, 1)
+    save = graph.save_mlmodel_using_protobuf if protobuf else graph.save_mlmodel
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    def describe(name, variant_weights, accuracy_before, accuracy_after):
+        mlmodel_file = os.path.join(out_dir, 'model-%s.mlmodel' % name)
+        save(mlmodel_file, variant_weights)
+
+        network = inference.Network(variant_weights, eval_batch_size)
+        latency, _ = inference.measure_speed(network.predict, test_images, eval_batch_size, repeats)
+
+        if accuracy_after is None:
+            accuracy_after = np.mean(np.argmax(network.predict(test_images), 1) == label_indexes)
+
+        return (name, weights.parameter_count(variant_weights), os.path.getsize(mlmodel_file), accuracy_before,
+                accuracy_after, latency)
+
+    rows = [describe('full', model_weights, None, None)]
+
+    for rank in [int(rank) for rank in ranks.split(',')]:
+        factorized = weights.factorize_weights(model_weights, rank, fc2_rank)
+        name = 'rank%d' % rank
+
+        factorized, accuracy_before, accuracy_after = fine_tuning.fine_tune(
+            factorized, training_file, test_images, test_labels, fine_tune_steps, learning_rate, batch_size,
+            eval_batch_size, os.path.join(out_dir, 'model-%s.ckpt' % name))
+        print('rank %d: testing accuracy %g after factorizing, %g after fine-tuning'
+              % (rank, accuracy_before, accuracy_after))
+
+        rows.append(describe(name, factorized, accuracy_before, accuracy_after))
+
+    full_accuracy, full_latency = rows[0][4], rows[0][5]
+    full_size = rows[0][2]
+
+    print()
+    print('%-8s %10s %10s %8s %10s %10s %9s %12s %8s'
+          % ('model', 'params', 'size (KB)', 'smaller', 'factorized', 'fine-tuned', 'delta', 'latency (ms)',
+             'speedup'))
+
+    for name, parameters, size, accuracy_before, accuracy_after, latency in rows:
+        before = '%10.4f' % accuracy_before if accuracy_before is not None else '%10s' % '-'
+        print('%-8s %10d %10.0f %7.1fx %s %10.4f %+9.4f %12.2f %7.2fx'
+              % (name, parameters, size / 1024., full_size / float(size), before, accuracy_after,
+                 accuracy_after - full_accuracy, 1000. * latency, full_latency / latency))
+
+
+if __name__ == '__main__':
+    main()
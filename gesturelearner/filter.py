@@ -3,11 +3,12 @@ from __future__ import division
 from __future__ import print_function
 
 import os
-import random
 import sys
 
 import click
+import numpy as np
 
+from gesturelearner import dedup, label_index, records
 import protobuf.touches_pb2 as touches_pb2
 
 
@@ -19,81 +20,205 @@ import protobuf.touches_pb2 as touches_pb2
 @click.option('--test-fraction', default=0, type=float)
 @click.option('--exclude-with-label', type=int, multiple=True)
 @click.option('--include-with-label', type=int, multiple=True)
-def main(in_file, out_file, merge_file, shuffle, test_fraction, exclude_with_label, include_with_label):
+@click.option('--out-format', type=click.Choice(records.FORMATS), default='trainingset',
+              help='"framed" writes records as they pass the filter, so readers can start before filtering ends.')
+@click.option('--dedup-index', help='Directory of a persistent index of seen records. Records of the merge-file '
+                                    'already in it (or in the in-file) are dropped.')
+@click.option('--near-duplicate-distance', default=0,
+              help='Also drop merged records whose perceptual hash is within this many bits of a seen record with the '
+                   'same label. 0 only drops exact duplicates.')
+@click.option('--stratify/--no-stratify', default=False, help='Take the test fraction of each label separately.')
+@click.option('--stats', is_flag=True, help='Only print the number of images with each label.')
+@click.option('--verify-index', is_flag=True, help='Check the label indexes against a checksum of the whole file '
+                                                   'rather than its size, modification time and first and last blocks.')
+def main(in_file, out_file, merge_file, shuffle, test_fraction, exclude_with_label, include_with_label, out_format,
+         dedup_index, near_duplicate_distance, stratify, stats, verify_index):
     if out_file is None:
         [file_name, extension] = os.path.splitext(in_file)
+
+        if out_format == 'framed':
+            extension = '.framed'
+
         out_file = file_name + "_filtered" + extension
 
     if len(exclude_with_label) > 0 and len(include_with_label) > 0:
         print('Cannot specify both --exclude-with-label and --include-with-label.', file=sys.stderr)
         return
 
+    # Records are never loaded. They are tracked by (source, offset) pairs and copied straight from the mapped input
+    # files to the output files.
     try:
-        f = open(in_file, 'rb')
-        training_set = touches_pb2.TrainingSet()
-        training_set.ParseFromString(f.read())
-        f.close()
+        sources = [records.open_records(in_file)]
     except FileNotFoundError:
         print('Could not find in-file "' + in_file + '"', file=sys.stderr)
         return
 
-    images = [image for image in training_set.labelledImages]
-    print('Loaded %s images from in-file.' % len(images))
-
     if merge_file is not None:
         try:
-            f = open(merge_file, 'rb')
-            merge_set = touches_pb2.TrainingSet()
-            merge_set.ParseFromString(f.read())
-            f.close()
-
-            images_before_merge = len(images)
-            images.extend([image for image in merge_set.labelledImages])
-            print('Merged %s images from "%s" with %s from "%s" for a total of %s.'
-                  % (images_before_merge, in_file, len(images) - images_before_merge, merge_file, len(images)))
-
+            sources.append(records.open_records(merge_file))
         except FileNotFoundError:
             print('Could not find merge-file "' + merge_file + '"', file=sys.stderr)
             return
 
-    filtered_images = []
+    if stats:
+        for source in sources:
+            print_stats(source.file_name, label_index.load_or_build(source.file_name, source, verify_index))
+            source.close()
+
+        return
+
+    def is_kept(label):
+        if len(exclude_with_label) > 0 and label in exclude_with_label:
+            return False
+
+        if len(include_with_label) > 0 and (not label in include_with_label):
+            return False
+
+        return True
+
+    test_fraction = max(0, min(test_fraction, 1))
+
+    # Without shuffling or a test set, the output is just the filtered input in order, so it can be written in a
+    # single pass as records are read.
+    if not shuffle and test_fraction == 0 and dedup_index is None:
+        stream_examples(sources, is_kept, out_file, out_format, verify_index)
+
+        for source in sources:
+            source.close()
+
+        return
+
+    # The label indexes give the offsets of the records with the wanted labels, so only those records are read.
+    index = label_index.load_or_build(in_file, sources[0], verify_index)
+    offsets, labels = index.offsets, index.labels
+    source_indexes = np.zeros(len(offsets), dtype=np.int64)
+    print('Loaded %s images from in-file.' % len(offsets))
+
+    if merge_file is not None:
+        images_before_merge = len(offsets)
+        merge_index = label_index.load_or_build(merge_file, sources[1], verify_index)
+        merge_offsets, merge_labels = merge_index.offsets, merge_index.labels
+
+        offsets = np.concatenate([offsets, merge_offsets])
+        labels = np.concatenate([labels, merge_labels])
+        source_indexes = np.concatenate([source_indexes, np.ones(len(merge_offsets), dtype=np.int64)])
+        print('Merged %s images from "%s" with %s from "%s" for a total of %s.'
+              % (images_before_merge, in_file, len(offsets) - images_before_merge, merge_file, len(offsets)))
+
+    keep = np.ones(len(offsets), dtype=bool)
+
+    if dedup_index is not None:
+        seen = dedup.DedupIndex(dedup_index, near_duplicate_distance)
+        with_perceptual_hashes = near_duplicate_distance > 0
+        checksums = [index.checksum] + ([merge_index.checksum] if merge_file is not None else [])
+
+        # All records of the in-file are kept; they're only added to the index. Only merged records can be dropped.
+        for source_index, source in enumerate(sources):
+            if seen.has_file(checksums[source_index]):
+                # The records of a file the index already has aren't hashed again.
+                is_new = np.zeros((source_indexes == source_index).sum(), dtype=bool)
+            else:
+                hashes, source_labels, perceptual = dedup.hash_records(source, with_perceptual_hashes)
+                is_new = seen.add(hashes, source_labels, perceptual, checksums[source_index])
 
-    for image in images:
-        if len(exclude_with_label) > 0 and image.label in exclude_with_label:
-            continue
+            if source_index > 0:
+                keep[source_indexes == source_index] = is_new
+                print('Dropped %s images from "%s" that were already seen.' % ((~is_new).sum(), merge_file))
 
-        if len(include_with_label) > 0 and (not image.label in include_with_label):
-            continue
+        seen.save()
+        print('Dedup index "%s" now has %s images.' % (dedup_index, len(seen)))
 
-        filtered_images.append(image)
+    if len(exclude_with_label) > 0:
+        keep &= ~np.isin(labels, exclude_with_label)
 
-    print('Images after exclusion/inclusion: %s' % len(filtered_images))
+    if len(include_with_label) > 0:
+        keep &= np.isin(labels, include_with_label)
+
+    offsets = offsets[keep]
+    labels = labels[keep]
+    source_indexes = source_indexes[keep]
+
+    print('Images after exclusion/inclusion: %s' % len(offsets))
+
+    order = np.arange(len(offsets))
 
     if shuffle:
         print('Shuffling images.')
-        random.shuffle(filtered_images)
+        np.random.shuffle(order)
 
-    test_fraction = max(0, min(test_fraction, 1))
+    example_count = len(offsets)
+
+    if stratify:
+        is_test = np.zeros(example_count, dtype=bool)
+
+        for label in np.unique(labels):
+            label_order = order[labels[order] == label]
+            is_test[label_order[:int(round(len(label_order) * test_fraction))]] = True
 
-    example_count = len(filtered_images)
-    test_example_count = int(round(example_count * test_fraction))
+        test_order = order[is_test[order]]
+        train_order = order[~is_test[order]]
+    else:
+        test_example_count = int(round(example_count * test_fraction))
+        test_order = order[0:test_example_count]
+        train_order = order[test_example_count:]
+
+    test_example_count = len(test_order)
 
     if test_example_count > 0:
         [file_name, extension] = os.path.splitext(out_file)
         test_file = file_name + "_test" + extension
-        save_examples(filtered_images[0:test_example_count], test_file)
+        save_examples(sources, source_indexes, offsets, test_order, test_file, out_format)
         print('Saved %s testing images to "%s".' % (test_example_count, test_file))
 
-    save_examples(filtered_images[test_example_count:], out_file)
+    save_examples(sources, source_indexes, offsets, train_order, out_file, out_format)
     print('Saved %s training images to "%s".' % (example_count - test_example_count, out_file))
 
+    for source in sources:
+        source.close()
+
+
+def save_examples(sources, source_indexes, offsets, order, file_name, out_format):
+    with records.open_writer(file_name, out_format) as writer:
+        for i in order:
+            writer.write_record(sources[source_indexes[i]].record_bytes(int(offsets[i])))
+
+
+def stream_examples(sources, is_kept, file_name, out_format, verify_index=False):
+    read_count = 0
+
+    with records.open_writer(file_name, out_format) as writer:
+        for source in sources:
+            index = label_index.load(source.file_name, verify_index)
+
+            if index is not None:
+                # Seek to the wanted records rather than reading all of them.
+                read_count += len(index)
+                kept_labels = [label for label in index.label_values.tolist() if is_kept(label)]
+
+                for offset in index.offsets_for(kept_labels):
+                    writer.write_record(source.record_bytes(int(offset)))
+
+                continue
+
+            for offset, label, _, _, _ in source:
+                read_count += 1
+
+                if is_kept(label):
+                    writer.write_record(source.record_bytes(offset))
+
+    print('Read %s images and saved %s of them to "%s".' % (read_count, writer.count, file_name))
+
+
+def print_stats(file_name, index):
+    print('%s: %s images' % (file_name, len(index)))
+
+    for label, count in sorted(index.counts().items()):
+        try:
+            name = touches_pb2.Label.Name(label)
+        except ValueError:
+            name = 'unknown'
 
-def save_examples(labelled_images, file_name):
-    f = open(file_name, 'wb')
-    training_set = touches_pb2.TrainingSet()
-    training_set.labelledImages.extend(labelled_images)
-    f.write(training_set.SerializeToString())
-    f.close()
+        print('  %3d %-20s %8d' % (label, name, count))
 
 
 if __name__ == '__main__':
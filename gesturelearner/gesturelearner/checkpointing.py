@@ -0,0 +1,255 @@
+"""Reading, restoring and writing the checkpoints of train.py.
+
+CheckpointWriter saves checkpoints from a background thread. save() copies the values of the variables out of the
+training session, which only takes as long as a memory copy, and a thread writes them to disk while training
+continues. The thread has its own graph and session, with a variable for each of the training graph's variables
+(saved under the same names), so the checkpoints are ordinary TensorFlow checkpoints.
+
+Each checkpoint is written to a temporary prefix and renamed into place, data files first and index last, and only
+then recorded in the directory's checkpoint state file. A crash can leave temporary files behind but never a
+half-written checkpoint under a real name.
+"""
+import glob
+import json
+import os
+import threading
+import weakref
+
+import tensorflow as tf
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def checkpoint_variable_names(checkpoint):
+    return set(tf.train.NewCheckpointReader(checkpoint).get_variable_to_shape_map().keys())
+
+
+# The Savers of restore for each graph, by the names of the variables they restore.
+_restore_savers = weakref.WeakKeyDictionary()
+
+
+def restore(sess, checkpoint, var_list=None):
+    """Restore the variables of var_list (by default all global variables) that the checkpoint has.
+
+    Checkpoints written before a variable was added to the graph (e.g. the global step) can still be restored; the
+    missing variables keep their initial values. Returns the names of the variables that weren't restored.
+
+    A Saver adds ops to the graph, so the Saver for each set of variables is made once and reused by later calls, e.g.
+    for every checkpoint evaluate.py scores.
+    """
+    if var_list is None:
+        var_list = tf.global_variables()
+
+    names = checkpoint_variable_names(checkpoint)
+    restored = [variable for variable in var_list if variable.op.name in names]
+
+    savers = _restore_savers.setdefault(sess.graph, {})
+    key = tuple(sorted(variable.op.name for variable in restored))
+
+    if key not in savers:
+        savers[key] = tf.train.Saver(restored)
+
+    savers[key].restore(sess, checkpoint)
+
+    return sorted(variable.op.name for variable in var_list if variable.op.name not in names)
+
+
+def training_position(checkpoint):
+    """Return the global step and data seed saved in a checkpoint by train.py.
+
+    The step is 0 and the seed None if there is no checkpoint or it doesn't have them. This reads the checkpoint
+    directly, so it can be used before the training graph (whose input pipeline depends on both) is built.
+    """
+    if checkpoint is None:
+        return 0, None
+
+    reader = tf.train.NewCheckpointReader(checkpoint)
+    step = int(reader.get_tensor('global_step')) if reader.has_tensor('global_step') else 0
+    seed = int(reader.get_tensor('data_seed')) if reader.has_tensor('data_seed') else None
+
+    return step, seed
+
+
+def latest(model):
+    """Return the checkpoint to restore for model: the newer of model itself and its latest numbered checkpoint
+    (model-STEP), as saved with and without --async-checkpoints.
+
+    The newer one has the higher global step or, for equal steps, was written last. Returns None if there is neither.
+    """
+    candidates = []
+
+    if tf.train.checkpoint_exists(model):
+        candidates.append(model)
+
+    state = tf.train.get_checkpoint_state(os.path.dirname(os.path.abspath(model)))
+
+    if state is not None and os.path.basename(state.model_checkpoint_path).startswith(os.path.basename(model) + '-') \
+            and tf.train.checkpoint_exists(state.model_checkpoint_path):
+        candidates.append(state.model_checkpoint_path)
+
+    if len(candidates) == 0:
+        return None
+
+    return max(candidates, key=lambda checkpoint: (training_position(checkpoint)[0], modification_time(checkpoint)))
+
+
+def modification_time(checkpoint):
+    times = [os.path.getmtime(file_name) for file_name in checkpoint_files(checkpoint)]
+    return max(times) if times else 0
+
+
+def checkpoint_files(prefix):
+    return glob.glob(prefix + '.data-*') + glob.glob(prefix + '.index') + glob.glob(prefix + '.meta')
+
+
+class CheckpointWriter(object):
+    def __init__(self, model, keep_last=5, keep_best=True):
+        """Write checkpoints named model-STEP, keeping the last keep_last and, if keep_best, the most accurate one.
+
+        The accuracies used to pick the best checkpoint are kept in model.checkpoints.json, so retention carries on
+        across runs.
+        """
+        # The checkpoint state file is easiest to get right with absolute paths.
+        self.model = os.path.abspath(model)
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.directory = os.path.dirname(self.model)
+
+        self._history_file = self.model + '.checkpoints.json'
+        self._history = self._load_history()
+
+        self._variables = None
+        self._graph = None
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name='CheckpointWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _load_history(self):
+        try:
+            with open(self._history_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def save(self, sess, step, accuracy=None, var_list=None):
+        """Snapshot the variables of var_list (by default all global variables) and queue them for writing.
+
+        accuracy is the test accuracy of the model at this step, if known. This only blocks if two snapshots are
+        already waiting to be written.
+        """
+        self._check_error()
+
+        if var_list is None:
+            var_list = tf.global_variables()
+
+        if self._variables is None:
+            self._variables = dict((variable.op.name, variable) for variable in var_list)
+
+        names = sorted(self._variables)
+        values = sess.run([self._variables[name] for name in names])
+
+        self._queue.put((step, accuracy, dict(zip(names, values))))
+
+    def close(self):
+        """Wait for the queued checkpoints to be written."""
+        self._queue.put(None)
+        self._thread.join()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _check_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+
+            if item is None:
+                return
+
+            if self._error is not None:
+                continue
+
+            try:
+                self._write(*item)
+            except Exception as e:
+                self._error = e
+
+    def _build_graph(self, values):
+        self._graph = tf.Graph()
+
+        with self._graph.as_default():
+            self._placeholders = {}
+            assignments = []
+            saved_variables = {}
+
+            for i, name in enumerate(sorted(values)):
+                value = values[name]
+                placeholder = tf.placeholder(tf.as_dtype(value.dtype), value.shape)
+                variable = tf.Variable(tf.zeros(value.shape, tf.as_dtype(value.dtype)), name='snapshot_%d' % i)
+
+                self._placeholders[name] = placeholder
+                assignments.append(tf.assign(variable, placeholder))
+                saved_variables[name] = variable
+
+            self._assign_op = tf.group(*assignments)
+            self._saver = tf.train.Saver(saved_variables, max_to_keep=None)
+
+        self._session = tf.Session(graph=self._graph)
+
+    def _write(self, step, accuracy, values):
+        if self._graph is None:
+            self._build_graph(values)
+
+        prefix = '%s-%d' % (self.model, step)
+        temporary_prefix = prefix + '.tmp'
+
+        self._session.run(self._assign_op, dict((self._placeholders[name], values[name]) for name in values))
+        self._saver.save(self._session, temporary_prefix, write_meta_graph=False, write_state=False)
+
+        # Readers look for the index, so it's renamed last.
+        data_files = glob.glob(temporary_prefix + '.data-*')
+        for file_name in data_files:
+            os.rename(file_name, prefix + file_name[len(temporary_prefix):])
+        os.rename(temporary_prefix + '.index', prefix + '.index')
+
+        self._history = [entry for entry in self._history if entry['path'] != prefix]
+        self._history.append({'path': prefix, 'step': step, 'accuracy': accuracy})
+        self._apply_retention(prefix)
+
+    def _apply_retention(self, latest_prefix):
+        kept = set(entry['path'] for entry in self._history[-self.keep_last:])
+
+        if self.keep_best:
+            scored = [entry for entry in self._history if entry['accuracy'] is not None]
+
+            if scored:
+                kept.add(max(scored, key=lambda entry: (entry['accuracy'], entry['step']))['path'])
+
+        removed = [entry for entry in self._history if entry['path'] not in kept]
+        self._history = [entry for entry in self._history if entry['path'] in kept]
+
+        tf.train.update_checkpoint_state(self.directory, latest_prefix,
+                                         [entry['path'] for entry in self._history])
+
+        temporary_file = self._history_file + '.tmp'
+        with open(temporary_file, 'w') as f:
+            json.dump(self._history, f, indent=2)
+        os.rename(temporary_file, self._history_file)
+
+        # Files are only deleted once the state file no longer lists them.
+        for entry in removed:
+            for file_name in checkpoint_files(entry['path']):
+                os.remove(file_name)
@@ -5,3 +5,6 @@ IMAGE_HEIGHT = 45
 IMAGE_WIDTH = 45
 
 NUM_LABEL_INDEXES = len(touches_pb2.Label.values())
+
+# The number of filters of each convolutional layer of the network (before pruning).
+CONV_CHANNELS = (32, 64, 64)
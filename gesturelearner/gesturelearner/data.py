@@ -0,0 +1,250 @@
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+
+from . import packed, stroke_augmentation
+from .constants import *
+
+
+def decode_example(serialized_example):
+    """Decode one serialized tf.train.Example into a normalized image and a one-hot label."""
+    features = tf.parse_single_example(
+      serialized_example,
+      features={
+        'height': tf.FixedLenFeature([], tf.int64),
+        'width': tf.FixedLenFeature([], tf.int64),
+        'label': tf.FixedLenFeature([], tf.int64),
+        'image': tf.FixedLenFeature([], tf.string)
+    })
+
+    height = tf.cast(features['height'], tf.int32)
+    width = tf.cast(features['width'], tf.int32)
+    label = tf.cast(features['label'], tf.int64)
+    image = tf.decode_raw(features['image'], tf.uint8)
+
+    label_index = tf.reshape(label, [1, 1])
+
+    sparse_tensor = tf.SparseTensor(label_index, [1.0], [NUM_LABEL_INDEXES])
+    label = tf.sparse_tensor_to_dense(sparse_tensor)
+
+    image = tf.cast(image, tf.float32)
+    image = image * (1. / 255) - 0.5
+    image = tf.reshape(image, [height, width, 1])
+
+    resized_image = tf.image.resize_image_with_crop_or_pad(
+        image=image,
+        target_height=IMAGE_HEIGHT,
+        target_width=IMAGE_WIDTH
+    )
+
+    return resized_image, label
+
+
+def expand_file_pattern(pattern):
+    """Return the sorted list of files matching a glob such as "data-*-of-00008.tfrecords"."""
+    file_names = sorted(tf.gfile.Glob(pattern))
+
+    if len(file_names) == 0:
+        raise ValueError('No files match "%s".' % pattern)
+
+    return file_names
+
+
+def read_test_file(file_pattern):
+    """Decode the test set once into stacked arrays of normalized images and one-hot labels."""
+    images, label_indexes = read_image_arrays(file_pattern)
+
+    return packed.normalize_images(images), packed.one_hot(label_indexes)
+
+
+def read_image_arrays(file_pattern, limit=None):
+    """Decode all the examples (or the first limit of them) into a (count, height, width) uint8 array of images and an
+    array of label indexes."""
+    file_names = expand_file_pattern(file_pattern)
+
+    if packed.is_packed_file(file_names[0]):
+        packed_dataset = packed.PackedDataset(file_names[0])
+        return (np.array(packed_dataset.images[:limit]),
+                np.array(packed_dataset.label_indexes[:limit], dtype=np.int64))
+
+    images = []
+    label_indexes = []
+
+    for string_record in (record for file_name in file_names
+                          for record in tf.python_io.tf_record_iterator(path=file_name)):
+        example = tf.train.Example()
+        example.ParseFromString(string_record)
+
+        height = int(example.features.feature['height'].int64_list.value[0])
+        width = int(example.features.feature['width'].int64_list.value[0])
+        label_indexes.append(example.features.feature['label'].int64_list.value[0])
+        image = np.frombuffer(example.features.feature['image'].bytes_list.value[0], dtype=np.uint8)
+
+        images.append(packed.crop_or_pad(image.reshape(height, width), IMAGE_HEIGHT, IMAGE_WIDTH))
+
+        if limit is not None and len(images) == limit:
+            break
+
+    if len(images) == 0:
+        return np.zeros((0, IMAGE_HEIGHT, IMAGE_WIDTH), dtype=np.uint8), np.zeros(0, dtype=np.int64)
+
+    return np.stack(images), np.array(label_indexes, dtype=np.int64)
+
+
+def read(file_name_queue):
+    reader = tf.TFRecordReader()
+
+    _, serialized_example = reader.read(file_name_queue)
+
+    return decode_example(serialized_example)
+
+
+def queue_input(file_names, batch_size=50):
+    """The original input path: a queue runner filling a shuffle_batch queue.
+
+    The batches have to be fetched into Python and fed back to the network.
+    """
+    images, labels = read(tf.train.string_input_producer(file_names))
+
+    images, labels = tf.train.shuffle_batch(
+        [images, labels],
+         batch_size=batch_size,
+         capacity=200,
+         num_threads=2,
+         min_after_dequeue=0
+    )
+
+    return images, labels
+
+
+def augment(dataset, augmenter, num_parallel_calls=None):
+    """Run an image_augmentation.ImageAugmenter over the batches of a dataset of (images, labels) batches.
+
+    The NumPy augmentation runs in tf.data's own threads, so it overlaps with the training step.
+    """
+    if num_parallel_calls is None:
+        num_parallel_calls = multiprocessing.cpu_count()
+
+    def augment_batch(images, labels):
+        images = tf.py_func(augmenter.augment, [images], tf.float32, stateful=True)
+        images.set_shape([None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        return images, labels
+
+    return dataset.map(augment_batch, num_parallel_calls=num_parallel_calls)
+
+
+def dataset_input(file_names, batch_size=50, shuffle_buffer=1000, cache=None, num_parallel_calls=None,
+                  prefetch_batches=2, augmenter=None, seed=None, skip_batches=0, num_shards=1, shard_index=0):
+    """Build a tf.data pipeline and return the (images, labels) tensors of its next batch.
+
+    The tensors can be connected directly to the network, so that batches never pass through Python.
+
+    cache is None for no caching, 'memory' to keep the decoded images in memory after the first epoch or the path of
+    a file to keep them on disk (which persists across runs). augmenter is an optional
+    image_augmentation.ImageAugmenter applied to every batch.
+
+    With a seed, the examples come in the same order every time, and skip_batches resumes from a later batch. The
+    skipped examples still have to be read and decoded, but not augmented or trained on.
+
+    With num_shards > 1, only the shard_index-th of num_shards disjoint parts of the examples is read: whole files if
+    there are enough of them, every num_shards-th record otherwise.
+    """
+    if num_parallel_calls is None:
+        num_parallel_calls = multiprocessing.cpu_count()
+
+    shard_records = num_shards > 1 and len(file_names) < num_shards
+
+    if num_shards > 1 and not shard_records:
+        file_names = file_names[shard_index::num_shards]
+
+    if len(file_names) == 1:
+        dataset = tf.data.TFRecordDataset(file_names)
+    else:
+        # Read several shards at once, taking records from whichever is ready first. That makes the order
+        # nondeterministic, so not with a seed, and neither when records are split between readers, which all have to
+        # see the same order.
+        deterministic = seed is not None or shard_records
+        dataset = tf.data.Dataset.from_tensor_slices(file_names)
+
+        if not shard_records:
+            dataset = dataset.shuffle(len(file_names), seed=seed)
+
+        dataset = dataset.apply(tf.contrib.data.parallel_interleave(
+            tf.data.TFRecordDataset, cycle_length=min(len(file_names), num_parallel_calls), sloppy=not deterministic))
+
+    if shard_records:
+        dataset = dataset.shard(num_shards, shard_index)
+
+    dataset = dataset.map(decode_example, num_parallel_calls=num_parallel_calls)
+
+    # Caching comes before shuffling so that the cache holds each decoded image once, and the order still changes
+    # every epoch.
+    if cache == 'memory':
+        dataset = dataset.cache()
+    elif cache is not None:
+        dataset = dataset.cache(cache)
+
+    if shuffle_buffer > 1:
+        dataset = dataset.shuffle(shuffle_buffer, seed=seed)
+
+    dataset = dataset.repeat()
+
+    if skip_batches > 0:
+        dataset = dataset.skip(skip_batches * batch_size)
+
+    dataset = dataset.batch(batch_size)
+
+    if augmenter is not None:
+        dataset = augment(dataset, augmenter, num_parallel_calls)
+
+    dataset = dataset.prefetch(prefetch_batches)
+
+    return dataset.make_one_shot_iterator().get_next()
+
+
+def packed_input(file_name, batch_size=50, prefetch_batches=2, augmenter=None, seed=None, skip_batches=0):
+    """Like dataset_input, but for a packed file (see packed.py).
+
+    Batches are gathered from the memory-mapped file with one vectorized read each, so there is nothing to decode.
+    Skipped batches cost nothing, since the position of any batch can be computed directly.
+    """
+    packed_dataset = packed.PackedDataset(file_name)
+
+    # The generator only runs once the graph does, so an empty file is reported here instead.
+    if len(packed_dataset) == 0:
+        raise ValueError('"%s" has no images.' % file_name)
+
+    dataset = tf.data.Dataset.from_generator(
+        lambda: packed_dataset.batches(batch_size, seed=seed, start_batch=skip_batches),
+        (tf.float32, tf.float32),
+        (tf.TensorShape([None, IMAGE_HEIGHT, IMAGE_WIDTH, 1]), tf.TensorShape([None, NUM_LABEL_INDEXES]))
+    )
+
+    if augmenter is not None:
+        dataset = augment(dataset, augmenter)
+
+    dataset = dataset.prefetch(prefetch_batches)
+
+    return dataset.make_one_shot_iterator().get_next()
+
+
+def drawings_input(file_name, batch_size=50, workers=None, prefetch_batches=2, augmenter=None, seed=None,
+                   skip_batches=0):
+    """Like dataset_input, but for a RawDataSet of raw drawings (a .dataset file).
+
+    Every batch is made of new, randomly augmented images of the drawings (see stroke_augmentation.py), rasterized by
+    a pool of worker processes.
+    """
+    dataset = tf.data.Dataset.from_generator(
+        lambda: stroke_augmentation.parallel_batches(file_name, batch_size, workers, seed, skip_batches),
+        (tf.float32, tf.float32),
+        (tf.TensorShape([None, IMAGE_HEIGHT, IMAGE_WIDTH, 1]), tf.TensorShape([None, NUM_LABEL_INDEXES]))
+    )
+
+    if augmenter is not None:
+        dataset = augment(dataset, augmenter)
+
+    dataset = dataset.prefetch(prefetch_batches)
+
+    return dataset.make_one_shot_iterator().get_next()
@@ -0,0 +1,231 @@
+"""A persistent index of the records already in a data set, for deduplicating merges.
+
+Records are identified by a 64-bit hash of their label, size and pixels. The index is stored as a directory of .npy
+files holding sorted uint64 arrays, so lookups are vectorized binary searches and tens of millions of records take a
+few hundred megabytes at most, without any per-record Python objects.
+
+In near-duplicate mode the index also stores a 64-bit perceptual hash of each image: the bits say which cells of an
+8x8 grid over the image are brighter than average. Two records of the same label whose perceptual hashes differ in at
+most max_distance bits count as duplicates. Such pairs are found by splitting the hash into max_distance + 1 bands:
+by the pigeonhole principle at least one band must match exactly, so only records sharing a band are compared.
+
+The index also keeps the checksums of the files whose records were all added to it, so merging into the same in-file
+again doesn't need to hash its records.
+"""
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+from .constants import *
+from .packed import crop_or_pad
+
+
+PERCEPTUAL_HASH_GRID = 8
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def record_hash(label, height, width, values):
+    digest = hashlib.blake2b(struct.pack('<qii', label, height, width), digest_size=8)
+    digest.update(values)
+    return struct.unpack('<Q', digest.digest())[0]
+
+
+def perceptual_hashes(images):
+    """Return the perceptual hashes of a (count, IMAGE_HEIGHT, IMAGE_WIDTH) array of images as uint64."""
+    edges_y = np.linspace(0, images.shape[1], PERCEPTUAL_HASH_GRID + 1).astype(int)[:-1]
+    edges_x = np.linspace(0, images.shape[2], PERCEPTUAL_HASH_GRID + 1).astype(int)[:-1]
+
+    # Sum the pixels of each grid cell. The cells differ in size by at most a pixel, which doesn't matter here.
+    cells = np.add.reduceat(images.astype(np.uint32), edges_y, axis=1)
+    cells = np.add.reduceat(cells, edges_x, axis=2).reshape(len(images), -1)
+
+    bits = cells > cells.mean(axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view('>u8').astype(np.uint64).ravel()
+
+
+def hash_records(scanned_images, with_perceptual_hashes=False, chunk_size=10000):
+    """Return the record hashes, labels and (optionally) perceptual hashes of scanned records as arrays.
+
+    The records are gathered chunk_size at a time into fixed-size arrays, so no per-record Python objects are kept.
+    """
+    chunk_hashes = np.zeros(chunk_size, dtype=np.uint64)
+    chunk_labels = np.zeros(chunk_size, dtype=np.int64)
+    chunk_images = np.zeros((chunk_size, IMAGE_HEIGHT, IMAGE_WIDTH), dtype=np.uint8) if with_perceptual_hashes else None
+
+    hashes = []
+    labels = []
+    perceptual = []
+
+    def add_chunk(count):
+        hashes.append(chunk_hashes[:count].copy())
+        labels.append(chunk_labels[:count].copy())
+
+        if with_perceptual_hashes:
+            perceptual.append(perceptual_hashes(chunk_images[:count]))
+
+    count = 0
+
+    for record in scanned_images:
+        chunk_hashes[count] = record_hash(record.label, record.height, record.width, record.values)
+        chunk_labels[count] = record.label
+
+        if with_perceptual_hashes:
+            image = np.frombuffer(record.values, dtype=np.uint8).reshape(record.height, record.width)
+            chunk_images[count] = crop_or_pad(image, IMAGE_HEIGHT, IMAGE_WIDTH)
+
+        count += 1
+
+        if count == chunk_size:
+            add_chunk(count)
+            count = 0
+
+    add_chunk(count)
+
+    return (np.concatenate(hashes), np.concatenate(labels),
+            np.concatenate(perceptual) if with_perceptual_hashes else None)
+
+
+def popcount(values):
+    """Number of set bits of each value of a uint64 array."""
+    return _POPCOUNT_TABLE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+def _band_keys(perceptual, labels, band, bands):
+    """Combine the label and one band of each perceptual hash into a single sortable key."""
+    band_bits = 64 // bands
+    band_values = (perceptual >> np.uint64(band * band_bits)) & np.uint64((1 << band_bits) - 1)
+    return (labels.astype(np.uint64) << np.uint64(32)) | band_values
+
+
+def _first_near_match(perceptual, labels, reference_perceptual, reference_labels, max_distance, band_orders=None):
+    """For each query, the smallest index of a reference with the same label within max_distance bits, or -1."""
+    bands = max_distance + 1
+    first_match = np.full(len(perceptual), len(reference_perceptual), dtype=np.int64)
+
+    for band in range(bands):
+        reference_keys = _band_keys(reference_perceptual, reference_labels, band, bands)
+
+        if band_orders is None:
+            order = np.argsort(reference_keys, kind='mergesort')
+        else:
+            order = band_orders[band]
+
+        sorted_keys = reference_keys[order]
+        query_keys = _band_keys(perceptual, labels, band, bands)
+
+        starts = np.searchsorted(sorted_keys, query_keys, side='left')
+        counts = np.searchsorted(sorted_keys, query_keys, side='right') - starts
+
+        # Expand every query into (query, candidate) pairs without a Python loop.
+        queries = np.repeat(np.arange(len(perceptual)), counts)
+        candidates = order[np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+
+        distances = popcount(perceptual[queries] ^ reference_perceptual[candidates])
+        close = distances <= max_distance
+        np.minimum.at(first_match, queries[close], candidates[close])
+
+    first_match[first_match == len(reference_perceptual)] = -1
+    return first_match
+
+
+class DedupIndex(object):
+    def __init__(self, directory, max_distance=0):
+        """Open (or create, on save) the index in directory.
+
+        With max_distance > 0, records whose perceptual hashes are within max_distance bits of a record already in the
+        index also count as duplicates.
+        """
+        if max_distance >= 32:
+            raise ValueError('The near-duplicate distance must be less than 32 bits.')
+
+        self.directory = directory
+        self.max_distance = max_distance
+        self._band_orders = None
+
+        self.hashes = self._load('hashes', np.uint64)
+        self.perceptual = self._load('perceptual_hashes', np.uint64)
+        self.labels = self._load('labels', np.int64)
+        self.file_checksums = set(self._load('file_checksums', np.str_, mmap_mode=None).tolist())
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.npy')
+
+    def _load(self, name, dtype, mmap_mode='r'):
+        if os.path.exists(self._path(name)):
+            return np.load(self._path(name), mmap_mode=mmap_mode)
+
+        return np.zeros(0, dtype=dtype)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def has_file(self, file_checksum):
+        """Whether all records of the file with this checksum (see label_index.checksum) were added. None of them
+        would be new."""
+        return file_checksum in self.file_checksums
+
+    def add(self, hashes, labels, perceptual=None, file_checksum=None):
+        """Add records to the index and return a boolean mask of the ones that weren't already in it.
+
+        Of several duplicates within the records themselves, only the first counts as new. perceptual is only needed
+        in near-duplicate mode, where only the perceptual hashes of the new records are added. If the records are all
+        those of a file, pass its checksum so that has_file recognizes it.
+        """
+        is_new = np.zeros(len(hashes), dtype=bool)
+        is_new[np.unique(hashes, return_index=True)[1]] = True
+
+        positions = np.searchsorted(self.hashes, hashes)
+        found = positions < len(self.hashes)
+        found[found] = self.hashes[positions[found]] == hashes[found]
+        is_new &= ~found
+
+        # Every exactly new record goes into the exact index, near duplicates included: they may still be kept (the
+        # records of the in-file always are), and a later run with a smaller distance must recognize them.
+        # Inserting the few new hashes into the sorted index is cheaper than sorting it all again.
+        new_hashes = np.sort(hashes[is_new])
+        self.hashes = np.insert(self.hashes, np.searchsorted(self.hashes, new_hashes), new_hashes)
+
+        if self.max_distance > 0:
+            if len(self.perceptual) > 0:
+                if self._band_orders is None:
+                    self._band_orders = [np.argsort(_band_keys(self.perceptual, self.labels, band,
+                                                               self.max_distance + 1), kind='mergesort')
+                                         for band in range(self.max_distance + 1)]
+
+                is_new &= _first_near_match(perceptual, labels, self.perceptual, self.labels, self.max_distance,
+                                            self._band_orders) < 0
+
+            # Within the new records, keep the first of each group of near duplicates.
+            first_match = _first_near_match(perceptual, labels, perceptual, labels, self.max_distance)
+            is_new &= first_match == np.arange(len(perceptual))
+
+        if self.max_distance > 0:
+            self.perceptual = np.concatenate([self.perceptual, perceptual[is_new]])
+            self.labels = np.concatenate([self.labels, labels[is_new]])
+            self._band_orders = None
+
+        if file_checksum is not None:
+            self.file_checksums.add(file_checksum)
+
+        return is_new
+
+    def save(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        arrays = [('hashes', self.hashes), ('file_checksums', np.array(sorted(self.file_checksums), dtype=np.str_))]
+
+        if self.max_distance > 0 or len(self.perceptual) > 0:
+            arrays += [('perceptual_hashes', self.perceptual), ('labels', self.labels)]
+
+        for name, array in arrays:
+            # Write to a temporary file first so an interrupted save leaves the previous index intact.
+            temporary_path = self._path(name) + '.tmp'
+
+            with open(temporary_path, 'wb') as f:
+                np.save(f, np.ascontiguousarray(array))
+
+            os.rename(temporary_path, self._path(name))
@@ -0,0 +1,73 @@
+"""Evaluate the network on a test set in fixed-size batches.
+
+The test set is decoded once into stacked arrays. Each evaluation feeds it to the network one slice at a time and
+accumulates the accuracy, mean loss and confusion matrix in local (unsaved) variables, so memory use depends on the
+batch size rather than on the size of the test set.
+"""
+import collections
+
+import numpy as np
+import tensorflow as tf
+
+from .constants import *
+
+
+class EvaluationResult(collections.namedtuple('EvaluationResult', ['accuracy', 'loss', 'confusion_matrix'])):
+    """confusion_matrix[i, j] is the number of examples with label index i that were predicted as j."""
+
+    def recall(self):
+        """Return the fraction of the examples of each label index that were predicted correctly (NaN if none)."""
+        counts = self.confusion_matrix.sum(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.diag(self.confusion_matrix) / counts.astype(np.float64)
+
+
+class Evaluator(object):
+    def __init__(self, images_input, labels_input, logits, test_images, test_labels, batch_size=500):
+        """Build the metric ops for a network reading images_input and labels_input.
+
+        test_images and test_labels are the arrays returned by data.read_test_file. images_input and labels_input
+        must be placeholders (or placeholders with defaults) so that slices of them can be fed.
+        """
+        self.images_input = images_input
+        self.labels_input = labels_input
+        self.test_images = test_images
+        self.test_labels = test_labels
+        self.batch_size = batch_size
+
+        with tf.variable_scope('evaluation') as scope:
+            label_indexes = tf.argmax(labels_input, 1)
+            predicted_indexes = tf.argmax(logits, 1)
+            losses = tf.nn.softmax_cross_entropy_with_logits(labels=labels_input, logits=logits)
+
+            self.accuracy, update_accuracy = tf.metrics.accuracy(label_indexes, predicted_indexes)
+            self.loss, update_loss = tf.metrics.mean(losses)
+
+            self.confusion_matrix = tf.Variable(tf.zeros([NUM_LABEL_INDEXES, NUM_LABEL_INDEXES], dtype=tf.int64),
+                                                trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                                                name='confusion_matrix')
+            update_confusion_matrix = tf.assign_add(
+                self.confusion_matrix,
+                tf.confusion_matrix(label_indexes, predicted_indexes, num_classes=NUM_LABEL_INDEXES, dtype=tf.int64))
+
+            self.update_op = tf.group(update_accuracy, update_loss, update_confusion_matrix)
+            self.reset_op = tf.variables_initializer(tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES, scope.name))
+
+    def __len__(self):
+        return len(self.test_labels)
+
+    def evaluate(self, sess, feed_dict=None):
+        """Run the whole test set through the network and return an EvaluationResult.
+
+        feed_dict holds anything else the network needs, e.g. the dropout keep probability.
+        """
+        sess.run(self.reset_op)
+
+        for start in range(0, len(self), self.batch_size):
+            batch_feed = dict(feed_dict or {})
+            batch_feed[self.images_input] = self.test_images[start:start + self.batch_size]
+            batch_feed[self.labels_input] = self.test_labels[start:start + self.batch_size]
+            sess.run(self.update_op, batch_feed)
+
+        return EvaluationResult(*sess.run([self.accuracy, self.loss, self.confusion_matrix]))
@@ -0,0 +1,63 @@
+"""Fine-tune a network whose weights were changed after training, e.g. factorized (see weights.factorize_weights) or
+pruned (see pruning.prune_weights), to recover the accuracy lost in the change.
+
+The network is built with the shapes of the given weights, so the saved checkpoint can be trained further with
+train.py or converted with save_mlmodel.py like any other.
+"""
+import tensorflow as tf
+
+from . import data, evaluation, graph, packed, weights as weights_module
+from .constants import *
+
+
+def fine_tune(model_weights, training_file, test_images, test_labels, steps, learning_rate, batch_size,
+              eval_batch_size, model_out):
+    """Train the network, starting from model_weights, for steps steps and save it to model_out.
+
+    Returns the fine-tuned weights and the test accuracy before and after fine-tuning.
+    """
+    with tf.Graph().as_default():
+        training_files = data.expand_file_pattern(training_file)
+
+        if packed.is_packed_file(training_files[0]):
+            train_images, train_labels = data.packed_input(training_files[0], batch_size)
+        else:
+            train_images, train_labels = data.dataset_input(training_files, batch_size)
+
+        images_input = tf.placeholder_with_default(train_images, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        labels_input = tf.placeholder_with_default(train_labels, [None, NUM_LABEL_INDEXES])
+
+        predicted_labels, variables = graph.make_network(images_input,
+                                                         **weights_module.network_options(model_weights))
+
+        cross_entropy = tf.reduce_mean(
+            tf.nn.softmax_cross_entropy_with_logits(labels=labels_input, logits=predicted_labels))
+        train_step = tf.train.AdamOptimizer(learning_rate).minimize(cross_entropy)
+
+        evaluator = evaluation.Evaluator(images_input, labels_input, predicted_labels, test_images, test_labels,
+                                         eval_batch_size)
+
+        # Only the network's variables, so that the checkpoint can be read by weights.load_checkpoint.
+        names = weights_module.names_of(model_weights)
+        saver = tf.train.Saver([variables[name] for name in names])
+
+        with tf.Session() as sess:
+            sess.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+
+            for name in names:
+                variables[name].load(model_weights[name], sess)
+
+            accuracy_before = float(evaluator.evaluate(sess, {variables['keep_prob']: 1.0}).accuracy)
+
+            for i in range(steps):
+                sess.run(train_step, {variables['keep_prob']: 0.5})
+
+                if (i + 1) % 100 == 0:
+                    print('step %d, training loss %g' % (i + 1, sess.run(cross_entropy, {variables['keep_prob']: 1.0})))
+
+            accuracy_after = float(evaluator.evaluate(sess, {variables['keep_prob']: 1.0}).accuracy)
+
+            saver.save(sess, model_out)
+            print('Saved model in file: %s' % model_out)
+
+            return weights_module.from_variables(sess, variables), accuracy_before, accuracy_after
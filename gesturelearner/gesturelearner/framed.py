@@ -0,0 +1,254 @@
+"""A streaming container for LabelledImage records.
+
+A framed file starts with a 16-byte header, followed by one frame per record: the record's length as a little-endian
+uint32, then the serialized LabelledImage. Closing a writer appends an end marker (a frame length of 0xFFFFFFFF) and,
+optionally, a footer index of every frame's offset so readers can seek to records without scanning.
+
+Unlike a TrainingSet, a framed file can be written one record at a time and read while it is still being written.
+"""
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+from .scanner import ScannedImage, encode_labelled_image, parse_labelled_image
+
+
+MAGIC = b'GLFRAMED'
+VERSION = 1
+HEADER_FORMAT = '<8sI4x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+FRAME_LENGTH_FORMAT = '<I'
+FRAME_LENGTH_SIZE = struct.calcsize(FRAME_LENGTH_FORMAT)
+END_MARKER = 0xFFFFFFFF
+
+# The footer index is a uint64 count, count uint64 frame offsets, then this trailer: the offset of the index and a
+# magic number, so readers can find the index from the end of the file.
+TRAILER_FORMAT = '<Q8s'
+TRAILER_SIZE = struct.calcsize(TRAILER_FORMAT)
+TRAILER_MAGIC = b'GLFRIDX1'
+
+FLUSH_INTERVAL = 1000
+
+
+def is_framed_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class FramedWriter(object):
+    def __init__(self, file_name, write_index=True):
+        self.count = 0
+        self._write_index = write_index
+        self._offsets = [] if write_index else None
+        self._file = open(file_name, 'wb')
+        self._file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION))
+        self._position = HEADER_SIZE
+
+    def write_record(self, record_bytes):
+        if self._write_index:
+            self._offsets.append(self._position)
+
+        self._file.write(struct.pack(FRAME_LENGTH_FORMAT, len(record_bytes)))
+        self._file.write(record_bytes)
+        self._position += FRAME_LENGTH_SIZE + len(record_bytes)
+        self.count += 1
+
+        # Let readers following the file see records regularly.
+        if self.count % FLUSH_INTERVAL == 0:
+            self.flush()
+
+    def write(self, label, height, width, values):
+        self.write_record(encode_labelled_image(label, height, width, values))
+
+    def flush(self):
+        """Make the records written so far visible to readers."""
+        self._file.flush()
+
+    def close(self):
+        self._file.write(struct.pack(FRAME_LENGTH_FORMAT, END_MARKER))
+
+        if self._write_index:
+            index_offset = self._position + FRAME_LENGTH_SIZE
+            self._file.write(struct.pack('<Q', len(self._offsets)))
+            self._file.write(np.array(self._offsets, dtype='<u8').tobytes())
+            self._file.write(struct.pack(TRAILER_FORMAT, index_offset, TRAILER_MAGIC))
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FramedReader(object):
+    """Reads a complete framed file over an mmap.
+
+    It has the same interface as scanner.TrainingSetScanner: records are identified by their frame's offset. If the
+    file has no end marker (because its writer is still running or crashed), reading stops at the last complete frame.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer = memoryview(self._mmap)
+        except ValueError:
+            # Empty files can't be memory-mapped. Like a file whose writer hasn't written anything yet, they have no
+            # records.
+            self._mmap = None
+            self._buffer = memoryview(b'')
+            return
+
+        magic, version = struct.unpack_from(HEADER_FORMAT, self._buffer, 0) \
+            if len(self._buffer) >= HEADER_SIZE else (None, None)
+
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('"%s" is not a framed file of version %s.' % (file_name, VERSION))
+
+    def close(self):
+        self._buffer.release()
+
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def footer_offsets(self):
+        """Return the offsets stored in the footer index, or None if the file doesn't have one."""
+        if len(self._buffer) < HEADER_SIZE + TRAILER_SIZE:
+            return None
+
+        index_offset, magic = struct.unpack_from(TRAILER_FORMAT, self._buffer, len(self._buffer) - TRAILER_SIZE)
+
+        if magic != TRAILER_MAGIC:
+            return None
+
+        count, = struct.unpack_from('<Q', self._buffer, index_offset)
+        return np.frombuffer(self._buffer, dtype='<u8', count=count, offset=index_offset + 8).astype(np.int64)
+
+    def _records(self, start=0, end=None):
+        buffer = self._buffer
+        position = max(start, HEADER_SIZE)
+        size = len(buffer)
+
+        if end is None:
+            end = size
+
+        while position < end and position + FRAME_LENGTH_SIZE <= size:
+            length, = struct.unpack_from(FRAME_LENGTH_FORMAT, buffer, position)
+
+            if length == END_MARKER or position + FRAME_LENGTH_SIZE + length > size:
+                return
+
+            yield position, position + FRAME_LENGTH_SIZE, position + FRAME_LENGTH_SIZE + length
+            position += FRAME_LENGTH_SIZE + length
+
+    def __iter__(self):
+        return self.scan()
+
+    def scan(self, start=0, end=None):
+        for offset, payload_start, payload_end in self._records(start, end):
+            yield ScannedImage(offset, *parse_labelled_image(self._buffer, payload_start, payload_end))
+
+    def index(self):
+        offsets = self.footer_offsets()
+
+        if offsets is None:
+            offsets = [offset for offset, _, _ in self._records()]
+
+        labels = [self.record_at(int(offset), with_image=False).label for offset in offsets]
+
+        return np.array(offsets, dtype=np.int64), np.array(labels, dtype=np.int64)
+
+    def _payload_range(self, offset):
+        length, = struct.unpack_from(FRAME_LENGTH_FORMAT, self._buffer, offset)
+
+        if length == END_MARKER or offset < HEADER_SIZE:
+            raise ValueError('No record at offset %s of "%s".' % (offset, self.file_name))
+
+        return offset + FRAME_LENGTH_SIZE, offset + FRAME_LENGTH_SIZE + length
+
+    def record_at(self, offset, with_image=True):
+        start, end = self._payload_range(offset)
+        return ScannedImage(offset, *parse_labelled_image(self._buffer, start, end, with_image))
+
+    def record_bytes(self, offset):
+        start, end = self._payload_range(offset)
+        return self._buffer[start:end]
+
+
+class FollowTimeoutError(IOError):
+    pass
+
+
+def follow(file_name, poll_interval=0.5, timeout=300):
+    """Yield the records of a framed file as they are written, until its writer closes it.
+
+    This reads the file with plain reads rather than an mmap, since the file grows while it is being read. The
+    records' values are bytes rather than memoryviews.
+
+    Raises FollowTimeoutError if the file doesn't appear or stops growing for timeout seconds before its end marker,
+    e.g. because its writer crashed.
+    """
+    # The time of the last progress, in a list so that the nested functions can update it.
+    last_progress = [time.time()]
+
+    def wait():
+        if time.time() - last_progress[0] > timeout:
+            raise FollowTimeoutError('"%s" hasn\'t grown for %g seconds and has no end marker.' % (file_name, timeout))
+
+        time.sleep(poll_interval)
+
+    while not os.path.exists(file_name):
+        wait()
+
+    with open(file_name, 'rb') as f:
+        def read_exactly(size):
+            data = b''
+
+            while len(data) < size:
+                chunk = f.read(size - len(data))
+
+                if not chunk:
+                    wait()
+                    continue
+
+                last_progress[0] = time.time()
+                data += chunk
+
+            return data
+
+        magic, version = struct.unpack(HEADER_FORMAT, read_exactly(HEADER_SIZE))
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('"%s" is not a framed file of version %s.' % (file_name, VERSION))
+
+        offset = HEADER_SIZE
+
+        while True:
+            length, = struct.unpack(FRAME_LENGTH_FORMAT, read_exactly(FRAME_LENGTH_SIZE))
+
+            if length == END_MARKER:
+                return
+
+            payload = read_exactly(length)
+            yield ScannedImage(offset, *parse_labelled_image(payload, 0, length))
+            offset += FRAME_LENGTH_SIZE + length
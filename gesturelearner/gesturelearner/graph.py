@@ -6,6 +6,7 @@ import coremltools.proto.Model_pb2 as mlmodel
 import numpy as np
 import tensorflow as tf
 
+from . import quantization as quantization_module
 from .constants import *
 
 
@@ -28,9 +29,15 @@ def tf_fc_weights_order_to_mlmodel(array):
     return np.swapaxes(array, 0, 1)
 
 
-def make_network(input):
+def make_network(input, fc1_rank=None, fc2_rank=None, conv_channels=CONV_CHANNELS):
     """Create the graph for the neural network, minus the softmax layer.
 
+    conv_channels are the numbers of filters of the three convolutional layers, which are fewer in a pruned network
+    (see pruning.py).
+
+    With fc1_rank or fc2_rank, the weight matrix of that fully connected layer is replaced by the product of two
+    thinner ones, W_fc1_u and W_fc1_v (or W_fc2_u and W_fc2_v), i.e. two layers with rank units between them.
+
     For this project, this graph should be kept in sync with make_mlmodel and save_mlmodel_using_protobuf below.
     Readers using this as a reference should probably ignore save_mlmodel_using_protobuf and just use make_mlmodel (use
     coremltools rather than directly using the MLModel protobuf specification).
@@ -41,8 +48,8 @@ def make_network(input):
     x_image = tf.reshape(input, [-1, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
 
     # First convolutional layer
-    vars['W_conv1'] = weight_variable([3, 3, 1, 32])
-    vars['b_conv1'] = bias_variable([32])
+    vars['W_conv1'] = weight_variable([3, 3, 1, conv_channels[0]])
+    vars['b_conv1'] = bias_variable([conv_channels[0]])
 
     h_conv1 = tf.nn.relu(conv2d(x_image, vars['W_conv1']) + vars['b_conv1'])
 
@@ -50,43 +57,61 @@ def make_network(input):
     h_pool1 = max_pool_2x2(h_conv1)
 
     # Second convolutional layer
-    vars['W_conv2'] = weight_variable([3, 3, 32, 64])
-    vars['b_conv2'] = bias_variable([64])
+    vars['W_conv2'] = weight_variable([3, 3, conv_channels[0], conv_channels[1]])
+    vars['b_conv2'] = bias_variable([conv_channels[1]])
     h_conv2 = tf.nn.relu(conv2d(h_pool1, vars['W_conv2']) + vars['b_conv2'])
 
     # Second pooling layer
     h_pool2 = max_pool_2x2(h_conv2)
 
     # Third convolutional layer
-    vars['W_conv3'] = weight_variable([3, 3, 64, 64])
-    vars['b_conv3'] = bias_variable([64])
+    vars['W_conv3'] = weight_variable([3, 3, conv_channels[1], conv_channels[2]])
+    vars['b_conv3'] = bias_variable([conv_channels[2]])
     h_conv3 = tf.nn.relu(conv2d(h_pool2, vars['W_conv3']) + vars['b_conv3'])
 
     # Third pooling layer
     h_pool3 = max_pool_2x2(h_conv3)
 
     # Fully connected layer 1
-    vars['W_fc1'] = weight_variable([6 * 6 * 64, 1024])
+    fc1_weights = fc_weight_variables(vars, 'W_fc1', [6 * 6 * conv_channels[2], 1024], fc1_rank)
     vars['b_fc1'] = bias_variable([1024])
 
-    h_pool3_flat = tf.reshape(h_pool3, [-1, 6*6*64])
-    h_fc1 = tf.nn.relu(tf.matmul(h_pool3_flat, vars['W_fc1']) + vars['b_fc1'])
+    h_pool3_flat = tf.reshape(h_pool3, [-1, 6*6*conv_channels[2]])
+    h_fc1 = tf.nn.relu(fc_matmul(h_pool3_flat, fc1_weights) + vars['b_fc1'])
 
     # Dropout layer
     vars['keep_prob'] = tf.placeholder(tf.float32)
     h_fc1_drop = tf.nn.dropout(h_fc1, vars['keep_prob'])
 
     # Fully connected layer 2
-    vars['W_fc2'] = weight_variable([1024, NUM_LABEL_INDEXES])
+    fc2_weights = fc_weight_variables(vars, 'W_fc2', [1024, NUM_LABEL_INDEXES], fc2_rank)
     vars['b_fc2'] = bias_variable([NUM_LABEL_INDEXES])
 
-    output = tf.matmul(h_fc1_drop, vars['W_fc2']) + vars['b_fc2']
+    output = fc_matmul(h_fc1_drop, fc2_weights) + vars['b_fc2']
 
     # NOTE: The softmax layer is not included here.
 
     return output, vars
 
 
+def fc_weight_variables(vars, name, shape, rank=None):
+    """Create the weights of a fully connected layer: one matrix, or two of rank columns and rows whose product
+    replaces it."""
+    if rank is None:
+        vars[name] = weight_variable(shape)
+        return [vars[name]]
+
+    vars[name + '_u'] = weight_variable([shape[0], rank])
+    vars[name + '_v'] = weight_variable([rank, shape[1]])
+    return [vars[name + '_u'], vars[name + '_v']]
+
+
+def fc_matmul(x, weights):
+    for W in weights:
+        x = tf.matmul(x, W)
+    return x
+
+
 def conv2d(x, W):
     """conv2d returns a 2d convolution layer with full stride."""
     return tf.nn.conv2d(x, W, strides=[1, 1, 1, 1], padding='SAME')
@@ -110,7 +135,15 @@ def bias_variable(shape):
     return tf.Variable(initial)
 
 
-def make_mlmodel(variables):
+def make_mlmodel(weights, quantization=None):
+    """Build the Core ML model of the network.
+
+    weights is a dict of NumPy arrays keyed by the names make_network gives the variables, as returned by
+    weights.load_checkpoint or weights.from_variables, so no TensorFlow graph or session is needed.
+
+    quantization is None for float32 weights, or 'float16' or 'linear8' (see quantization.py). Models with linear8
+    weights need iOS 12.
+    """
     # Specify the inputs and outputs (there can be multiple).
     # Each name corresponds to the input_name/output_name of a layer in the network so
     # that Core ML knows where to insert and extract data.
@@ -136,9 +169,9 @@ def make_mlmodel(variables):
     # documentation). The latter shape matches what TensorFlow uses so we don't need to
     # reorder the matrix axes ourselves.
     builder.add_convolution(name='conv2d_1', kernel_channels=1,
-                            output_channels=32, height=3, width=3, stride_height=1,
+                            output_channels=weights['W_conv1'].shape[3], height=3, width=3, stride_height=1,
                             stride_width=1, border_mode='same', groups=0,
-                            W=variables['W_conv1'].eval(), b=variables['b_conv1'].eval(),
+                            W=weights['W_conv1'], b=weights['b_conv1'],
                             has_bias=True, is_deconv=False, output_shape=None,
                             input_name='add_layer', output_name='conv2d_1')
 
@@ -149,10 +182,10 @@ def make_mlmodel(variables):
                         stride_width=2, layer_type='MAX', padding_type='SAME',
                         input_name='relu_1', output_name='maxpool_1')
 
-    builder.add_convolution(name='conv2d_2', kernel_channels=32,
-                            output_channels=64, height=3, width=3, stride_height=1,
+    builder.add_convolution(name='conv2d_2', kernel_channels=weights['W_conv2'].shape[2],
+                            output_channels=weights['W_conv2'].shape[3], height=3, width=3, stride_height=1,
                             stride_width=1, border_mode='same', groups=0,
-                            W=variables['W_conv2'].eval(), b=variables['b_conv2'].eval(),
+                            W=weights['W_conv2'], b=weights['b_conv2'],
                             has_bias=True, is_deconv=False, output_shape=None,
                             input_name='maxpool_1', output_name='conv2d_2')
 
@@ -163,10 +196,10 @@ def make_mlmodel(variables):
                         stride_width=2, layer_type='MAX', padding_type='SAME',
                         input_name='relu_2', output_name='maxpool_2')
 
-    builder.add_convolution(name='conv2d_3', kernel_channels=64,
-                            output_channels=64, height=3, width=3, stride_height=1,
+    builder.add_convolution(name='conv2d_3', kernel_channels=weights['W_conv3'].shape[2],
+                            output_channels=weights['W_conv3'].shape[3], height=3, width=3, stride_height=1,
                             stride_width=1, border_mode='same', groups=0,
-                            W=variables['W_conv3'].eval(), b=variables['b_conv3'].eval(),
+                            W=weights['W_conv3'], b=weights['b_conv3'],
                             has_bias=True, is_deconv=False, output_shape=None,
                             input_name='maxpool_2', output_name='conv2d_3')
 
@@ -185,25 +218,31 @@ def make_mlmodel(variables):
     # (inputChannels, outputChannels). Unlike with add_convolution (see the comment
     # above), the shape add_inner_product expects matches what the protobuf specification
     # requires for inner products.
+    W_fc1, fc1_input_channels, fc1_input_name = add_first_factor(builder, weights, 'fc1',
+                                                                 6*6*weights['W_conv3'].shape[3], 'maxpool_3_flat')
     builder.add_inner_product(name='fc1',
-                              W=tf_fc_weights_order_to_mlmodel(variables['W_fc1'].eval())
+                              W=tf_fc_weights_order_to_mlmodel(W_fc1)
                                 .flatten(),
-                              b=variables['b_fc1'].eval().flatten(),
-                              input_channels=6*6*64, output_channels=1024, has_bias=True,
-                              input_name='maxpool_3_flat', output_name='fc1')
+                              b=weights['b_fc1'].flatten(),
+                              input_channels=fc1_input_channels, output_channels=1024, has_bias=True,
+                              input_name=fc1_input_name, output_name='fc1')
 
     builder.add_activation(name='relu_4', non_linearity='RELU', input_name='fc1',
                            output_name='relu_4', params=None)
 
+    W_fc2, fc2_input_channels, fc2_input_name = add_first_factor(builder, weights, 'fc2', 1024, 'relu_4')
     builder.add_inner_product(name='fc2',
-                              W=tf_fc_weights_order_to_mlmodel(variables['W_fc2'].eval())
+                              W=tf_fc_weights_order_to_mlmodel(W_fc2)
                                 .flatten(),
-                              b=variables['b_fc2'].eval().flatten(), input_channels=1024,
+                              b=weights['b_fc2'].flatten(), input_channels=fc2_input_channels,
                               output_channels=NUM_LABEL_INDEXES, has_bias=True,
-                              input_name='relu_4', output_name='fc2')
+                              input_name=fc2_input_name, output_name='fc2')
 
     builder.add_softmax(name='softmax', input_name='fc2', output_name='labelValues')
 
+    if quantization is not None:
+        quantization_module.quantize_spec(builder.spec, quantization)
+
     model = MLModel(builder.spec)
 
     model.short_description = 'Model for recognizing a variety of images drawn on screen with one\'s finger'
@@ -214,14 +253,34 @@ def make_mlmodel(variables):
     return model
 
 
-def save_mlmodel(file_name, variables):
-    model = make_mlmodel(variables)
+def add_first_factor(builder, weights, layer, input_channels, input_name):
+    """If the fully connected layer is factorized (see make_network), add an inner product layer without bias for its
+    first factor, layer_u.
+
+    Returns the weight matrix, number of input channels and input name of the inner product layer that remains to be
+    added for layer itself.
+    """
+    if 'W_%s_u' % layer not in weights:
+        return weights['W_' + layer], input_channels, input_name
+
+    W_u = weights['W_%s_u' % layer]
+    builder.add_inner_product(name=layer + '_u',
+                              W=tf_fc_weights_order_to_mlmodel(W_u).flatten(), b=None,
+                              input_channels=input_channels, output_channels=W_u.shape[1], has_bias=False,
+                              input_name=input_name, output_name=layer + '_u')
+
+    return weights['W_%s_v' % layer], W_u.shape[1], layer + '_u'
+
+
+def save_mlmodel(file_name, weights, quantization=None):
+    model = make_mlmodel(weights, quantization)
     model.save(file_name)
 
     print('Saved to file: %s' % file_name)
 
 
-def save_mlmodel_using_protobuf(file_name, variables):
+def save_mlmodel_using_protobuf(file_name, weights, quantization=None):
+    """Like save_mlmodel, but writing the MLModel protobuf specification directly."""
     model = mlmodel.Model()
     model.specificationVersion = 1
 
@@ -265,7 +324,7 @@ def save_mlmodel_using_protobuf(file_name, variables):
     conv2d_1.name = 'conv2d_1'
     conv2d_1.input.extend(['add_layer'])
     conv2d_1.output.extend(['conv2d_1'])
-    conv2d_1.convolution.outputChannels = 32
+    conv2d_1.convolution.outputChannels = weights['W_conv1'].shape[3]
     conv2d_1.convolution.kernelChannels = 1
     conv2d_1.convolution.kernelSize.extend([3, 3])
     conv2d_1.convolution.same.asymmetryMode = mlmodel.SamePadding.SamePaddingMode.Value('BOTTOM_RIGHT_HEAVY')
@@ -276,8 +335,8 @@ def save_mlmodel_using_protobuf(file_name, variables):
     # On the contrary, when using the coremltools instead of using protobuf directly, there is no need to do this reshaping.
     # coremltools takes the same shape as TensorFlow and seems to reorder the matrix axes for you. See the comments in
     # make_mlmodel above for more explanation.
-    conv2d_1.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(variables['W_conv1'].eval()).flatten())
-    conv2d_1.convolution.bias.floatValue.extend(variables['b_conv1'].eval().flatten())
+    conv2d_1.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(weights['W_conv1']).flatten())
+    conv2d_1.convolution.bias.floatValue.extend(weights['b_conv1'].flatten())
     layers.extend([conv2d_1])
 
     relu_1 = mlmodel.NeuralNetworkLayer()
@@ -301,14 +360,14 @@ def save_mlmodel_using_protobuf(file_name, variables):
     conv2d_2.name = 'conv2d_2'
     conv2d_2.input.extend(['maxpool_1'])
     conv2d_2.output.extend(['conv2d_2'])
-    conv2d_2.convolution.outputChannels = 64
-    conv2d_2.convolution.kernelChannels = 32
+    conv2d_2.convolution.outputChannels = weights['W_conv2'].shape[3]
+    conv2d_2.convolution.kernelChannels = weights['W_conv2'].shape[2]
     conv2d_2.convolution.kernelSize.extend([3, 3])
     conv2d_2.convolution.same.asymmetryMode = mlmodel.SamePadding.SamePaddingMode.Value('BOTTOM_RIGHT_HEAVY')
     conv2d_2.convolution.isDeconvolution = False
     conv2d_2.convolution.hasBias = True
-    conv2d_2.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(variables['W_conv2'].eval()).flatten())
-    conv2d_2.convolution.bias.floatValue.extend(variables['b_conv2'].eval().flatten())
+    conv2d_2.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(weights['W_conv2']).flatten())
+    conv2d_2.convolution.bias.floatValue.extend(weights['b_conv2'].flatten())
     layers.extend([conv2d_2])
 
     relu_2 = mlmodel.NeuralNetworkLayer()
@@ -332,14 +391,14 @@ def save_mlmodel_using_protobuf(file_name, variables):
     conv2d_3.name = 'conv2d_3'
     conv2d_3.input.extend(['maxpool_2'])
     conv2d_3.output.extend(['conv2d_3'])
-    conv2d_3.convolution.outputChannels = 64
-    conv2d_3.convolution.kernelChannels = 64
+    conv2d_3.convolution.outputChannels = weights['W_conv3'].shape[3]
+    conv2d_3.convolution.kernelChannels = weights['W_conv3'].shape[2]
     conv2d_3.convolution.kernelSize.extend([3, 3])
     conv2d_3.convolution.same.asymmetryMode = mlmodel.SamePadding.SamePaddingMode.Value('BOTTOM_RIGHT_HEAVY')
     conv2d_3.convolution.isDeconvolution = False
     conv2d_3.convolution.hasBias = True
-    conv2d_3.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(variables['W_conv3'].eval()).flatten())
-    conv2d_3.convolution.bias.floatValue.extend(variables['b_conv3'].eval().flatten())
+    conv2d_3.convolution.weights.floatValue.extend(tf_conv_weights_order_to_mlmodel(weights['W_conv3']).flatten())
+    conv2d_3.convolution.bias.floatValue.extend(weights['b_conv3'].flatten())
     layers.extend([conv2d_3])
 
     relu_3 = mlmodel.NeuralNetworkLayer()
@@ -366,17 +425,20 @@ def save_mlmodel_using_protobuf(file_name, variables):
     maxpool_3_flat.flatten.mode = mlmodel.FlattenLayerParams.FlattenOrder.Value('CHANNEL_LAST')
     layers.extend([maxpool_3_flat])
 
+    W_fc1, fc1_input_channels, fc1_input_name = first_factor_layer(layers, weights, 'fc1',
+                                                                   6*6*weights['W_conv3'].shape[3], 'maxpool_3_flat')
+
     fc1 = mlmodel.NeuralNetworkLayer()
     fc1.name = 'fc1'
-    fc1.input.extend(['maxpool_3_flat'])
+    fc1.input.extend([fc1_input_name])
     fc1.output.extend(['fc1'])
-    fc1.innerProduct.inputChannels = 6*6*64
+    fc1.innerProduct.inputChannels = fc1_input_channels
     fc1.innerProduct.outputChannels = 1024
     fc1.innerProduct.hasBias = True
     # We must reorder the weight matrix axes because Core ML uses the shape (outputChannels, inputChannels) but
     # TensorFlow uses the shape (inputChannels, outputChannels).
-    fc1.innerProduct.weights.floatValue.extend(tf_fc_weights_order_to_mlmodel(variables['W_fc1'].eval()).flatten())
-    fc1.innerProduct.bias.floatValue.extend(variables['b_fc1'].eval().flatten())
+    fc1.innerProduct.weights.floatValue.extend(tf_fc_weights_order_to_mlmodel(W_fc1).flatten())
+    fc1.innerProduct.bias.floatValue.extend(weights['b_fc1'].flatten())
     layers.extend([fc1])
 
     relu_4 = mlmodel.NeuralNetworkLayer()
@@ -386,15 +448,17 @@ def save_mlmodel_using_protobuf(file_name, variables):
     relu_4.activation.ReLU.SetInParent()
     layers.extend([relu_4])
 
+    W_fc2, fc2_input_channels, fc2_input_name = first_factor_layer(layers, weights, 'fc2', 1024, 'relu_4')
+
     fc2 = mlmodel.NeuralNetworkLayer()
     fc2.name = 'fc2'
-    fc2.input.extend(['relu_4'])
+    fc2.input.extend([fc2_input_name])
     fc2.output.extend(['fc2'])
-    fc2.innerProduct.inputChannels = 1024
+    fc2.innerProduct.inputChannels = fc2_input_channels
     fc2.innerProduct.outputChannels = NUM_LABEL_INDEXES
     fc2.innerProduct.hasBias = True
-    fc2.innerProduct.weights.floatValue.extend(tf_fc_weights_order_to_mlmodel(variables['W_fc2'].eval()).flatten())
-    fc2.innerProduct.bias.floatValue.extend(variables['b_fc2'].eval().flatten())
+    fc2.innerProduct.weights.floatValue.extend(tf_fc_weights_order_to_mlmodel(W_fc2).flatten())
+    fc2.innerProduct.bias.floatValue.extend(weights['b_fc2'].flatten())
     layers.extend([fc2])
 
     sm = mlmodel.NeuralNetworkLayer()
@@ -404,8 +468,31 @@ def save_mlmodel_using_protobuf(file_name, variables):
     sm.softmax.SetInParent()
     layers.extend([sm])
 
+    if quantization is not None:
+        quantization_module.quantize_spec(model, quantization)
+
     f = open(file_name, 'wb')
     f.write(model.SerializeToString())
     f.close()
 
     print('Saved to file: %s' % file_name)
+
+
+def first_factor_layer(layers, weights, layer, input_channels, input_name):
+    """Like add_first_factor, but for save_mlmodel_using_protobuf."""
+    if 'W_%s_u' % layer not in weights:
+        return weights['W_' + layer], input_channels, input_name
+
+    W_u = weights['W_%s_u' % layer]
+
+    factor = mlmodel.NeuralNetworkLayer()
+    factor.name = layer + '_u'
+    factor.input.extend([input_name])
+    factor.output.extend([layer + '_u'])
+    factor.innerProduct.inputChannels = input_channels
+    factor.innerProduct.outputChannels = W_u.shape[1]
+    factor.innerProduct.hasBias = False
+    factor.innerProduct.weights.floatValue.extend(tf_fc_weights_order_to_mlmodel(W_u).flatten())
+    layers.extend([factor])
+
+    return weights['W_%s_v' % layer], W_u.shape[1], layer + '_u'
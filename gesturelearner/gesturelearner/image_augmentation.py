@@ -0,0 +1,148 @@
+"""Augment batches of rasterized images with NumPy.
+
+Each image of a batch gets its own random:
+
+- thickening or thinning of its strokes (a grayscale dilation or erosion by a 3x3 cross),
+- rotation and scale about the image center,
+- translation, limited so that the drawing stays inside the image,
+- elastic distortion: a smooth random displacement field, as in Simard et al., "Best Practices for Convolutional
+  Neural Networks Applied to Visual Document Analysis".
+
+The rotation, scale, translation and distortion are combined into one sampling grid per image, and the whole batch is
+resampled with a single vectorized bilinear interpolation.
+"""
+import numpy as np
+
+
+class ImageAugmenter(object):
+    """Makes randomly augmented copies of batches of normalized images of shape (count, height, width, 1).
+
+    rotation is in degrees, scale relative and max_translation and elastic_alpha (the largest displacement of the
+    elastic distortion) in pixels. Each is the largest change in either direction. morphology is the probability that
+    an image's strokes are thickened or thinned (with equal chance).
+    """
+
+    def __init__(self, rotation=8.0, scale=0.1, max_translation=4, morphology=0.3, elastic_alpha=1.5,
+                 elastic_sigma=4.0, seed=None):
+        self.rotation = rotation
+        self.scale = scale
+        self.max_translation = max_translation
+        self.morphology = morphology
+        self.elastic_alpha = elastic_alpha
+        self.elastic_sigma = elastic_sigma
+        self.random_state = np.random.RandomState(seed)
+
+    def augment(self, images):
+        # Work on coverage in [0, 1], where the background is 0 and can be padded with zeros.
+        coverage = images[..., 0] + 0.5
+        count, height, width = coverage.shape
+
+        if self.morphology > 0:
+            coverage = self.thicken_or_thin(coverage)
+
+        angles = np.radians(self.random_state.uniform(-self.rotation, self.rotation, count))
+        scales = self.random_state.uniform(1 - self.scale, 1 + self.scale, count)
+
+        # Map each output pixel back to the source pixel it samples.
+        cos = np.cos(angles) / scales
+        sin = np.sin(angles) / scales
+        translations = self.translations(coverage)
+
+        y, x = np.mgrid[0:height, 0:width].astype(np.float64)
+        center_y, center_x = (height - 1) / 2.0, (width - 1) / 2.0
+        dy = y[np.newaxis] - center_y - translations[:, 0, np.newaxis, np.newaxis]
+        dx = x[np.newaxis] - center_x - translations[:, 1, np.newaxis, np.newaxis]
+
+        source_x = center_x + cos[:, np.newaxis, np.newaxis] * dx + sin[:, np.newaxis, np.newaxis] * dy
+        source_y = center_y - sin[:, np.newaxis, np.newaxis] * dx + cos[:, np.newaxis, np.newaxis] * dy
+
+        if self.elastic_alpha > 0:
+            displacement = self.elastic_displacement(count, height, width)
+            source_x += displacement[0]
+            source_y += displacement[1]
+
+        coverage = bilinear_sample(coverage, source_y, source_x)
+
+        return (coverage - 0.5).astype(np.float32)[..., np.newaxis]
+
+    def thicken_or_thin(self, coverage):
+        operations = self.random_state.choice([-1, 0, 1], size=len(coverage),
+                                              p=[self.morphology / 2, 1 - self.morphology, self.morphology / 2])
+
+        padded = np.pad(coverage, ((0, 0), (1, 1), (1, 1)), mode='constant')
+        height, width = coverage.shape[1:]
+        neighbours = np.stack([padded[:, 1 + dy:1 + dy + height, 1 + dx:1 + dx + width]
+                               for dy, dx in [(0, 0), (-1, 0), (1, 0), (0, -1), (0, 1)]])
+
+        operation = operations[:, np.newaxis, np.newaxis]
+        return np.where(operation > 0, neighbours.max(axis=0), np.where(operation < 0, neighbours.min(axis=0),
+                                                                        coverage))
+
+    def translations(self, coverage):
+        """Return random (count, 2) integer (y, x) translations that keep each image's drawing inside the image."""
+        count, height, width = coverage.shape
+        rows = coverage.max(axis=2) > 0
+        columns = coverage.max(axis=1) > 0
+
+        def limits(is_drawn, size):
+            has_content = is_drawn.any(axis=1)
+            first = np.where(has_content, is_drawn.argmax(axis=1), 0)
+            last = np.where(has_content, size - 1 - is_drawn[:, ::-1].argmax(axis=1), size - 1)
+            return (np.maximum(-first, -self.max_translation),
+                    np.minimum(size - 1 - last, self.max_translation))
+
+        translations = np.zeros((count, 2))
+
+        for axis, (is_drawn, size) in enumerate([(rows, height), (columns, width)]):
+            low, high = limits(is_drawn, size)
+            translations[:, axis] = np.floor(self.random_state.uniform(low, high + 1))
+
+        return translations
+
+    def elastic_displacement(self, count, height, width):
+        """Return a random (2, count, height, width) displacement field whose largest displacement is elastic_alpha."""
+        fields = gaussian_blur(self.random_state.uniform(-1, 1, (2, count, height, width)), self.elastic_sigma)
+        largest = np.abs(fields).max(axis=(2, 3), keepdims=True)
+        return fields * (self.elastic_alpha / np.maximum(largest, 1e-12))
+
+
+def gaussian_blur(images, sigma):
+    """Blur the last two axes of images with a Gaussian filter, treating pixels outside the images as zero.
+
+    The blur along each axis is a product with a (size, size) matrix, which is much faster than summing shifted
+    copies of the images for the kernel sizes used here.
+    """
+    def blur_matrix(size):
+        offsets = np.arange(size)[:, np.newaxis] - np.arange(size)[np.newaxis]
+        radius = int(np.ceil(3 * sigma))
+        kernel = np.exp(-0.5 * (np.arange(-radius, radius + 1) / sigma) ** 2)
+        return np.where(np.abs(offsets) <= radius, np.exp(-0.5 * (offsets / sigma) ** 2), 0) / kernel.sum()
+
+    height, width = images.shape[-2:]
+    return np.matmul(np.matmul(blur_matrix(height), images), blur_matrix(width))
+
+
+def bilinear_sample(images, y, x):
+    """Sample (count, height, width) images at the (count, out_height, out_width) coordinates y and x.
+
+    Coordinates are in pixels and pixels outside the images are zero.
+    """
+    count, height, width = images.shape
+
+    # Pad with a border of zeros and clamp the coordinates to it.
+    padded = np.pad(images, ((0, 0), (1, 1), (1, 1)), mode='constant')
+    y = np.clip(y + 1, 0, height + 1)
+    x = np.clip(x + 1, 0, width + 1)
+
+    y0 = np.minimum(np.floor(y).astype(np.int64), height)
+    x0 = np.minimum(np.floor(x).astype(np.int64), width)
+    wy = y - y0
+    wx = x - x0
+
+    flat = padded.reshape(-1)
+    base = (np.arange(count) * (height + 2) * (width + 2))[:, np.newaxis, np.newaxis]
+    top_left = base + y0 * (width + 2) + x0
+
+    top = flat[top_left] * (1 - wx) + flat[top_left + 1] * wx
+    bottom = flat[top_left + width + 2] * (1 - wx) + flat[top_left + width + 3] * wx
+    return top * (1 - wy) + bottom * wy
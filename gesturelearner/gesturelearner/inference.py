@@ -0,0 +1,142 @@
+"""Run the network of graph.make_network in NumPy, without TensorFlow.
+
+Each 3x3 convolution is a single matrix product over the whole batch: the 3x3 neighbourhoods of all pixels are
+gathered into the rows of a matrix (im2col) and multiplied by the kernels reshaped to (9 * input channels, output
+channels). Padding and pooling follow TensorFlow's SAME padding, so the outputs match the TensorFlow graph up to
+floating point rounding.
+"""
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+from . import weights as weights_module
+from .constants import *
+
+
+def im2col_3x3(x):
+    """From (count, height, width, channels) to (count * height * width, 9 * channels) rows of 3x3 neighbourhoods,
+    zero-padded by one pixel on each side."""
+    count, height, width, channels = x.shape
+    padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)), mode='constant')
+
+    s = padded.strides
+    patches = as_strided(padded, shape=(count, height, width, 3, 3, channels),
+                         strides=(s[0], s[1], s[2], s[1], s[2], s[3]), writeable=False)
+
+    # The (row, column, channel) order of the columns matches the (height, width, in, out) order of the kernels.
+    return patches.reshape(count * height * width, 9 * channels)
+
+
+def conv3x3_relu(x, W, b, scale=None):
+    """A 3x3 convolution with stride 1 and SAME padding, followed by ReLU.
+
+    If given, the products are multiplied by scale (one value per output channel) before the bias is added.
+    """
+    count, height, width, _ = x.shape
+    y = np.dot(im2col_3x3(x), W.reshape(-1, W.shape[3]))
+
+    if scale is not None:
+        y *= scale
+
+    y += b
+    np.maximum(y, 0, out=y)
+    return y.reshape(count, height, width, W.shape[3])
+
+
+def max_pool_2x2(x):
+    """2x2 max pooling with stride 2 and SAME padding, which pads odd sizes at the bottom and right."""
+    count, height, width, channels = x.shape
+    pad_height = height % 2
+    pad_width = width % 2
+
+    if pad_height or pad_width:
+        x = np.pad(x, ((0, 0), (0, pad_height), (0, pad_width), (0, 0)), mode='constant', constant_values=-np.inf)
+
+    pooled_height = (height + pad_height) // 2
+    pooled_width = (width + pad_width) // 2
+
+    return x.reshape(count, pooled_height, 2, pooled_width, 2, channels).max(axis=(2, 4))
+
+
+def softmax(logits):
+    exps = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exps / exps.sum(axis=1, keepdims=True)
+
+
+class Network(object):
+    def __init__(self, weights, batch_size=256):
+        """weights is a dict of arrays such as returned by weights.load. Batches of more than batch_size images are
+        run batch_size at a time to bound memory use."""
+        self.weights = dict((name, np.ascontiguousarray(weights[name], dtype=np.float32))
+                            for name in weights_module.names_of(weights))
+        self.batch_size = batch_size
+
+    @classmethod
+    def load(cls, file_name, batch_size=256):
+        """Load a .npz file written by weights.save."""
+        return cls(weights_module.load(file_name), batch_size)
+
+    def logits(self, images):
+        """Return the network's output before the softmax for normalized images of shape (count, height, width, 1),
+        as fed to make_network."""
+        images = np.asarray(images, dtype=np.float32).reshape(-1, IMAGE_HEIGHT, IMAGE_WIDTH, 1)
+
+        if len(images) <= self.batch_size:
+            return self._logits(images)
+
+        return np.concatenate([self._logits(images[start:start + self.batch_size])
+                               for start in range(0, len(images), self.batch_size)])
+
+    def _logits(self, x):
+        x = max_pool_2x2(self.conv('conv1', x))
+        x = max_pool_2x2(self.conv('conv2', x))
+        x = max_pool_2x2(self.conv('conv3', x))
+
+        # Flattened in (height, width, channel) order, like the reshape in make_network.
+        x = x.reshape(len(x), -1)
+
+        x = self.fc('fc1', x)
+        np.maximum(x, 0, out=x)
+
+        # Dropout is the identity at inference.
+        return self.fc('fc2', x)
+
+    def conv(self, layer, x):
+        """The convolution and ReLU of layer ('conv1', 'conv2' or 'conv3')."""
+        return conv3x3_relu(x, self.weights['W_' + layer], self.weights['b_' + layer])
+
+    def fc(self, layer, x):
+        """The fully connected layer ('fc1' or 'fc2'), without activation."""
+        if 'W_%s_u' % layer in self.weights:
+            y = np.dot(np.dot(x, self.weights['W_%s_u' % layer]), self.weights['W_%s_v' % layer])
+        else:
+            y = np.dot(x, self.weights['W_' + layer])
+
+        y += self.weights['b_' + layer]
+        return y
+
+    def predict(self, images):
+        """Return the probability of each label index for each image, like the softmax layer of the Core ML model."""
+        return softmax(self.logits(images))
+
+
+def measure_speed(predict, images, batch_size, repeats):
+    """Return the average seconds to classify one image at a time and the images classified per second in batches
+    of batch_size."""
+    predict(images[:1])
+
+    start = time.time()
+    for i in range(repeats):
+        predict(images[i % len(images):i % len(images) + 1])
+    latency = (time.time() - start) / repeats
+
+    batches = [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+    predict(batches[0])
+
+    start = time.time()
+    for batch in batches:
+        predict(batch)
+    throughput = len(images) / (time.time() - start)
+
+    return latency, throughput
@@ -0,0 +1,149 @@
+"""Sidecar label indexes for data set files.
+
+The index of data.trainingset is stored next to it as data.trainingset.labelindex. It holds the offset and label of
+every record (see records.py), a fingerprint of the file it was built from and a checksum of it, so selecting the
+records of some labels or counting the records of each label only reads the index instead of scanning the data set.
+
+Loading an index only compares the fingerprint: the file's size, modification time and a hash of its first and last
+blocks, which catches appended, truncated and rewritten files without reading them. The checksum is a BLAKE2b hash of
+the whole file. Comparing it (with verify=True) also catches same-size edits in the middle of the file, such as a
+relabelled record, after a copy that preserves modification times, but reads the whole file every time.
+"""
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+from . import records
+
+
+SUFFIX = '.labelindex'
+CHECKSUM_BLOCK_SIZE = 1024 * 1024
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+
+def checksum(file_name):
+    digest = hashlib.blake2b(digest_size=16)
+
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def fingerprint(file_name):
+    stat = os.stat(file_name)
+    digest = hashlib.blake2b(struct.pack('<qq', stat.st_size, stat.st_mtime_ns), digest_size=16)
+
+    with open(file_name, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK_SIZE))
+
+        if stat.st_size > FINGERPRINT_BLOCK_SIZE:
+            f.seek(max(FINGERPRINT_BLOCK_SIZE, stat.st_size - FINGERPRINT_BLOCK_SIZE))
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+class LabelIndex(object):
+    def __init__(self, offsets, labels, file_checksum, file_fingerprint):
+        self.offsets = offsets
+        self.labels = labels
+        self.checksum = file_checksum
+        self.fingerprint = file_fingerprint
+
+        # Records grouped by label, in file order within each label.
+        self._order = np.argsort(labels, kind='mergesort')
+        self.label_values, self._label_starts, self.label_counts = np.unique(labels[self._order], return_index=True,
+                                                                             return_counts=True)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def counts(self):
+        """Return a dict from label to number of records."""
+        return dict(zip(self.label_values.tolist(), self.label_counts.tolist()))
+
+    def positions_for(self, label):
+        """Return the positions (in file order) of the records with the given label."""
+        i = np.searchsorted(self.label_values, label)
+
+        if i == len(self.label_values) or self.label_values[i] != label:
+            return np.zeros(0, dtype=np.int64)
+
+        return self._order[self._label_starts[i]:self._label_starts[i] + self.label_counts[i]]
+
+    def offsets_for(self, labels):
+        """Return the offsets, in file order, of the records with any of the given labels."""
+        positions = [self.positions_for(label) for label in labels]
+        return self.offsets[np.sort(np.concatenate(positions))] if positions else np.zeros(0, dtype=np.int64)
+
+    def save(self, file_name):
+        # Write to a temporary file first so an interrupted save never leaves a truncated index.
+        temporary_file = file_name + '.tmp'
+
+        with open(temporary_file, 'wb') as f:
+            np.savez(f, offsets=self.offsets, labels=self.labels, checksum=np.array(self.checksum),
+                     fingerprint=np.array(self.fingerprint))
+
+        os.rename(temporary_file, file_name)
+
+    @classmethod
+    def load(cls, file_name):
+        with np.load(file_name) as arrays:
+            return cls(arrays['offsets'], arrays['labels'], str(arrays['checksum']), str(arrays['fingerprint']))
+
+
+def index_file_name(file_name):
+    return file_name + SUFFIX
+
+
+def load(file_name, verify=False):
+    """Return the label index of a data set file, or None if it has none or the file changed since it was built.
+
+    With verify, the file is compared by its checksum rather than its fingerprint.
+    """
+    try:
+        index = LabelIndex.load(index_file_name(file_name))
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+    if index.fingerprint != fingerprint(file_name):
+        return None
+
+    if verify and index.checksum != checksum(file_name):
+        return None
+
+    return index
+
+
+def load_or_build(file_name, source=None, verify=False):
+    """Return the label index of a data set file, building and saving it first if needed.
+
+    source is an already open reader of the file. If the index can't be saved (e.g. the directory is read-only), it's
+    still returned.
+    """
+    index = load(file_name, verify)
+
+    if index is not None:
+        return index
+
+    file_fingerprint = fingerprint(file_name)
+    file_checksum = checksum(file_name)
+
+    if source is None:
+        with records.open_records(file_name) as source:
+            offsets, labels = source.index()
+    else:
+        offsets, labels = source.index()
+
+    index = LabelIndex(offsets, labels, file_checksum, file_fingerprint)
+
+    try:
+        index.save(index_file_name(file_name))
+    except (IOError, OSError):
+        pass
+
+    return index
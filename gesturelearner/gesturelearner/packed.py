@@ -0,0 +1,184 @@
+"""A packed dataset format that can be memory-mapped.
+
+A packed file is a small header followed by all images as one contiguous (count, height, width) uint8 array and then
+all label indexes as one (count,) uint8 array. Reading a batch is a single vectorized gather from the memory map, so
+there is no per-record parsing, and concurrent readers of the same file share its pages through the OS page cache.
+"""
+import struct
+
+import numpy as np
+
+from .constants import *
+
+
+MAGIC = b'GLPACK01'
+HEADER_FORMAT = '<8sQIII'
+HEADER_SIZE = 64
+
+
+def is_packed_file(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def crop_or_pad(image, height, width):
+    """Center-crop or zero-pad a 2D image to (height, width), like tf.image.resize_image_with_crop_or_pad."""
+    if image.shape == (height, width):
+        return image
+
+    result = np.zeros((height, width), dtype=image.dtype)
+
+    def offsets(size, target_size):
+        if size > target_size:
+            return (size - target_size) // 2, 0, target_size
+        return 0, (target_size - size) // 2, size
+
+    source_y, target_y, copy_height = offsets(image.shape[0], height)
+    source_x, target_x, copy_width = offsets(image.shape[1], width)
+
+    result[target_y:target_y + copy_height, target_x:target_x + copy_width] = \
+        image[source_y:source_y + copy_height, source_x:source_x + copy_width]
+
+    return result
+
+
+def normalize_images(images):
+    """From uint8 images of shape (count, height, width) to the network's input of shape (count, height, width, 1)."""
+    images = images.astype(np.float32)
+    images *= 1. / 255
+    images -= 0.5
+    return images[..., np.newaxis]
+
+
+def one_hot(label_indexes):
+    labels = np.zeros((len(label_indexes), NUM_LABEL_INDEXES), dtype=np.float32)
+    labels[np.arange(len(label_indexes)), label_indexes] = 1.0
+    return labels
+
+
+def epoch_batches(count, batch_size, shuffle=True, seed=None, start_batch=0):
+    """Yield the indexes of the examples of each batch of a dataset of count examples, forever.
+
+    Batches don't cross epochs, and the examples left over at the end of each epoch are skipped. With a seed, epoch e
+    is shuffled with the seed (seed, e), so the position of any batch can be computed without replaying the epochs
+    before it.
+
+    Raises ValueError right away, not at the first batch, if the dataset is empty.
+    """
+    if count == 0:
+        raise ValueError('Can\'t make batches of an empty dataset.')
+
+    return _epoch_batches(count, batch_size, shuffle, seed, start_batch)
+
+
+def _epoch_batches(count, batch_size, shuffle, seed, start_batch):
+    batch_size = min(batch_size, count)
+    batches_per_epoch = count // batch_size
+    epoch, batch = divmod(start_batch, batches_per_epoch) if seed is not None else (0, 0)
+    random_state = np.random.RandomState(seed)
+
+    while True:
+        if not shuffle:
+            order = np.arange(count)
+        elif seed is not None:
+            order = np.random.RandomState([seed, epoch]).permutation(count)
+        else:
+            order = random_state.permutation(count)
+
+        for start in range(batch * batch_size, batches_per_epoch * batch_size, batch_size):
+            yield order[start:start + batch_size]
+
+        epoch += 1
+        batch = 0
+
+
+class PackedWriter(object):
+    """Writes a packed file one image at a time.
+
+    Images are appended to the file as they arrive; only the label indexes (one byte per image) are kept in memory
+    until close().
+    """
+
+    def __init__(self, file_name, height=IMAGE_HEIGHT, width=IMAGE_WIDTH):
+        self.height = height
+        self.width = width
+        self.count = 0
+        self._label_indexes = bytearray()
+        self._file = open(file_name, 'wb')
+        self._write_header()
+
+    def _write_header(self):
+        header = struct.pack(HEADER_FORMAT, MAGIC, self.count, self.height, self.width, NUM_LABEL_INDEXES)
+        self._file.seek(0)
+        self._file.write(header.ljust(HEADER_SIZE, b'\0'))
+
+    def write(self, values, image_height, image_width, label_index):
+        image = np.frombuffer(values, dtype=np.uint8).reshape(image_height, image_width)
+        image = crop_or_pad(image, self.height, self.width)
+
+        self._file.write(image.tobytes())
+        self._label_indexes.append(label_index)
+        self.count += 1
+
+    def write_arrays(self, images, label_indexes):
+        """Append a (count, height, width) uint8 array of images of this writer's size and their label indexes."""
+        self._file.write(np.ascontiguousarray(images, dtype=np.uint8).tobytes())
+        self._label_indexes.extend(np.asarray(label_indexes, dtype=np.uint8).tobytes())
+        self.count += len(images)
+
+    def close(self):
+        self._file.write(bytes(self._label_indexes))
+        self._write_header()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PackedDataset(object):
+    """Read-only, memory-mapped view of a packed file."""
+
+    def __init__(self, file_name):
+        with open(file_name, 'rb') as f:
+            header = f.read(struct.calcsize(HEADER_FORMAT))
+
+        magic, count, height, width, num_label_indexes = struct.unpack(HEADER_FORMAT, header)
+
+        if magic != MAGIC:
+            raise ValueError('"%s" is not a packed dataset file.' % file_name)
+
+        if num_label_indexes != NUM_LABEL_INDEXES:
+            raise ValueError('"%s" was written with %s label indexes but there are now %s.'
+                             % (file_name, num_label_indexes, NUM_LABEL_INDEXES))
+
+        self.file_name = file_name
+        self.height = height
+        self.width = width
+
+        self.images = np.memmap(file_name, dtype=np.uint8, mode='r', offset=HEADER_SIZE,
+                                shape=(count, height, width))
+        self.label_indexes = np.memmap(file_name, dtype=np.uint8, mode='r',
+                                       offset=HEADER_SIZE + count * height * width, shape=(count,))
+
+    def __len__(self):
+        return len(self.label_indexes)
+
+    def gather(self, indexes):
+        """Return the normalized images and one-hot labels at the given indexes."""
+        # Sorted indexes read the memory map front to back.
+        indexes = np.sort(indexes)
+        return normalize_images(self.images[indexes]), one_hot(self.label_indexes[indexes])
+
+    def arrays(self):
+        """Return the whole dataset as normalized images and one-hot labels."""
+        return normalize_images(self.images), one_hot(self.label_indexes)
+
+    def batches(self, batch_size, shuffle=True, seed=None, start_batch=0):
+        """Yield (images, labels) batches forever, reshuffling every epoch.
+
+        With a seed, the order is the same every time and start_batch skips straight to a later batch.
+        """
+        return (self.gather(indexes) for indexes in epoch_batches(len(self), batch_size, shuffle, seed, start_batch))
@@ -0,0 +1,157 @@
+"""Record where the time of each training step goes.
+
+A StepProfiler times the phases of each step (e.g. input, train, evaluation, checkpoint) and writes one JSON line
+per step with the duration of each phase, the examples per second and the fill level of the input queues. It also
+writes all the spans as a Chrome trace (open chrome://tracing or https://ui.perfetto.dev and load the file), and every
+timeline_steps steps, an op-level timeline of the training step from tf.RunMetadata.
+"""
+import collections
+import contextlib
+import json
+import time
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class StepProfiler(object):
+    def __init__(self, prefix=None, timeline_steps=None):
+        """Write prefix.profile.jsonl, prefix.trace.json and prefix.timeline-STEP.json. Nothing is written without a
+        prefix, but the totals are still kept for summary()."""
+        self.prefix = prefix
+        self.timeline_steps = timeline_steps
+
+        self.start_time = time.time()
+        self.step = None
+        self.step_start = None
+        self.phases = None
+
+        self.totals = collections.OrderedDict()
+        self.steps = 0
+        self.examples = 0
+        self.trace_events = []
+
+        self.log = open(prefix + '.profile.jsonl', 'a') if prefix is not None else None
+
+    def start_step(self, step):
+        self.step = step
+        self.step_start = time.time()
+        self.phases = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def span(self, name):
+        """Time the code in the with block as the phase name of the current step."""
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            end = time.time()
+            self.phases[name] = self.phases.get(name, 0.0) + end - start
+            self.trace_event(name, start, end)
+
+    def end_step(self, examples, queue_fill=None):
+        """Finish the current step, which trained on examples examples.
+
+        queue_fill maps the names of input queues to the number of elements in them.
+        """
+        end = time.time()
+        duration = end - self.step_start
+        examples_per_second = examples / duration if duration > 0 else 0.0
+
+        self.steps += 1
+        self.examples += examples
+
+        for name, seconds in self.phases.items():
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+
+        self.totals['total'] = self.totals.get('total', 0.0) + duration
+
+        if self.prefix is None:
+            return
+
+        line = {
+            'step': self.step,
+            'time': end,
+            'duration': duration,
+            'phases': self.phases,
+            'examples': examples,
+            'examples_per_second': examples_per_second
+        }
+
+        if queue_fill:
+            line['queue_fill'] = queue_fill
+
+        self.log.write(json.dumps(line) + '\n')
+
+        self.trace_event('step %d' % self.step, self.step_start, end, tid=0)
+        self.trace_counter('examples/sec', end, {'examples/sec': examples_per_second})
+
+        if queue_fill:
+            self.trace_counter('queue fill', end, queue_fill)
+
+    def trace_event(self, name, start, end, tid=1):
+        if self.prefix is None:
+            return
+
+        # Steps are on one row of the trace and their phases on the row below.
+        self.trace_events.append({'name': name, 'ph': 'X', 'pid': 0, 'tid': tid, 'ts': self.microseconds(start),
+                                  'dur': (end - start) * 1e6, 'args': {'step': self.step}})
+
+    def trace_counter(self, name, when, values):
+        self.trace_events.append({'name': name, 'ph': 'C', 'pid': 0, 'ts': self.microseconds(when), 'args': values})
+
+    def microseconds(self, when):
+        return (when - self.start_time) * 1e6
+
+    def run_options(self, step):
+        """Return the options and metadata to pass to the training step's sess.run: (None, None) except every
+        timeline_steps steps, when a full trace of the run is requested."""
+        if self.prefix is None or not self.timeline_steps or step % self.timeline_steps != 0:
+            return None, None
+
+        return tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE), tf.RunMetadata()
+
+    def save_timeline(self, step, run_metadata):
+        """Write the op-level timeline of a run traced with run_options, if there is one."""
+        if run_metadata is None:
+            return
+
+        with open('%s.timeline-%d.json' % (self.prefix, step), 'w') as f:
+            f.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+
+    def summary(self):
+        """Return a table of the average milliseconds per step of each phase and the overall examples per second."""
+        if self.steps == 0:
+            return 'No steps were profiled.'
+
+        step_seconds = self.totals.get('total', 0.0)
+        lines = ['%-12s %10s %8s' % ('phase', 'ms/step', 'share')]
+
+        # The total goes last, whichever phase first appeared after it.
+        names = [name for name in self.totals if name != 'total'] + ['total']
+
+        for name in names:
+            seconds = self.totals[name]
+            share = 100. * seconds / step_seconds if step_seconds > 0 else 0.0
+            lines.append('%-12s %10.2f %7.1f%%' % (name, 1000. * seconds / self.steps, share))
+
+        if step_seconds > 0:
+            lines.append('%.0f examples/sec' % (self.examples / step_seconds))
+
+        return '\n'.join(lines)
+
+    def close(self):
+        if self.prefix is None:
+            return
+
+        self.log.close()
+
+        with open(self.prefix + '.trace.json', 'w') as f:
+            json.dump({'traceEvents': self.trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+def queue_sizes():
+    """Return a dict of the size tensors of the queues of the graph's queue runners, by queue name."""
+    return dict((queue_runner.queue.name, queue_runner.queue.size())
+                for queue_runner in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS))
@@ -0,0 +1,121 @@
+"""Structured pruning: removing whole filters from the convolutional layers.
+
+Removing a filter of conv1, conv2 or conv3 removes its kernel and bias, the input channel of the next convolution
+that reads its output and, for conv3, the rows of W_fc1 (or of W_fc1_u if fc1 is factorized) that read that channel
+at each position of the flattened 6x6 map. What remains is a smaller dense network, which make_network builds with
+conv_channels and which make_mlmodel and save_mlmodel_using_protobuf convert like the full one.
+
+Filters are ranked by one of two scores:
+
+* 'magnitude': the L1 norm of the filter's kernel.
+* 'activation': the mean output of the filter's ReLU over example images. A filter that is rarely active contributes
+  little to the next layer whatever the size of its weights.
+"""
+import numpy as np
+
+from . import inference, weights as weights_module
+from .constants import *
+
+
+SCORE_METHODS = ['magnitude', 'activation']
+
+
+def magnitude_scores(weights):
+    """Return the L1 norm of each filter of each convolutional layer."""
+    return dict((layer, np.abs(weights['W_' + layer]).reshape(-1, weights['W_' + layer].shape[3]).sum(axis=0))
+                for layer in weights_module.CONV_LAYERS)
+
+
+class _ActivationNetwork(inference.Network):
+    """A float network that sums the output of each filter of the convolutional layers."""
+
+    def __init__(self, weights, batch_size=256):
+        inference.Network.__init__(self, weights, batch_size)
+        self.sums = dict((layer, 0.0) for layer in weights_module.CONV_LAYERS)
+        self.counts = dict((layer, 0) for layer in weights_module.CONV_LAYERS)
+
+    def conv(self, layer, x):
+        y = inference.Network.conv(self, layer, x)
+        self.sums[layer] = self.sums[layer] + y.sum(axis=(0, 1, 2), dtype=np.float64)
+        self.counts[layer] += y.shape[0] * y.shape[1] * y.shape[2]
+        return y
+
+
+def activation_scores(weights, images, batch_size=256):
+    """Return the mean activation of each filter of each convolutional layer over normalized images."""
+    network = _ActivationNetwork(weights, batch_size)
+    network.logits(images)
+    return dict((layer, network.sums[layer] / max(network.counts[layer], 1)) for layer in network.sums)
+
+
+def filter_scores(weights, method='magnitude', images=None, batch_size=256):
+    """Score the filters of each convolutional layer with one of SCORE_METHODS. The 'activation' method needs
+    images."""
+    if method == 'magnitude':
+        return magnitude_scores(weights)
+
+    if method == 'activation':
+        if images is None:
+            raise ValueError('Scoring filters by activation needs images.')
+        return activation_scores(weights, images, batch_size)
+
+    raise ValueError('Unknown scoring method "%s".' % method)
+
+
+def keep_strongest(scores, fraction):
+    """Return the sorted indexes of the highest scoring fraction of the filters of each layer (at least one)."""
+    keep = {}
+
+    for layer, layer_scores in scores.items():
+        count = max(1, int(round(fraction * len(layer_scores))))
+        keep[layer] = np.sort(np.argsort(-np.asarray(layer_scores), kind='mergesort')[:count])
+
+    return keep
+
+
+def prune_weights(weights, keep):
+    """Return a copy of weights with only the filters of each convolutional layer whose indexes are in keep[layer].
+
+    Layers missing from keep keep all their filters.
+    """
+    result = dict(weights)
+
+    for position, layer in enumerate(weights_module.CONV_LAYERS):
+        if layer not in keep:
+            continue
+
+        indexes = np.asarray(keep[layer])
+        result['W_' + layer] = result['W_' + layer][:, :, :, indexes]
+        result['b_' + layer] = result['b_' + layer][indexes]
+
+        if position + 1 < len(weights_module.CONV_LAYERS):
+            next_name = 'W_' + weights_module.CONV_LAYERS[position + 1]
+            result[next_name] = result[next_name][:, :, indexes, :]
+            continue
+
+        # The flattened input of fc1 is in (height, width, channel) order, so its rows are grouped by position.
+        fc1_name = 'W_fc1_u' if 'W_fc1_u' in result else 'W_fc1'
+        W = result[fc1_name]
+        channels = weights['W_' + layer].shape[3]
+        result[fc1_name] = W.reshape(-1, channels, W.shape[1])[:, indexes, :].reshape(-1, W.shape[1])
+
+    return result
+
+
+def flops(weights):
+    """Return the floating point operations (two per multiply-add) to classify one image, ignoring biases,
+    activations and pooling."""
+    multiply_adds = 0
+    height, width = IMAGE_HEIGHT, IMAGE_WIDTH
+
+    for layer in weights_module.CONV_LAYERS:
+        multiply_adds += height * width * np.asarray(weights['W_' + layer]).size
+
+        # SAME max pooling rounds up.
+        height, width = (height + 1) // 2, (width + 1) // 2
+
+    for name in weights_module.names_of(weights):
+        if name.startswith('W_fc'):
+            multiply_adds += np.asarray(weights[name]).size
+
+    return 2 * multiply_adds
@@ -0,0 +1,232 @@
+"""Post-training quantization of the network's weights and activations.
+
+Two kinds of quantization are supported:
+
+* For Core ML models, the weights of each convolution and inner product layer are stored either as float16 or with
+  linear 8-bit quantization, where each output channel has its own scale and bias (weight = scale * q + bias for a
+  uint8 q). quantize_spec rewrites the weights of a Model protobuf specification, and quantize_weights applies the
+  same rounding to a dict of weights so that its effect on accuracy can be measured with inference.Network.
+* For servers, QuantizedNetwork runs the network of inference.Network with symmetric int8 weights (one scale per
+  output channel) and 8-bit activations, whose scales come from a calibration pass over example images. The weights
+  stay int8 in memory and the products are accumulated exactly, as with an int32 accumulator (see integer_dot).
+"""
+import numpy as np
+
+from . import inference, weights as weights_module
+
+
+# The modes of quantize_spec and quantize_weights, and the Core ML specification version each needs.
+SPECIFICATION_VERSIONS = {'float16': 2, 'linear8': 3}
+
+LAYERS = ['conv1', 'conv2', 'conv3', 'fc1', 'fc2']
+
+# float32 holds every integer up to 2 ** 24 exactly. The product of an int8 weight and an 8-bit activation is at most
+# 127 * 255 in magnitude, so any partial sum of up to EXACT_TERMS of them is exact too, in whatever order it's added.
+EXACT_TERMS = 2 ** 24 // (127 * 255)
+
+
+def linear_quantize(rows, bits=8):
+    """Quantize each row of a 2D array to 2 ** bits levels between its minimum and maximum.
+
+    Returns q, scale and bias such that rows is approximately scale[:, None] * q + bias[:, None].
+    """
+    low = rows.min(axis=1)
+    high = rows.max(axis=1)
+    scale = (high - low) / (2 ** bits - 1)
+
+    # A constant row is stored exactly with any scale.
+    scale[scale == 0] = 1.0
+
+    q = np.round((rows - low[:, np.newaxis]) / scale[:, np.newaxis])
+    return q.astype(np.uint8 if bits <= 8 else np.uint16), scale.astype(np.float32), low.astype(np.float32)
+
+
+def quantize_weights(weights, mode):
+    """Return a copy of weights with the weight matrices rounded the way quantize_spec stores them."""
+    if mode not in SPECIFICATION_VERSIONS:
+        raise ValueError('Unknown quantization mode "%s".' % mode)
+
+    result = dict(weights)
+
+    # Including both factors of factorized layers, which are separate layers in the Core ML model.
+    for name in weights_module.names_of(weights):
+        if not name.startswith('W_'):
+            continue
+
+        W = np.asarray(weights[name], dtype=np.float32)
+
+        if mode == 'float16':
+            result[name] = W.astype(np.float16).astype(np.float32)
+            continue
+
+        # The output channels are the last axis in TensorFlow's layout and the rows of the quantized matrix.
+        rows = W.reshape(-1, W.shape[-1]).T
+        q, scale, bias = linear_quantize(rows)
+        result[name] = (q * scale[:, np.newaxis] + bias[:, np.newaxis]).T.reshape(W.shape)
+
+    return result
+
+
+def quantize_spec(spec, mode):
+    """Store the weights of the convolution and inner product layers of a Core ML Model specification as float16
+    ('float16') or linearly quantized to 8 bits per output channel ('linear8'). The biases stay float32."""
+    if mode not in SPECIFICATION_VERSIONS:
+        raise ValueError('Unknown quantization mode "%s".' % mode)
+
+    for layer in spec.neuralNetwork.layers:
+        kind = layer.WhichOneof('layer')
+
+        if kind not in ('convolution', 'innerProduct'):
+            continue
+
+        params = getattr(layer, kind)
+
+        # Core ML orders the weights of both layer types by output channel first.
+        rows = np.array(params.weights.floatValue, dtype=np.float32).reshape(params.outputChannels, -1)
+        params.weights.ClearField('floatValue')
+
+        if mode == 'float16':
+            params.weights.float16Value = rows.astype('<f2').tobytes()
+        else:
+            q, scale, bias = linear_quantize(rows)
+            params.weights.rawValue = q.tobytes()
+            params.weights.quantization.numberOfBits = 8
+            params.weights.quantization.linearQuantization.scale.extend(scale)
+            params.weights.quantization.linearQuantization.bias.extend(bias)
+
+    spec.specificationVersion = max(spec.specificationVersion, SPECIFICATION_VERSIONS[mode])
+
+
+def symmetric_quantize(W):
+    """Quantize W to int8 with one scale for each output channel (the last axis). Returns the int8 array and the
+    scales."""
+    scale = np.abs(W.reshape(-1, W.shape[-1])).max(axis=0) / 127.
+    scale[scale == 0] = 1.0
+    return np.clip(np.round(W / scale), -127, 127).astype(np.int8), scale.astype(np.float32)
+
+
+def integer_dot(x, W):
+    """Return the matrix product of the 8-bit integer matrices x and W as int32, exactly.
+
+    NumPy's integer matrix product doesn't use BLAS and is tens of times slower than its float32 one. Instead, the inner
+    dimension is split in blocks of EXACT_TERMS, each block is multiplied as float32, which is exact, and the blocks
+    are added as int32.
+    """
+    y = np.zeros((x.shape[0], W.shape[1]), dtype=np.int32)
+
+    for start in range(0, x.shape[1], EXACT_TERMS):
+        end = start + EXACT_TERMS
+        y += np.dot(x[:, start:end].astype(np.float32), W[start:end].astype(np.float32)).astype(np.int32)
+
+    return y
+
+
+class _RecordingNetwork(inference.Network):
+    """A float network that records a percentile of the absolute values of each layer's input."""
+
+    def __init__(self, weights, percentile, batch_size=256):
+        inference.Network.__init__(self, weights, batch_size)
+        self.percentile = percentile
+        self.ranges = dict((layer, 0.0) for layer in LAYERS)
+
+    def record(self, layer, x):
+        self.ranges[layer] = max(self.ranges[layer], float(np.percentile(np.abs(x), self.percentile)))
+
+    def conv(self, layer, x):
+        self.record(layer, x)
+        return inference.Network.conv(self, layer, x)
+
+    def fc(self, layer, x):
+        self.record(layer, x)
+        return inference.Network.fc(self, layer, x)
+
+
+def calibrate(weights, images, percentile=99.99, batch_size=256):
+    """Run the float network over images and return the range of the input of each layer.
+
+    Values beyond the range are clipped when the input is quantized. A percentile slightly below 100 keeps a few
+    outliers from coarsening the steps for all the other values.
+    """
+    network = _RecordingNetwork(weights, percentile, batch_size)
+    network.logits(images)
+    return network.ranges
+
+
+class QuantizedNetwork(inference.Network):
+    def __init__(self, weights, activation_ranges, batch_size=256):
+        """An int8 version of inference.Network.
+
+        activation_ranges is returned by calibrate. The input image is quantized to int8 and the inputs of the other
+        layers, which come after a ReLU, to uint8.
+
+        Factorized layers (see weights.factorize_weights) aren't supported.
+
+        The weights are kept as int8 and converted to float32 one block at a time by integer_dot, so each layer's
+        result is exactly that of an int32 accumulator, scaled back to float32 before the bias is added.
+        """
+        if any(rank is not None for rank in weights_module.ranks(weights)):
+            raise ValueError('The int8 network doesn\'t support factorized layers.')
+
+        self.batch_size = batch_size
+        self.weights = {}
+        self.weight_scales = {}
+        self.activation_scales = {}
+
+        for layer in LAYERS:
+            q, scale = symmetric_quantize(np.asarray(weights['W_' + layer], dtype=np.float32))
+            self.weights['W_' + layer] = q.reshape(-1, q.shape[-1])
+            self.weights['b_' + layer] = np.asarray(weights['b_' + layer], dtype=np.float32)
+            self.weight_scales[layer] = scale
+
+            levels = 127. if layer == 'conv1' else 255.
+            self.activation_scales[layer] = max(activation_ranges[layer], 1e-8) / levels
+
+    def quantize_input(self, layer, x):
+        if layer == 'conv1':
+            return np.clip(np.round(x / self.activation_scales[layer]), -127, 127).astype(np.int8)
+
+        return np.clip(np.round(x / self.activation_scales[layer]), 0, 255).astype(np.uint8)
+
+    def dequantized_dot(self, layer, x):
+        y = integer_dot(x, self.weights['W_' + layer]).astype(np.float32)
+        y *= self.activation_scales[layer] * self.weight_scales[layer]
+        y += self.weights['b_' + layer]
+        return y
+
+    def conv(self, layer, x):
+        count, height, width, _ = x.shape
+        y = self.dequantized_dot(layer, inference.im2col_3x3(self.quantize_input(layer, x)))
+        np.maximum(y, 0, out=y)
+        return y.reshape(count, height, width, -1)
+
+    def fc(self, layer, x):
+        return self.dequantized_dot(layer, self.quantize_input(layer, x))
+
+
+def save_quantized(file_name, weights, activation_ranges):
+    """Save the int8 weights, their scales and the activation ranges to a compressed .npz file."""
+    arrays = {}
+
+    for layer in LAYERS:
+        q, scale = symmetric_quantize(np.asarray(weights['W_' + layer], dtype=np.float32))
+        arrays['W_' + layer] = q
+        arrays['W_%s_scale' % layer] = scale
+        arrays['b_' + layer] = np.asarray(weights['b_' + layer], dtype=np.float32)
+        arrays['%s_range' % layer] = np.float32(activation_ranges[layer])
+
+    np.savez_compressed(file_name, **arrays)
+
+
+def load_quantized(file_name, batch_size=256):
+    """Load a QuantizedNetwork saved by save_quantized."""
+    with np.load(file_name) as f:
+        weights = {}
+        ranges = {}
+
+        for layer in LAYERS:
+            # Quantizing the dequantized weights again gives back the same int8 values and scales.
+            weights['W_' + layer] = f['W_' + layer].astype(np.float32) * f['W_%s_scale' % layer]
+            weights['b_' + layer] = f['b_' + layer]
+            ranges[layer] = float(f['%s_range' % layer])
+
+    return QuantizedNetwork(weights, ranges, batch_size)
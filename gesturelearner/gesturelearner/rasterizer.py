@@ -0,0 +1,204 @@
+"""Rasterize drawings the way GestureInput does, with NumPy.
+
+This mirrors Drawing.fitIn(rect:) and Drawing.rasterized() in apps/Common/Drawing.swift: the drawing is scaled to fit
+a 35x35 box centered in the 45x45 image, then its strokes are drawn in white on black with a 4 pixel wide line with
+round caps and joins.
+
+A pixel's value is its coverage by the stroked path, computed from the distance of its center to the nearest stroke
+segment: pixels within half the stroke width are white and coverage falls off linearly over one pixel beyond that.
+This matches Core Graphics' antialiasing closely (see rasterize.py --check).
+"""
+import numpy as np
+
+from .constants import *
+import protobuf.touches_pb2 as touches_pb2
+
+
+FIT_IN_BOX_SIZE = 35
+STROKE_WIDTH = 4.0
+
+# Limits the size of the (pixels, segments) distance matrices.
+MAX_SEGMENTS_PER_PASS = 256
+
+# rasterize_batch splits segments into pieces at most this long, so each piece only touches a small window of pixels.
+MAX_PIECE_LENGTH = 2.0
+
+
+def drawing_strokes(drawing):
+    """Return the strokes of a touches_pb2.Drawing as a list of (samples, 2) arrays of x, y positions."""
+    return [np.array([(sample.position.x, sample.position.y) for sample in stroke.samples],
+                     dtype=np.float64).reshape(-1, 2)
+            for stroke in drawing.strokes]
+
+
+def bounding_rect(strokes):
+    """Return (left, top, width, height) like the Swift boundingRect.
+
+    As in Swift, an empty stroke has the bounding rect CGRect.zero, which still counts towards the union.
+    """
+    points = [stroke if len(stroke) > 0 else np.zeros((1, 2)) for stroke in strokes]
+
+    if len(points) == 0:
+        return 0., 0., 0., 0.
+
+    points = np.concatenate(points)
+    left, top = points.min(axis=0)
+    right, bottom = points.max(axis=0)
+    return left, top, right - left, bottom - top
+
+
+def fit_in(strokes, rect):
+    """Scale and move strokes so that they fit in rect = (left, top, width, height), keeping their aspect ratio."""
+    left, top, width, height = bounding_rect(strokes)
+    rect_left, rect_top, rect_width, rect_height = rect
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if width / height > rect_width / rect_height:
+            scale_factor = rect_width / width
+        else:
+            scale_factor = rect_height / height
+
+        new_left = rect_left + rect_width / 2.0 - width * scale_factor / 2.0
+        new_top = rect_top + rect_height / 2.0 - height * scale_factor / 2.0
+
+        offset = np.array([new_left, new_top]) - np.array([left, top]) * scale_factor
+        return [stroke * scale_factor + offset for stroke in strokes]
+
+
+def stroke_segments(strokes):
+    """Return the line segments of strokes as an (n, 4) array of x0, y0, x1, y1.
+
+    As with Core Graphics, a stroke with a single sample is only a move and isn't drawn.
+    """
+    segments = [np.concatenate([stroke[:-1], stroke[1:]], axis=1) for stroke in strokes if len(stroke) > 1]
+
+    if len(segments) == 0:
+        return np.zeros((0, 4))
+
+    segments = np.concatenate(segments)
+
+    # A degenerate drawing (e.g. a single point) scales to NaN and, as on the device, draws nothing.
+    return segments[np.isfinite(segments).all(axis=1)]
+
+
+def segment_distances(points, segments):
+    """Return the distance from each of the (n, 2) points to the nearest of the segments."""
+    distances = np.full(len(points), np.inf)
+
+    for start in range(0, len(segments), MAX_SEGMENTS_PER_PASS):
+        chunk = segments[start:start + MAX_SEGMENTS_PER_PASS]
+        a = chunk[:, :2]
+        ab = chunk[:, 2:] - a
+        length_squared = (ab ** 2).sum(axis=1)
+
+        ap = points[:, np.newaxis, :] - a[np.newaxis]
+        t = (ap * ab[np.newaxis]).sum(axis=2) / np.where(length_squared > 0, length_squared, 1)[np.newaxis]
+        t = np.clip(t, 0, 1)
+
+        nearest = ap - t[..., np.newaxis] * ab[np.newaxis]
+        distances = np.minimum(distances, np.sqrt((nearest ** 2).sum(axis=2)).min(axis=1))
+
+    return distances
+
+
+def pixel_centers(height=IMAGE_HEIGHT, width=IMAGE_WIDTH):
+    y, x = np.mgrid[0:height, 0:width] + 0.5
+    return np.stack([x.ravel(), y.ravel()], axis=1)
+
+
+def rasterize_segments(segments, stroke_width=STROKE_WIDTH, height=IMAGE_HEIGHT, width=IMAGE_WIDTH):
+    """Draw segments (already in pixel coordinates) and return a (height, width) uint8 image."""
+    if len(segments) == 0:
+        return np.zeros((height, width), dtype=np.uint8)
+
+    distances = segment_distances(pixel_centers(height, width), segments)
+    coverage = np.clip(stroke_width / 2.0 + 0.5 - distances, 0, 1)
+    return np.round(coverage * 255).astype(np.uint8).reshape(height, width)
+
+
+def split_segments(segments, max_length=MAX_PIECE_LENGTH):
+    """Split segments into pieces no longer than max_length. Returns the pieces and the segment each came from."""
+    lengths = np.hypot(segments[:, 2] - segments[:, 0], segments[:, 3] - segments[:, 1])
+    piece_counts = np.maximum(1, np.ceil(lengths / max_length)).astype(np.int64)
+
+    sources = np.repeat(np.arange(len(segments)), piece_counts)
+    piece_indexes = np.arange(len(sources)) - np.repeat(np.cumsum(piece_counts) - piece_counts, piece_counts)
+
+    start = segments[sources, :2]
+    direction = segments[sources, 2:] - start
+    t0 = (piece_indexes / piece_counts[sources])[:, np.newaxis]
+    t1 = ((piece_indexes + 1) / piece_counts[sources])[:, np.newaxis]
+
+    return np.concatenate([start + t0 * direction, start + t1 * direction], axis=1), sources
+
+
+def rasterize_batch(segments, segment_images, count, stroke_widths=STROKE_WIDTH, height=IMAGE_HEIGHT,
+                    width=IMAGE_WIDTH):
+    """Draw the segments of many images at once and return a (count, height, width) uint8 array.
+
+    segment_images gives the image each segment belongs to and stroke_widths is a scalar or one width per image. The
+    result is the same as calling rasterize_segments for each image, but instead of measuring the distance from every
+    pixel to every segment, each short piece of a segment only covers the window of pixels around it, and all the
+    windows of the batch are computed together.
+    """
+    canvas = np.zeros(count * height * width)
+
+    if len(segments) == 0:
+        return canvas.astype(np.uint8).reshape(count, height, width)
+
+    half_widths = np.broadcast_to(np.asarray(stroke_widths, dtype=np.float64), (count,)) / 2.0 + 0.5
+
+    pieces, sources = split_segments(segments)
+    piece_images = segment_images[sources]
+    reach = half_widths[piece_images]
+
+    window_size = int(np.ceil(MAX_PIECE_LENGTH + 2 * half_widths.max())) + 1
+    window = np.arange(window_size)
+    left = np.floor(np.minimum(pieces[:, 0], pieces[:, 2]) - reach).astype(np.int64)
+    top = np.floor(np.minimum(pieces[:, 1], pieces[:, 3]) - reach).astype(np.int64)
+
+    # (pieces, window_size) pixel columns and rows, then the distance of each window pixel's center to its piece.
+    columns = left[:, np.newaxis] + window
+    rows = top[:, np.newaxis] + window
+
+    a = pieces[:, :2]
+    ab = pieces[:, 2:] - a
+    length_squared = (ab ** 2).sum(axis=1)
+    length_squared[length_squared == 0] = 1
+
+    ax = (columns + 0.5 - a[:, 0:1])[:, np.newaxis, :]
+    ay = (rows + 0.5 - a[:, 1:2])[:, :, np.newaxis]
+    t = np.clip((ax * ab[:, 0, np.newaxis, np.newaxis] + ay * ab[:, 1, np.newaxis, np.newaxis])
+                / length_squared[:, np.newaxis, np.newaxis], 0, 1)
+    distances = np.hypot(ax - t * ab[:, 0, np.newaxis, np.newaxis], ay - t * ab[:, 1, np.newaxis, np.newaxis])
+
+    coverage = np.clip(reach[:, np.newaxis, np.newaxis] - distances, 0, 1)
+
+    inside = ((rows >= 0) & (rows < height))[:, :, np.newaxis] & ((columns >= 0) & (columns < width))[:, np.newaxis, :]
+    pixel_indexes = (piece_images[:, np.newaxis, np.newaxis] * height + rows[:, :, np.newaxis]) * width \
+        + columns[:, np.newaxis, :]
+    inside &= coverage > 0
+
+    np.maximum.at(canvas, pixel_indexes[inside], coverage[inside])
+
+    return np.round(canvas * 255).astype(np.uint8).reshape(count, height, width)
+
+
+def rasterize(strokes, stroke_width=STROKE_WIDTH, height=IMAGE_HEIGHT, width=IMAGE_WIDTH):
+    """Fit strokes (in screen coordinates) in the image like Drawing.rasterized() and return a uint8 image."""
+    margin_y = (height - FIT_IN_BOX_SIZE) / 2.0
+    margin_x = (width - FIT_IN_BOX_SIZE) / 2.0
+    fit_strokes = fit_in(strokes, (margin_x, margin_y, FIT_IN_BOX_SIZE, FIT_IN_BOX_SIZE))
+    return rasterize_segments(stroke_segments(fit_strokes), stroke_width, height, width)
+
+
+def rasterize_serialized_drawings(serialized_drawings):
+    """Rasterize a list of serialized touches_pb2.Drawing messages. Meant to run in a worker process."""
+    images = []
+
+    for serialized_drawing in serialized_drawings:
+        drawing = touches_pb2.Drawing()
+        drawing.ParseFromString(serialized_drawing)
+        images.append(rasterize(drawing_strokes(drawing)).tobytes())
+
+    return images
@@ -0,0 +1,22 @@
+"""Open data set files in any of the record formats that filter.py can write.
+
+Readers have the interface of scanner.TrainingSetScanner and writers that of scanner.TrainingSetWriter.
+"""
+from . import framed, scanner
+
+
+FORMATS = ['trainingset', 'framed']
+
+
+def open_records(file_name):
+    if framed.is_framed_file(file_name):
+        return framed.FramedReader(file_name)
+
+    return scanner.TrainingSetScanner(file_name)
+
+
+def open_writer(file_name, out_format):
+    if out_format == 'framed':
+        return framed.FramedWriter(file_name)
+
+    return scanner.TrainingSetWriter(file_name)
@@ -0,0 +1,271 @@
+"""Read and write .trainingset files without building protobuf messages.
+
+A TrainingSet is nothing but a sequence of length-delimited labelledImages fields, so a file can be walked record by
+record directly over an mmap. Each record's pixels are returned as a memoryview into the mapped file, which keeps
+memory use bounded by the page cache no matter how large the file is.
+
+Only the parts of the protobuf wire format needed for touches.proto are implemented here. Unknown fields are skipped.
+"""
+from collections import namedtuple
+import mmap
+
+import numpy as np
+
+
+# Field numbers from touches.proto.
+TRAINING_SET_LABELLED_IMAGES = 1
+LABELLED_IMAGE_IMAGE = 1
+LABELLED_IMAGE_LABEL = 2
+IMAGE_HEIGHT_FIELD = 1
+IMAGE_WIDTH_FIELD = 2
+IMAGE_VALUES_FIELD = 15
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+
+ScannedImage = namedtuple('ScannedImage', ['offset', 'label', 'height', 'width', 'values'])
+
+
+def read_varint(buffer, position):
+    """Return the varint starting at position and the position after it."""
+    result = 0
+    shift = 0
+
+    while True:
+        byte = buffer[position]
+        position += 1
+        result |= (byte & 0x7f) << shift
+
+        if byte < 0x80:
+            return result, position
+
+        shift += 7
+
+
+def encode_varint(value):
+    encoded = bytearray()
+
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+    return bytes(encoded)
+
+
+def skip_field(buffer, position, wire_type):
+    if wire_type == WIRE_VARINT:
+        return read_varint(buffer, position)[1]
+    if wire_type == WIRE_FIXED64:
+        return position + 8
+    if wire_type == WIRE_LENGTH_DELIMITED:
+        length, position = read_varint(buffer, position)
+        return position + length
+    if wire_type == WIRE_FIXED32:
+        return position + 4
+
+    raise ValueError('Unsupported wire type %s at byte %s.' % (wire_type, position))
+
+
+def parse_image(buffer, start, end):
+    """Return the (height, width, values) of the Image message in buffer[start:end]."""
+    height = 0
+    width = 0
+    values = buffer[start:start]
+    position = start
+
+    while position < end:
+        key, position = read_varint(buffer, position)
+        field, wire_type = key >> 3, key & 0x7
+
+        if field == IMAGE_HEIGHT_FIELD and wire_type == WIRE_VARINT:
+            height, position = read_varint(buffer, position)
+        elif field == IMAGE_WIDTH_FIELD and wire_type == WIRE_VARINT:
+            width, position = read_varint(buffer, position)
+        elif field == IMAGE_VALUES_FIELD and wire_type == WIRE_LENGTH_DELIMITED:
+            length, position = read_varint(buffer, position)
+            values = buffer[position:position + length]
+            position += length
+        else:
+            position = skip_field(buffer, position, wire_type)
+
+    return height, width, values
+
+
+def parse_labelled_image(buffer, start, end, with_image=True):
+    """Return the (label, height, width, values) of the LabelledImage message in buffer[start:end].
+
+    With with_image=False only the label is decoded and the other values are None.
+    """
+    label = 0
+    image_start = image_end = None
+    position = start
+
+    while position < end:
+        key, position = read_varint(buffer, position)
+        field, wire_type = key >> 3, key & 0x7
+
+        if field == LABELLED_IMAGE_LABEL and wire_type == WIRE_VARINT:
+            label, position = read_varint(buffer, position)
+        elif field == LABELLED_IMAGE_IMAGE and wire_type == WIRE_LENGTH_DELIMITED:
+            length, position = read_varint(buffer, position)
+            image_start, image_end = position, position + length
+            position += length
+        else:
+            position = skip_field(buffer, position, wire_type)
+
+    if not with_image:
+        return label, None, None, None
+
+    if image_start is None:
+        return (label,) + parse_image(buffer, start, start)
+
+    return (label,) + parse_image(buffer, image_start, image_end)
+
+
+def encode_labelled_image(label, height, width, values):
+    """Serialize a LabelledImage the same way protobuf does (proto3 omits default values)."""
+    image = bytearray()
+
+    if height != 0:
+        image += encode_varint(IMAGE_HEIGHT_FIELD << 3 | WIRE_VARINT) + encode_varint(height)
+    if width != 0:
+        image += encode_varint(IMAGE_WIDTH_FIELD << 3 | WIRE_VARINT) + encode_varint(width)
+    if len(values) > 0:
+        image += encode_varint(IMAGE_VALUES_FIELD << 3 | WIRE_LENGTH_DELIMITED) + encode_varint(len(values))
+        image += values
+
+    labelled_image = bytearray()
+
+    if len(image) > 0:
+        labelled_image += encode_varint(LABELLED_IMAGE_IMAGE << 3 | WIRE_LENGTH_DELIMITED)
+        labelled_image += encode_varint(len(image)) + image
+
+    if label != 0:
+        labelled_image += encode_varint(LABELLED_IMAGE_LABEL << 3 | WIRE_VARINT) + encode_varint(label)
+
+    return bytes(labelled_image)
+
+
+class TrainingSetScanner(object):
+    """Walks the records of a .trainingset file over an mmap.
+
+    Records are identified by their offset: the position in the file of the labelledImages field that holds them.
+    The memoryviews returned for pixels and record bytes point into the mapped file. If any are still alive at
+    close(), the mapping is only closed once they have been garbage collected.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self._file = open(file_name, 'rb')
+
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._buffer = memoryview(self._mmap)
+        except ValueError:
+            # Empty files can't be memory-mapped.
+            self._mmap = None
+            self._buffer = memoryview(b'')
+
+    def close(self):
+        self._buffer.release()
+
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _records(self, start=0, end=None):
+        """Yield (offset, payload start, payload end) for every record with start <= offset < end."""
+        buffer = self._buffer
+        position = start
+
+        if end is None:
+            end = len(buffer)
+
+        while position < end:
+            offset = position
+            key, position = read_varint(buffer, position)
+            field, wire_type = key >> 3, key & 0x7
+
+            if field == TRAINING_SET_LABELLED_IMAGES and wire_type == WIRE_LENGTH_DELIMITED:
+                length, position = read_varint(buffer, position)
+                yield offset, position, position + length
+                position += length
+            else:
+                position = skip_field(buffer, position, wire_type)
+
+    def __iter__(self):
+        return self.scan()
+
+    def scan(self, start=0, end=None):
+        """Yield the records with start <= offset < end. start has to be the offset of a record (or 0)."""
+        for offset, payload_start, payload_end in self._records(start, end):
+            yield ScannedImage(offset, *parse_labelled_image(self._buffer, payload_start, payload_end))
+
+    def index(self):
+        """Return the offsets and labels of all records as two int64 arrays, without decoding any images."""
+        offsets = []
+        labels = []
+
+        for offset, start, end in self._records():
+            offsets.append(offset)
+            labels.append(parse_labelled_image(self._buffer, start, end, with_image=False)[0])
+
+        return np.array(offsets, dtype=np.int64), np.array(labels, dtype=np.int64)
+
+    def _payload_range(self, offset):
+        key, position = read_varint(self._buffer, offset)
+
+        if key != (TRAINING_SET_LABELLED_IMAGES << 3 | WIRE_LENGTH_DELIMITED):
+            raise ValueError('No record at offset %s of "%s".' % (offset, self.file_name))
+
+        length, position = read_varint(self._buffer, position)
+        return position, position + length
+
+    def record_at(self, offset, with_image=True):
+        start, end = self._payload_range(offset)
+        return ScannedImage(offset, *parse_labelled_image(self._buffer, start, end, with_image))
+
+    def record_bytes(self, offset):
+        """Return the serialized LabelledImage at offset."""
+        start, end = self._payload_range(offset)
+        return self._buffer[start:end]
+
+
+class TrainingSetWriter(object):
+    """Writes a .trainingset file one serialized LabelledImage at a time."""
+
+    def __init__(self, file_name):
+        self.count = 0
+        self._file = open(file_name, 'wb')
+
+    def write_record(self, record_bytes):
+        self._file.write(encode_varint(TRAINING_SET_LABELLED_IMAGES << 3 | WIRE_LENGTH_DELIMITED))
+        self._file.write(encode_varint(len(record_bytes)))
+        self._file.write(record_bytes)
+        self.count += 1
+
+    def write(self, label, height, width, values):
+        self.write_record(encode_labelled_image(label, height, width, values))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,89 @@
+"""Decide when to lower the learning rate and when to stop training.
+
+PlateauSchedule follows a metric measured on held-out data (the test loss or accuracy). When it stops improving for
+decay_patience evaluations, the learning rate is multiplied by decay_factor, and when it hasn't improved for patience
+evaluations, training stops. Budget stops training after a number of steps or seconds, whichever comes first.
+"""
+import time
+
+
+class PlateauSchedule(object):
+    def __init__(self, learning_rate, mode='min', patience=10, decay_patience=4, decay_factor=0.5,
+                 min_learning_rate=1e-6, min_delta=1e-4):
+        """mode is 'min' for a metric that should decrease (a loss) and 'max' for one that should increase."""
+        if mode not in ('min', 'max'):
+            raise ValueError('mode must be "min" or "max", not "%s".' % mode)
+
+        self.learning_rate = learning_rate
+        self.mode = mode
+        self.patience = patience
+        self.decay_patience = decay_patience
+        self.decay_factor = decay_factor
+        self.min_learning_rate = min_learning_rate
+        self.min_delta = min_delta
+
+        self.best = None
+        self.best_step = None
+        self.evaluations_since_best = 0
+        self.evaluations_since_decay = 0
+
+    def is_improvement(self, value):
+        if self.best is None:
+            return True
+
+        if self.mode == 'min':
+            return value < self.best - self.min_delta
+
+        return value > self.best + self.min_delta
+
+    def update(self, step, value):
+        """Record the metric's value at step. Returns True if the learning rate changed."""
+        if self.is_improvement(value):
+            self.best = value
+            self.best_step = step
+            self.evaluations_since_best = 0
+            self.evaluations_since_decay = 0
+            return False
+
+        self.evaluations_since_best += 1
+        self.evaluations_since_decay += 1
+
+        if self.evaluations_since_decay >= self.decay_patience and self.learning_rate > self.min_learning_rate:
+            self.learning_rate = max(self.learning_rate * self.decay_factor, self.min_learning_rate)
+            self.evaluations_since_decay = 0
+            return True
+
+        return False
+
+    @property
+    def should_stop(self):
+        return self.evaluations_since_best >= self.patience
+
+
+class Budget(object):
+    def __init__(self, max_steps, max_seconds=None):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.start_time = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def is_exhausted(self, step):
+        return step >= self.max_steps or (self.max_seconds is not None and self.elapsed >= self.max_seconds)
+
+
+def savings(start_step, stop_step, elapsed, fixed_steps):
+    """Return the steps and (estimated) seconds saved by stopping at stop_step instead of running to fixed_steps.
+
+    The seconds are estimated from the average time per step of the steps that did run, from start_step.
+    """
+    steps_saved = max(0, fixed_steps - stop_step)
+
+    if stop_step > start_step:
+        seconds_saved = steps_saved * elapsed / (stop_step - start_step)
+    else:
+        seconds_saved = 0.0
+
+    return steps_saved, seconds_saved
@@ -0,0 +1,289 @@
+"""Augment raw drawings at the stroke level and rasterize them in batches.
+
+The drawings of a RawDataSet are kept as flat arrays of samples (see Drawings). An augmented batch is made by:
+
+1. Resampling every stroke in time: a stroke of n samples becomes about n * rate samples, uniformly spaced between its
+   first and last sample times, as if it had been drawn on a device with a different touch sampling rate.
+2. Applying a random affine transform (rotation, scaling along x and y and shear) to each drawing.
+3. Fitting each drawing in the image like Drawing.rasterized() does. Since this removes any change of overall size,
+   the scaling only changes a drawing's aspect ratio.
+4. Moving every sample by a random offset (jitter), in pixels.
+5. Rasterizing with a random stroke width per drawing (see rasterizer.rasterize_batch).
+
+Every step is vectorized over the whole batch.
+"""
+import collections
+import multiprocessing
+
+import numpy as np
+
+from . import rasterizer
+from .constants import *
+from .packed import epoch_batches, normalize_images, one_hot
+import protobuf.touches_pb2 as touches_pb2
+
+
+def ranges(starts, counts):
+    """Concatenate np.arange(start, start + count) for each start and count."""
+    return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+
+class Drawings(object):
+    """The drawings and labels of a RawDataSet, as flat arrays.
+
+    points and times hold every sample of every stroke in order. stroke_starts gives the first sample of each stroke
+    and drawing_strokes the first stroke of each drawing (both with a final entry for the end). An empty stroke is
+    stored as a single sample at (0, 0): like an empty stroke in Swift, it counts towards the drawing's bounding rect
+    but isn't drawn.
+    """
+
+    def __init__(self, points, times, stroke_starts, drawing_strokes, label_indexes):
+        self.points = points
+        self.times = times
+        self.stroke_starts = stroke_starts
+        self.drawing_strokes = drawing_strokes
+        self.label_indexes = label_indexes
+
+    def __len__(self):
+        return len(self.label_indexes)
+
+    @classmethod
+    def from_raw_data_set(cls, raw_data_set):
+        label_values = touches_pb2.Label.values()
+
+        points = []
+        times = []
+        stroke_starts = [0]
+        drawing_strokes = [0]
+
+        for drawing in raw_data_set.drawingList.drawings:
+            for stroke in drawing.strokes:
+                if len(stroke.samples) == 0:
+                    points.append((0., 0.))
+                    times.append(0.)
+                else:
+                    points.extend((sample.position.x, sample.position.y) for sample in stroke.samples)
+                    times.extend(sample.time for sample in stroke.samples)
+
+                stroke_starts.append(len(points))
+
+            drawing_strokes.append(len(stroke_starts) - 1)
+
+        label_indexes = [label_values.index(label) if label in label_values else 0 for label in raw_data_set.labels]
+
+        return cls(np.array(points, dtype=np.float64).reshape(-1, 2), np.array(times, dtype=np.float64),
+                   np.array(stroke_starts, dtype=np.int64), np.array(drawing_strokes, dtype=np.int64),
+                   np.array(label_indexes, dtype=np.uint8))
+
+    @classmethod
+    def load(cls, file_name):
+        raw_data_set = touches_pb2.RawDataSet()
+
+        with open(file_name, 'rb') as f:
+            raw_data_set.ParseFromString(f.read())
+
+        if len(raw_data_set.drawingList.drawings) != len(raw_data_set.labels):
+            raise ValueError('"%s" has %s drawings but %s labels.'
+                             % (file_name, len(raw_data_set.drawingList.drawings), len(raw_data_set.labels)))
+
+        return cls.from_raw_data_set(raw_data_set)
+
+    def strokes_of(self, drawing_indexes):
+        """Return the indexes of the strokes of the given drawings and the position (in drawing_indexes) of each."""
+        first = self.drawing_strokes[drawing_indexes]
+        counts = self.drawing_strokes[np.asarray(drawing_indexes) + 1] - first
+        return ranges(first, counts), np.repeat(np.arange(len(first)), counts)
+
+
+def resample_strokes(drawings, strokes, rates):
+    """Resample strokes uniformly in time, each at rates[i] times its number of samples.
+
+    Returns the new points and the number of points of each stroke. Strokes keep at least their first and last sample.
+    """
+    starts = drawings.stroke_starts[strokes]
+    counts = drawings.stroke_starts[strokes + 1] - starts
+    sample_indexes = ranges(starts, counts)
+    sample_strokes = np.repeat(np.arange(len(strokes)), counts)
+
+    # Normalize each stroke's times to [0, 1] (or its sample positions, if its samples all have the same time) and
+    # offset stroke i to [2i, 2i + 1], so a single np.interp over all samples never mixes two strokes.
+    times = drawings.times[sample_indexes]
+    first_times = np.full(len(strokes), np.inf)
+    last_times = np.full(len(strokes), -np.inf)
+    np.minimum.at(first_times, sample_strokes, times)
+    np.maximum.at(last_times, sample_strokes, times)
+    durations = last_times - first_times
+
+    positions = np.arange(len(sample_indexes)) - np.repeat(np.cumsum(counts) - counts, counts)
+    by_time = (times - np.repeat(first_times, counts)) / np.repeat(np.where(durations > 0, durations, 1), counts)
+    by_position = positions / np.repeat(np.maximum(counts - 1, 1), counts)
+    normalized = np.where(np.repeat(durations > 0, counts), by_time, by_position)
+
+    # Sort within strokes, since sample times aren't guaranteed to increase.
+    keys = sample_strokes * 2.0 + normalized
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    points = drawings.points[sample_indexes][order]
+
+    new_counts = np.where(counts > 1, np.maximum(2, np.round(counts * rates)).astype(np.int64), counts)
+    new_strokes = np.repeat(np.arange(len(strokes)), new_counts)
+    new_positions = np.arange(new_counts.sum()) - np.repeat(np.cumsum(new_counts) - new_counts, new_counts)
+    new_keys = new_strokes * 2.0 + new_positions / np.repeat(np.maximum(new_counts - 1, 1), new_counts)
+
+    new_points = np.stack([np.interp(new_keys, keys, points[:, 0]), np.interp(new_keys, keys, points[:, 1])], axis=1)
+    return new_points, new_counts
+
+
+def fit_in_batch(points, point_images, count, box_size=rasterizer.FIT_IN_BOX_SIZE, height=IMAGE_HEIGHT,
+                 width=IMAGE_WIDTH):
+    """Like rasterizer.fit_in with the box of rasterizer.rasterize, for the points of many drawings at once."""
+    minimum = np.full((count, 2), np.inf)
+    maximum = np.full((count, 2), -np.inf)
+    np.minimum.at(minimum, point_images, points)
+    np.maximum.at(maximum, point_images, points)
+
+    size = maximum - minimum
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale_factors = box_size / size.max(axis=1)
+        center = np.array([width / 2.0, height / 2.0])
+        offsets = center - (minimum + size / 2.0) * scale_factors[:, np.newaxis]
+        return points * scale_factors[point_images, np.newaxis] + offsets[point_images]
+
+
+class StrokeAugmenter(object):
+    """Makes randomly augmented images of drawings.
+
+    Angles are in degrees. Each parameter is the largest change in either direction: with rotation=10, drawings are
+    rotated by a uniformly random angle between -10 and 10 degrees. scale is the largest relative change of the
+    width and height, resample_rate that of the number of samples per stroke and stroke_width that of the stroke
+    width, while jitter is the standard deviation of the per-sample offsets in pixels.
+    """
+
+    def __init__(self, drawings, rotation=10.0, scale=0.15, shear=0.15, jitter=0.3, resample_rate=0.5,
+                 stroke_width=0.25, seed=None):
+        self.drawings = drawings
+        self.rotation = rotation
+        self.scale = scale
+        self.shear = shear
+        self.jitter = jitter
+        self.resample_rate = resample_rate
+        self.stroke_width = stroke_width
+        self.random_state = np.random.RandomState(seed)
+
+    def _uniform(self, amount, count, center=0.0):
+        return center + self.random_state.uniform(-amount, amount, count)
+
+    def affine_matrices(self, count):
+        """Return random (count, 2, 2) matrices, each a scale, then a shear, then a rotation."""
+        angles = np.radians(self._uniform(self.rotation, count))
+        cos, sin = np.cos(angles), np.sin(angles)
+        rotations = np.stack([np.stack([cos, -sin], axis=1), np.stack([sin, cos], axis=1)], axis=1)
+
+        shears = np.tile(np.eye(2), (count, 1, 1))
+        shears[:, 0, 1] = self._uniform(self.shear, count)
+
+        scales = np.zeros((count, 2, 2))
+        scales[:, 0, 0] = self._uniform(self.scale, count, 1.0)
+        scales[:, 1, 1] = self._uniform(self.scale, count, 1.0)
+
+        return np.matmul(rotations, np.matmul(shears, scales))
+
+    def augment(self, drawing_indexes):
+        """Return augmented images of the given drawings as a (count, IMAGE_HEIGHT, IMAGE_WIDTH) uint8 array."""
+        drawing_indexes = np.asarray(drawing_indexes, dtype=np.int64)
+        count = len(drawing_indexes)
+
+        strokes, stroke_images = self.drawings.strokes_of(drawing_indexes)
+
+        if self.resample_rate > 0:
+            points, point_counts = resample_strokes(self.drawings, strokes,
+                                                    self._uniform(self.resample_rate, len(strokes), 1.0))
+        else:
+            starts = self.drawings.stroke_starts[strokes]
+            point_counts = self.drawings.stroke_starts[strokes + 1] - starts
+            points = self.drawings.points[ranges(starts, point_counts)]
+
+        point_images = np.repeat(stroke_images, point_counts)
+
+        points = np.einsum('nij,nj->ni', self.affine_matrices(count)[point_images], points)
+        points = fit_in_batch(points, point_images, count)
+
+        if self.jitter > 0:
+            points += self.random_state.normal(0, self.jitter, points.shape)
+
+        # Segments join consecutive points of the same stroke.
+        point_strokes = np.repeat(np.arange(len(strokes)), point_counts)
+        same_stroke = point_strokes[1:] == point_strokes[:-1]
+        segments = np.concatenate([points[:-1], points[1:]], axis=1)[same_stroke]
+        segment_images = point_images[:-1][same_stroke]
+
+        finite = np.isfinite(segments).all(axis=1)
+
+        stroke_widths = rasterizer.STROKE_WIDTH * self._uniform(self.stroke_width, count, 1.0)
+        return rasterizer.rasterize_batch(segments[finite], segment_images[finite], count, stroke_widths)
+
+    def batches(self, batch_size, shuffle=True):
+        """Yield (images, labels) batches of augmented drawings forever, like packed.PackedDataset.batches."""
+        if len(self.drawings) == 0:
+            raise ValueError('Can\'t make batches of an empty dataset.')
+
+        batch_size = min(batch_size, len(self.drawings))
+
+        while True:
+            if shuffle:
+                order = self.random_state.permutation(len(self.drawings))
+            else:
+                order = np.arange(len(self.drawings))
+
+            for start in range(0, len(order) - batch_size + 1, batch_size):
+                indexes = order[start:start + batch_size]
+                yield normalize_images(self.augment(indexes)), one_hot(self.drawings.label_indexes[indexes])
+
+
+_worker_augmenter = None
+
+
+def _start_worker(file_name, options):
+    global _worker_augmenter
+    _worker_augmenter = StrokeAugmenter(Drawings.load(file_name), **options)
+
+
+def _augment_batch(indexes, batch_seed):
+    # Reseeding for every batch makes its augmentation independent of the worker that happens to make it.
+    if batch_seed is not None:
+        _worker_augmenter.random_state.seed(batch_seed)
+
+    return _worker_augmenter.augment(indexes), _worker_augmenter.drawings.label_indexes[indexes]
+
+
+def parallel_batches(file_name, batch_size, workers=None, seed=None, start_batch=0, **options):
+    """Like StrokeAugmenter.batches, but the drawings of file_name are augmented in a pool of worker processes.
+
+    options are passed on to StrokeAugmenter. At most two batches per worker are in flight at any time. With a seed,
+    every batch is the same every time, whatever the number of workers: its drawings are chosen by
+    packed.epoch_batches and batch n (counting from 0, not from start_batch) is augmented with the seed (seed, n), so
+    resuming at start_batch gives the batches an uninterrupted run would have.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    count = len(Drawings.load(file_name))
+
+    # Fails on an empty file before any worker is started.
+    batches = epoch_batches(count, batch_size, seed=seed, start_batch=start_batch)
+
+    pool = multiprocessing.Pool(workers, _start_worker, (file_name, options))
+    pending = collections.deque()
+
+    try:
+        for batch_number, indexes in enumerate(batches, start_batch):
+            batch_seed = None if seed is None else [seed, batch_number]
+            pending.append(pool.apply_async(_augment_batch, (indexes, batch_seed)))
+
+            if len(pending) < 2 * workers:
+                continue
+
+            images, batch_label_indexes = pending.popleft().get()
+            yield normalize_images(images), one_hot(batch_label_indexes)
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,109 @@
+"""Hyperparameter search: sampling trials from a search space and pruning them early.
+
+A search space maps each hyperparameter to a list of values to choose from or to {"uniform": [low, high]} or
+{"log_uniform": [low, high]}, e.g. as a JSON file:
+
+    {"learning_rate": {"log_uniform": [1e-5, 1e-3]}, "batch_size": [32, 50, 64], "keep_prob": {"uniform": [0.3, 0.8]}}
+
+AshaScheduler implements asynchronous successive halving (ASHA): every trial is evaluated at a few rungs of
+geometrically increasing steps, and stops at a rung unless its result is among the best 1 / reduction_factor of the
+results recorded at that rung so far. Trials never wait for each other, so a pool of processes stays busy.
+"""
+import json
+import math
+
+import numpy as np
+
+
+DEFAULT_SPACE = {
+    'learning_rate': {'log_uniform': [1e-5, 1e-3]},
+    'batch_size': [32, 50, 64, 100],
+    'keep_prob': {'uniform': [0.3, 0.8]}
+}
+
+
+class SearchSpace(object):
+    def __init__(self, space):
+        for name, spec in space.items():
+            if isinstance(spec, dict):
+                if len(spec) != 1 or list(spec)[0] not in ('uniform', 'log_uniform'):
+                    raise ValueError('Hyperparameter "%s" must have one of "uniform" and "log_uniform".' % name)
+            elif not isinstance(spec, list) or len(spec) == 0:
+                raise ValueError('Hyperparameter "%s" must be a list of values or a distribution.' % name)
+
+        self.space = space
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as f:
+            return cls(json.load(f))
+
+    @property
+    def names(self):
+        return sorted(self.space)
+
+    def sample(self, random_state):
+        """Return a dict of one value of each hyperparameter."""
+        params = {}
+
+        for name in self.names:
+            spec = self.space[name]
+
+            if isinstance(spec, list):
+                params[name] = spec[random_state.randint(len(spec))]
+            elif 'uniform' in spec:
+                low, high = spec['uniform']
+                params[name] = float(random_state.uniform(low, high))
+            else:
+                low, high = spec['log_uniform']
+                params[name] = float(np.exp(random_state.uniform(np.log(low), np.log(high))))
+
+        return params
+
+
+def rung_steps(min_steps, max_steps, reduction_factor=3):
+    """Return the steps at which trials are compared: min_steps, min_steps * reduction_factor, ... below max_steps."""
+    steps = []
+    step = min_steps
+
+    while step < max_steps:
+        steps.append(step)
+        step *= reduction_factor
+
+    return steps
+
+
+class AshaScheduler(object):
+    def __init__(self, min_steps, max_steps, reduction_factor=3, results=None, lock=None):
+        """results and lock may be a multiprocessing.Manager's dict and Lock, to share the scheduler between processes.
+
+        Higher results are better.
+        """
+        self.rungs = rung_steps(min_steps, max_steps, reduction_factor)
+        self.reduction_factor = reduction_factor
+        self.results = results if results is not None else {}
+        self.lock = lock
+
+    def report(self, step, value):
+        """Record a trial's result at step. Returns False if the trial should stop, True if it should continue.
+
+        Steps that aren't rungs are not recorded and always continue.
+        """
+        if step not in self.rungs:
+            return True
+
+        if self.lock is not None:
+            with self.lock:
+                return self._report(step, value)
+
+        return self._report(step, value)
+
+    def _report(self, step, value):
+        # Reassigned rather than appended to, so that the change reaches a Manager's dict.
+        recorded = self.results.get(step, []) + [value]
+        self.results[step] = recorded
+
+        keep = max(1, int(math.floor(len(recorded) / float(self.reduction_factor))))
+        better = sum(1 for other in recorded if other > value)
+
+        return better < keep
@@ -0,0 +1,145 @@
+"""The network's weights as a dict of NumPy arrays, keyed by the names make_network gives them.
+
+Weights can be read from a checkpoint or from the variables of a session, and saved to and loaded from a compressed
+.npz file, which can be read without TensorFlow.
+
+A fully connected layer factorized to a lower rank (see factorize) has the weights W_fc1_u and W_fc1_v, whose product
+approximates W_fc1, instead of W_fc1.
+"""
+import numpy as np
+
+
+# In the order make_network creates them, which is also the order of their names in a checkpoint: make_network's
+# variables aren't named, so TensorFlow calls them Variable, Variable_1, ..., Variable_9.
+WEIGHT_NAMES = ['W_conv1', 'b_conv1', 'W_conv2', 'b_conv2', 'W_conv3', 'b_conv3', 'W_fc1', 'b_fc1', 'W_fc2', 'b_fc2']
+
+CONV_LAYERS = ['conv1', 'conv2', 'conv3']
+
+FACTORIZABLE_LAYERS = ['fc1', 'fc2']
+
+
+def weight_names(fc1_rank=None, fc2_rank=None):
+    """Return the names of the weights of make_network(input, fc1_rank, fc2_rank), in the order it creates them."""
+    names = []
+
+    for name in WEIGHT_NAMES:
+        if name == 'W_fc1' and fc1_rank is not None or name == 'W_fc2' and fc2_rank is not None:
+            names.extend([name + '_u', name + '_v'])
+        else:
+            names.append(name)
+
+    return names
+
+
+def names_of(weights):
+    """Return the names of the weights in a dict of weights, in the order make_network creates them."""
+    return weight_names(*ranks(weights))
+
+
+def ranks(weights):
+    """Return the ranks (fc1_rank, fc2_rank) of the factorized layers of a dict of weights, None for the others."""
+    return tuple(weights['W_%s_u' % layer].shape[1] if 'W_%s_u' % layer in weights else None
+                 for layer in FACTORIZABLE_LAYERS)
+
+
+def checkpoint_variable_name(index):
+    return 'Variable' if index == 0 else 'Variable_%d' % index
+
+
+def load_checkpoint(checkpoint):
+    """Read the weights from a checkpoint without building the network."""
+    reader = new_checkpoint_reader(checkpoint)
+    names = weight_names(*ranks_from_shapes(reader.get_variable_to_shape_map()))
+
+    return dict((name, reader.get_tensor(checkpoint_variable_name(index))) for index, name in enumerate(names))
+
+
+def checkpoint_network_options(checkpoint):
+    """Return the keyword arguments of make_network for the network of a checkpoint: the ranks of its factorized
+    layers and the number of filters of its (possibly pruned) convolutional layers."""
+    shapes = new_checkpoint_reader(checkpoint).get_variable_to_shape_map()
+    fc1_rank, fc2_rank = ranks_from_shapes(shapes)
+
+    conv_channels = tuple(shapes[checkpoint_variable_name(WEIGHT_NAMES.index('W_' + layer))][3]
+                          for layer in CONV_LAYERS)
+
+    return {'fc1_rank': fc1_rank, 'fc2_rank': fc2_rank, 'conv_channels': conv_channels}
+
+
+def network_options(weights):
+    """Like checkpoint_network_options, for a dict of weights."""
+    fc1_rank, fc2_rank = ranks(weights)
+    conv_channels = tuple(weights['W_' + layer].shape[3] for layer in CONV_LAYERS)
+
+    return {'fc1_rank': fc1_rank, 'fc2_rank': fc2_rank, 'conv_channels': conv_channels}
+
+
+def new_checkpoint_reader(checkpoint):
+    # Imported here so that the rest of this module (and inference.py) works without TensorFlow.
+    import tensorflow as tf
+
+    return tf.train.NewCheckpointReader(checkpoint)
+
+
+def ranks_from_shapes(shapes):
+    """Return the ranks of the factorized layers of a checkpoint with the given variable shapes.
+
+    A factorized layer has two matrices before its bias instead of one.
+    """
+    layer_ranks = []
+    position = WEIGHT_NAMES.index('W_fc1')
+
+    for layer in FACTORIZABLE_LAYERS:
+        if len(shapes[checkpoint_variable_name(position + 1)]) == 2:
+            layer_ranks.append(shapes[checkpoint_variable_name(position)][1])
+            position += 3
+        else:
+            layer_ranks.append(None)
+            position += 2
+
+    return tuple(layer_ranks)
+
+
+def from_variables(sess, variables):
+    """Evaluate the weight variables returned by make_network."""
+    factorized = [True if 'W_%s_u' % layer in variables else None for layer in FACTORIZABLE_LAYERS]
+    return sess.run(dict((name, variables[name]) for name in weight_names(*factorized)))
+
+
+def save(file_name, weights):
+    np.savez_compressed(file_name, **dict((name, np.asarray(weights[name], dtype=np.float32))
+                                          for name in names_of(weights)))
+
+
+def load(file_name):
+    with np.load(file_name) as f:
+        return dict((name, f[name]) for name in f.files)
+
+
+def factorize(W, rank):
+    """Return u and v of shapes (rows, rank) and (rank, columns) whose product is the best rank-rank approximation of
+    W, splitting the singular values evenly between them."""
+    u, s, v = np.linalg.svd(W, full_matrices=False)
+    root = np.sqrt(s[:rank])
+    return (u[:, :rank] * root).astype(np.float32), (root[:, np.newaxis] * v[:rank]).astype(np.float32)
+
+
+def factorize_weights(weights, fc1_rank=None, fc2_rank=None):
+    """Return a copy of weights with W_fc1 and/or W_fc2 factorized to the given ranks."""
+    result = dict(weights)
+
+    for layer, rank in zip(FACTORIZABLE_LAYERS, [fc1_rank, fc2_rank]):
+        if rank is None:
+            continue
+
+        if 'W_%s_u' % layer in weights:
+            raise ValueError('%s is already factorized.' % layer)
+
+        result['W_%s_u' % layer], result['W_%s_v' % layer] = factorize(weights['W_' + layer], rank)
+        del result['W_' + layer]
+
+    return result
+
+
+def parameter_count(weights):
+    return sum(np.asarray(weights[name]).size for name in names_of(weights))
@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+import click
+import numpy as np
+
+from gesturelearner import checkpointing, data, fine_tuning, graph, inference, packed, pruning, weights
+
+
+@click.command()
+@click.argument('model-in')
+@click.argument('training-file')
+@click.argument('test-file')
+@click.option('--levels', default='0.25,0.5,0.75', help='Comma-separated fractions of the filters of each '
+                                                       'convolutional layer to remove.')
+@click.option('--method', type=click.Choice(pruning.SCORE_METHODS), default='magnitude',
+              help='Remove the filters with the smallest weights or the smallest mean activation.')
+@click.option('--score-images', default=5000, help='Training images used to measure the activations.')
+@click.option('--fine-tune-steps', default=1000)
+@click.option('--learning-rate', default=1e-5)
+@click.option('--batch-size', default=50)
+@click.option('--eval-batch-size', default=500)
+@click.option('--out-dir', default='.', help='Where to save the pruned checkpoints and Core ML models.')
+@click.option('--protobuf', is_flag=True,
+              help='Write the Core ML models with save_mlmodel_using_protobuf instead of coremltools\' builder.')
+@click.option('--repeats', default=200, help='Single images classified for measuring latency.')
+def main(model_in, training_file, test_file, levels, method, score_images, fine_tune_steps, learning_rate,
+         batch_size, eval_batch_size, out_dir, protobuf, repeats):
+    """Remove the weakest filters of the convolutional layers of a model at each level, fine-tune and compare.
+
+    Each pruned model is saved as OUT_DIR/model-prunedP.ckpt and OUT_DIR/model-prunedP.mlmodel, where P is the
+    percentage of filters removed. The table compares their filters per layer, parameters, FLOPs per image, test
+    accuracy before and after fine-tuning, and latency with the NumPy engine.
+    """
+    checkpoint = checkpointing.latest(model_in)
+
+    if checkpoint is None:
+        print('Couldn\'t find model "%s".' % model_in, file=sys.stderr)
+        return
+
+    model_weights = weights.load_checkpoint(checkpoint)
+    test_images, test_labels = data.read_test_file(test_file)
+    label_indexes = np.argmax(test_labels, 1)
+    save = graph.save_mlmodel_using_protobuf if protobuf else graph.save_mlmodel
+
+    score_input = None
+
+    if method == 'activation':
+        score_input = packed.normalize_images(data.read_image_arrays(training_file, score_images)[0])
+
+    # The filters are ranked once, on the unpruned model, so that each level removes a superset of the filters of the
+    # levels below it.
+    scores = pruning.filter_scores(model_weights, method, score_input, eval_batch_size)
+
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+
+    def describe(name, variant_weights, accuracy_before, accuracy_after):
+        save(os.path.join(out_dir, 'model-%s.mlmodel' % name), variant_weights)
+
+        network = inference.Network(variant_weights, eval_batch_size)
+        latency, _ = inference.measure_speed(network.predict, test_images, eval_batch_size, repeats)
+
+        if accuracy_after is None:
+            accuracy_after = np.mean(np.argmax(network.predict(test_images), 1) == label_indexes)
+
+        channels = '/'.join(str(count) for count in weights.network_options(variant_weights)['conv_channels'])
+
+        return (name, channels, weights.parameter_count(variant_weights), pruning.flops(variant_weights),
+                accuracy_before, accuracy_after, latency)
+
+    rows = [describe('full', model_weights, None, None)]
+
+    for level in [float(level) for level in levels.split(',')]:
+        pruned = pruning.prune_weights(model_weights, pruning.keep_strongest(scores, 1 - level))
+        name = 'pruned%d' % round(100 * level)
+
+        pruned, accuracy_before, accuracy_after = fine_tuning.fine_tune(
+            pruned, training_file, test_images, test_labels, fine_tune_steps, learning_rate, batch_size,
+            eval_batch_size, os.path.join(out_dir, 'model-%s.ckpt' % name))
+        print('%g of the filters removed: testing accuracy %g after pruning, %g after fine-tuning'
+              % (level, accuracy_before, accuracy_after))
+
+        rows.append(describe(name, pruned, accuracy_before, accuracy_after))
+
+    full_flops, full_accuracy, full_latency = rows[0][3], rows[0][5], rows[0][6]
+
+    print()
+    print('%-10s %10s %10s %8s %8s %10s %10s %9s %12s %8s'
+          % ('model', 'filters', 'params', 'MFLOPs', 'fewer', 'pruned', 'fine-tuned', 'delta', 'latency (ms)',
+             'speedup'))
+
+    for name, channels, parameters, model_flops, accuracy_before, accuracy_after, latency in rows:
+        before = '%10.4f' % accuracy_before if accuracy_before is not None else '%10s' % '-'
+        print('%-10s %10s %10d %8.1f %7.1fx %s %10.4f %+9.4f %12.2f %7.2fx'
+              % (name, channels, parameters, model_flops / 1e6, full_flops / float(model_flops), before,
+                 accuracy_after, accuracy_after - full_accuracy, 1000. * latency, full_latency / latency))
+
+
+if __name__ == '__main__':
+    main()
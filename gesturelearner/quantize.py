@@ -0,0 +1,100 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+
+import click
+import numpy as np
+
+from gesturelearner import checkpointing, data, graph, inference, quantization, weights
+
+
+@click.command()
+@click.argument('model-in')
+@click.argument('test-file')
+@click.option('--calibration-images', default=1000, help='Test images used to measure the range of each layer\'s input.')
+@click.option('--percentile', default=99.99, help='The percentile of each layer\'s input that is quantized without '
+                                                 'clipping.')
+@click.option('--out-dir', help='Keep the quantized models in this directory.')
+@click.option('--batch-size', default=256)
+@click.option('--repeats', default=200, help='Single images classified for measuring latency.')
+def main(model_in, test_file, calibration_images, percentile, out_dir, batch_size, repeats):
+    """Quantize a model in every supported way and report the accuracy, size and speed of each variant.
+
+    The Core ML variants (float32, float16 and linear8 .mlmodel files) are scored with the NumPy engine on weights
+    rounded the same way. Their latency can only be measured on a device. The int8 variant is the server-side
+    QuantizedNetwork, saved as a .npz file. It keeps its weights as int8, but since NumPy has no fast integer matrix
+    product, its latency is expected to be somewhat above that of the float32 engine.
+    """
+    checkpoint = checkpointing.latest(model_in)
+
+    if checkpoint is None:
+        print('Couldn\'t find model "%s".' % model_in, file=sys.stderr)
+        return
+
+    model_weights = weights.load_checkpoint(checkpoint)
+    test_images, test_labels = data.read_test_file(test_file)
+    label_indexes = np.argmax(test_labels, 1)
+
+    # The first test images calibrate the activation ranges of the int8 network.
+    activation_ranges = quantization.calibrate(model_weights, test_images[:calibration_images], percentile,
+                                               batch_size)
+
+    directory = out_dir if out_dir is not None else tempfile.mkdtemp()
+    rows = []
+
+    try:
+        for name, mode in [('float32', None), ('float16', 'float16'), ('linear8', 'linear8')]:
+            file_name = os.path.join(directory, 'model-%s.mlmodel' % name)
+            graph.save_mlmodel_using_protobuf(file_name, model_weights, mode)
+
+            variant_weights = model_weights if mode is None else quantization.quantize_weights(model_weights, mode)
+            network = inference.Network(variant_weights, batch_size)
+            rows.append((name + ' .mlmodel', network, os.path.getsize(file_name), False))
+
+        file_name = os.path.join(directory, 'model-float32.npz')
+        weights.save(file_name, model_weights)
+        rows.append(('float32 .npz', inference.Network(model_weights, batch_size), os.path.getsize(file_name), True))
+
+        # The int8 network doesn't support factorized layers.
+        if not any(rank is not None for rank in weights.ranks(model_weights)):
+            file_name = os.path.join(directory, 'model-int8.npz')
+            quantization.save_quantized(file_name, model_weights, activation_ranges)
+            rows.append(('int8 .npz', quantization.load_quantized(file_name, batch_size), os.path.getsize(file_name),
+                         True))
+    finally:
+        if out_dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    reference = None
+
+    print('%-18s %9s %9s %12s %10s %14s %12s'
+          % ('variant', 'accuracy', 'delta', 'size (KB)', 'reduction', 'latency (ms)', 'images/sec'))
+
+    for name, network, size, timed in rows:
+        probabilities = network.predict(test_images)
+        accuracy = np.mean(np.argmax(probabilities, 1) == label_indexes)
+
+        if reference is None:
+            reference = accuracy, size
+
+        if timed:
+            latency, throughput = inference.measure_speed(network.predict, test_images, batch_size, repeats)
+            speed = '%14.2f %12.0f' % (1000. * latency, throughput)
+        else:
+            speed = '%14s %12s' % ('-', '-')
+
+        print('%-18s %9.4f %+9.4f %12.0f %9.1fx %s'
+              % (name, accuracy, accuracy - reference[0], size / 1024., reference[1] / float(size), speed))
+
+    if out_dir is not None:
+        print()
+        print('Saved the models in %s.' % out_dir)
+
+
+if __name__ == '__main__':
+    main()
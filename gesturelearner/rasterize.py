@@ -0,0 +1,105 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import sys
+
+import click
+import numpy as np
+
+from gesturelearner import rasterizer, scanner
+from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH
+import protobuf.touches_pb2 as touches_pb2
+
+
+@click.command()
+@click.argument('in-file')
+@click.option('--out-file')
+@click.option('--workers', type=int, help='Number of rasterizing processes. Defaults to one per CPU.')
+@click.option('--chunk-size', default=200, help='Number of drawings sent to a worker at a time.')
+@click.option('--check', 'reference_file',
+              help='A .trainingset rasterized by GestureInput from the same data set to compare the result with.')
+@click.option('--tolerance', default=16, help='The largest difference (out of 255) for pixels to count as agreeing.')
+def main(in_file, out_file, workers, chunk_size, reference_file, tolerance):
+    """Rasterize a .dataset file of raw drawings from GestureInput into a .trainingset file."""
+    if out_file is None:
+        out_file = os.path.splitext(in_file)[0] + '.trainingset'
+
+    try:
+        f = open(in_file, 'rb')
+        raw_data_set = touches_pb2.RawDataSet()
+        raw_data_set.ParseFromString(f.read())
+        f.close()
+    except FileNotFoundError:
+        print('Could not find in-file "' + in_file + '"', file=sys.stderr)
+        return
+
+    drawings = raw_data_set.drawingList.drawings
+    labels = list(raw_data_set.labels)
+
+    if len(drawings) != len(labels):
+        print('The in-file has %s drawings but %s labels.' % (len(drawings), len(labels)), file=sys.stderr)
+        return
+
+    chunks = [[drawing.SerializeToString() for drawing in drawings[start:start + chunk_size]]
+              for start in range(0, len(drawings), chunk_size)]
+    del raw_data_set
+
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count())
+
+    try:
+        with scanner.TrainingSetWriter(out_file) as writer:
+            for images in pool.imap(rasterizer.rasterize_serialized_drawings, chunks):
+                for image in images:
+                    writer.write(labels[writer.count], IMAGE_HEIGHT, IMAGE_WIDTH, image)
+    finally:
+        pool.close()
+        pool.join()
+
+    print('Saved %s images to "%s".' % (writer.count, out_file))
+
+    if reference_file is not None:
+        check(out_file, reference_file, tolerance)
+
+
+def check(file_name, reference_file, tolerance):
+    """Print how well the images of file_name agree with those of reference_file, pixel by pixel."""
+    agreeing_pixels = 0
+    total_pixels = 0
+    absolute_difference = 0
+    mismatched_labels = 0
+    worst_agreement = 1.0
+
+    with scanner.TrainingSetScanner(file_name) as source, scanner.TrainingSetScanner(reference_file) as reference:
+        for record, reference_record in zip(source, reference):
+            if record.label != reference_record.label:
+                mismatched_labels += 1
+
+            if (record.height, record.width) != (reference_record.height, reference_record.width):
+                continue
+
+            difference = np.abs(np.frombuffer(record.values, dtype=np.uint8).astype(np.int32)
+                                - np.frombuffer(reference_record.values, dtype=np.uint8))
+
+            agreeing = (difference <= tolerance).sum()
+            agreeing_pixels += agreeing
+            total_pixels += difference.size
+            absolute_difference += difference.sum()
+            worst_agreement = min(worst_agreement, agreeing / difference.size)
+
+    if total_pixels == 0:
+        print('No images to compare.')
+        return
+
+    print('Pixels within %s of the reference: %.2f%% (worst image: %.2f%%)'
+          % (tolerance, 100. * agreeing_pixels / total_pixels, 100. * worst_agreement))
+    print('Mean absolute difference: %.3f' % (absolute_difference / total_pixels))
+
+    if mismatched_labels > 0:
+        print('%s images have a different label than the reference.' % mismatched_labels)
+
+
+if __name__ == '__main__':
+    main()
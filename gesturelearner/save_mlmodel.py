@@ -1,36 +1,87 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
 import os
+import re
+import sys
 
 import click
 import tensorflow as tf
 
-from gesturelearner import graph
-from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH
+from gesturelearner import checkpointing, graph, quantization, weights
 
 
 @click.command()
-@click.argument('model-in')
-@click.option('--file-out')
-def main(model_in, file_out):
-    if file_out is None:
-        [file_name, extension] = os.path.splitext(model_in)
-        file_out = file_name + '.mlmodel'
+@click.argument('models-in', nargs=-1, required=True)
+@click.option('--file-out', help='The file to save to, when converting a single model. Defaults to the name of the '
+                                 'model with the extension .mlmodel.')
+@click.option('--out-dir', help='The directory to save the models to. Defaults to the directory of each model.')
+@click.option('--protobuf', is_flag=True,
+              help='Write the MLModel specification directly instead of using coremltools\' builder.')
+@click.option('--quantize', type=click.Choice(sorted(quantization.SPECIFICATION_VERSIONS)),
+              help='Store the weights as float16, or with 8 bits per weight and a scale and bias per output channel '
+                   '(linear8, which needs iOS 12).')
+def main(models_in, file_out, out_dir, protobuf, quantize):
+    """Convert checkpoints (or .npz files written by save_weights.py) to Core ML models.
+
+    The weights are read straight from the checkpoint files without building the network, so converting many models
+    in one run costs little more than reading them.
+    """
+    if file_out is not None and len(models_in) > 1:
+        print('--file-out can only be used with a single model. Use --out-dir instead.', file=sys.stderr)
+        return
 
-    # Create the graph.
-    predicted_labels, variables = graph.make_network(tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1]))
+    save = graph.save_mlmodel_using_protobuf if protobuf else graph.save_mlmodel
 
-    saver = tf.train.Saver()
+    for model_in in models_in:
+        model_weights = read_weights(model_in)
 
-    with tf.Session() as sess:
-        try:
-            saver.restore(sess, model_in)
-            print('Restored model from file: %s' % model_in)
-        except tf.errors.NotFoundError:
-            print('Couldn\'t find model "%s".' % model_in)
-            return
+        if model_weights is None:
+            print('Couldn\'t find model "%s".' % model_in, file=sys.stderr)
+            continue
 
-        graph.save_mlmodel(file_out, variables)
+        if file_out is not None:
+            model_file_out = file_out
+        else:
+            model_file_out = mlmodel_file_name(model_in)
 
-        return
+            if out_dir is not None:
+                model_file_out = os.path.join(out_dir, os.path.basename(model_file_out))
+
+        save(model_file_out, model_weights, quantize)
+
+
+def mlmodel_file_name(model_in):
+    """model.ckpt to model.mlmodel, and a numbered checkpoint such as model.ckpt-500 to model-500.mlmodel, so that the
+    checkpoints of one model don't overwrite each other's .mlmodel files."""
+    match = re.match(r'^(.*)\.ckpt(-\d+)?$', model_in)
+
+    if match is not None:
+        return match.group(1) + (match.group(2) or '') + '.mlmodel'
+
+    [file_name, extension] = os.path.splitext(model_in)
+    return file_name + '.mlmodel'
+
+
+def read_weights(model_in):
+    """Return the weights of a checkpoint or .npz file as a dict of arrays, or None if there is no such model."""
+    if model_in.endswith('.npz'):
+        return weights.load(model_in) if os.path.exists(model_in) else None
+
+    # With async checkpoints, model-in may be the name of the model rather than of one of its checkpoints.
+    checkpoint = checkpointing.latest(model_in)
+
+    if checkpoint is None:
+        return None
+
+    try:
+        model_weights = weights.load_checkpoint(checkpoint)
+    except (tf.errors.NotFoundError, tf.errors.DataLossError):
+        return None
+
+    print('Read model from file: %s' % checkpoint)
+    return model_weights
 
 
 if __name__ == '__main__':
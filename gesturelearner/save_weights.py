@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+
+import click
+import tensorflow as tf
+
+from gesturelearner import checkpointing, weights
+
+
+@click.command()
+@click.argument('model-in')
+@click.option('--file-out')
+def main(model_in, file_out):
+    """Save the weights of a checkpoint to a .npz file for gesturelearner/inference.py, which doesn't need
+    TensorFlow."""
+    if file_out is None:
+        [file_name, extension] = os.path.splitext(model_in)
+        file_out = file_name + '.npz'
+
+    # With async checkpoints, model-in may be the name of the model rather than of one of its checkpoints.
+    checkpoint = checkpointing.latest(model_in) or model_in
+
+    try:
+        model_weights = weights.load_checkpoint(checkpoint)
+    except (tf.errors.NotFoundError, tf.errors.DataLossError):
+        print('Couldn\'t find model "%s".' % model_in, file=sys.stderr)
+        return
+
+    weights.save(file_out, model_weights)
+    print('Saved to file: %s' % file_out)
+
+
+if __name__ == '__main__':
+    main()
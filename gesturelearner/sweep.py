@@ -0,0 +1,216 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import csv
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from gesturelearner import data, evaluation, graph, packed, tuning
+from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH, NUM_LABEL_INDEXES
+
+
+@click.command()
+@click.argument('training-file')
+@click.argument('test-file')
+@click.option('--space', 'space_file', help='A JSON search space (see gesturelearner/tuning.py). Defaults to the '
+                                            'learning rate, batch size and dropout keep probability.')
+@click.option('--trials', default=50)
+@click.option('--workers', type=int, help='Trials run at a time. Defaults to one per CPU.')
+@click.option('--threads-per-trial', type=int, help='Defaults to the number of CPUs divided by the workers.')
+@click.option('--max-steps', default=20000, help='The steps of a trial that is never pruned.')
+@click.option('--min-steps', default=500, help='The steps before a trial can first be pruned.')
+@click.option('--reduction-factor', default=3, help='Only 1 in this many trials continues past each rung.')
+@click.option('--max-seconds', type=float, help='Stop all trials after this long.')
+@click.option('--eval-batch-size', default=500)
+@click.option('--results', default='sweep.csv', help='The file to write the results table to.')
+@click.option('--shared-dir', help='Where to keep the decoded data while the trials run. Defaults to /dev/shm.')
+@click.option('--seed', type=int, help='Seed for sampling the trials.')
+def main(training_file, test_file, space_file, trials, workers, threads_per_trial, max_steps, min_steps,
+         reduction_factor, max_seconds, eval_batch_size, results, shared_dir, seed):
+    """Train trials of the network with hyperparameters sampled from a search space and prune the worst early."""
+    space = tuning.SearchSpace.load(space_file) if space_file is not None else tuning.SearchSpace(tuning.DEFAULT_SPACE)
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+
+    if threads_per_trial is None:
+        threads_per_trial = max(1, multiprocessing.cpu_count() // workers)
+
+    if shared_dir is None and os.path.isdir('/dev/shm'):
+        shared_dir = '/dev/shm'
+
+    # Decode both sets once into packed files in shared memory. Every trial memory-maps them, so they share the same
+    # pages instead of each decoding and holding its own copy.
+    directory = tempfile.mkdtemp(prefix='sweep-', dir=shared_dir)
+
+    try:
+        shared_training_file = share(training_file, os.path.join(directory, 'training.packed'))
+        shared_test_file = share(test_file, os.path.join(directory, 'test.packed'))
+
+        manager = multiprocessing.Manager()
+        scheduler = tuning.AshaScheduler(min_steps, max_steps, reduction_factor, manager.dict(), manager.Lock())
+        deadline = time.time() + max_seconds if max_seconds is not None else None
+
+        random_state = np.random.RandomState(seed)
+        tasks = [(trial, space.sample(random_state), random_state.randint(2 ** 31 - 1), shared_training_file,
+                  shared_test_file, scheduler, max_steps, eval_batch_size, threads_per_trial, deadline)
+                 for trial in range(trials)]
+
+        print('Running %d trials in %d processes, comparing them at steps %s.'
+              % (trials, workers, ', '.join(str(step) for step in scheduler.rungs)))
+
+        start_time = time.time()
+        trial_results = []
+
+        # A new process for each trial, so that each starts with its own TensorFlow state.
+        pool = multiprocessing.Pool(workers, maxtasksperchild=1)
+
+        try:
+            for result in pool.imap_unordered(run_trial, tasks):
+                trial_results.append(result)
+                print('trial %d: %s after %d steps, testing accuracy %g (%s)'
+                      % (result['trial'], result['status'], result['steps'], result['accuracy'],
+                         format_params(result['params'])))
+                sys.stdout.flush()
+        finally:
+            pool.terminate()
+            pool.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    write_results(results, trial_results, space.names)
+    print_results(trial_results, space.names)
+
+    total_steps = sum(result['steps'] for result in trial_results)
+    print()
+    print('%d trials trained for %d steps in %.0f seconds, instead of %d steps without pruning.'
+          % (len(trial_results), total_steps, time.time() - start_time, len(trial_results) * max_steps))
+    print('Wrote the results to %s.' % results)
+
+
+def share(file_pattern, shared_file):
+    """Decode the examples of file_pattern into the packed file shared_file and return its name.
+
+    A packed file is already shared through the page cache, so it is used directly.
+    """
+    file_names = data.expand_file_pattern(file_pattern)
+
+    if packed.is_packed_file(file_names[0]):
+        return file_names[0]
+
+    images, label_indexes = data.read_image_arrays(file_pattern)
+
+    with packed.PackedWriter(shared_file) as writer:
+        writer.write_arrays(images, label_indexes)
+
+    return shared_file
+
+
+def run_trial(task):
+    """Train one trial until it is pruned, reaches max_steps or runs out of time, and return its results."""
+    (trial, params, seed, training_file, test_file, scheduler, max_steps, eval_batch_size, threads,
+     deadline) = task
+
+    result = {'trial': trial, 'params': params, 'status': 'completed', 'steps': 0, 'accuracy': float('nan'),
+              'loss': float('nan'), 'seconds': 0.0}
+
+    if deadline is not None and time.time() >= deadline:
+        result['status'] = 'not run'
+        return result
+
+    start_time = time.time()
+
+    with tf.Graph().as_default():
+        tf.set_random_seed(seed)
+
+        train_images, train_labels = data.packed_input(training_file, params.get('batch_size', 50), seed=seed)
+        test_images, test_labels = packed.PackedDataset(test_file).arrays()
+
+        images_input = tf.placeholder_with_default(train_images, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        labels_input = tf.placeholder_with_default(train_labels, [None, NUM_LABEL_INDEXES])
+
+        predicted_labels, variables = graph.make_network(images_input)
+        cross_entropy = tf.reduce_mean(
+            tf.nn.softmax_cross_entropy_with_logits(labels=labels_input, logits=predicted_labels))
+        train_step = tf.train.AdamOptimizer(params.get('learning_rate', 1e-4)).minimize(cross_entropy)
+
+        evaluator = evaluation.Evaluator(images_input, labels_input, predicted_labels, test_images, test_labels,
+                                         eval_batch_size)
+
+        config = tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+
+        with tf.Session(config=config) as sess:
+            sess.run(tf.group(tf.global_variables_initializer(), tf.local_variables_initializer()))
+
+            for step in range(1, max_steps + 1):
+                sess.run(train_step, {variables['keep_prob']: params.get('keep_prob', 0.5)})
+                result['steps'] = step
+
+                out_of_time = deadline is not None and time.time() >= deadline
+
+                # Trials are only evaluated at the rungs and when they finish.
+                if step not in scheduler.rungs and step != max_steps and not out_of_time:
+                    continue
+
+                evaluation_result = evaluator.evaluate(sess, {variables['keep_prob']: 1.0})
+                result['accuracy'] = float(evaluation_result.accuracy)
+                result['loss'] = float(evaluation_result.loss)
+
+                if out_of_time:
+                    result['status'] = 'out of time'
+                    break
+
+                if not scheduler.report(step, result['accuracy']):
+                    result['status'] = 'pruned'
+                    break
+
+    result['seconds'] = time.time() - start_time
+    return result
+
+
+def format_params(params):
+    return ', '.join('%s=%s' % (name, format_value(params[name])) for name in sorted(params))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return '%.4g' % value
+    return str(value)
+
+
+def sorted_results(trial_results):
+    # Trials that never ran have a NaN accuracy and go last.
+    return sorted(trial_results, key=lambda result: (np.isnan(result['accuracy']), -np.nan_to_num(result['accuracy']),
+                                                     result['trial']))
+
+
+def write_results(file_name, trial_results, names):
+    with open(file_name, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(['trial', 'status', 'steps', 'accuracy', 'loss', 'seconds'] + names)
+
+        for result in sorted_results(trial_results):
+            writer.writerow([result['trial'], result['status'], result['steps'], result['accuracy'], result['loss'],
+                             '%.1f' % result['seconds']] + [result['params'].get(name) for name in names])
+
+
+def print_results(trial_results, names):
+    print()
+    print('%-6s %-12s %7s %9s %9s  %s' % ('trial', 'status', 'steps', 'accuracy', 'loss', 'hyperparameters'))
+
+    for result in sorted_results(trial_results):
+        print('%-6d %-12s %7d %9.4f %9.4f  %s' % (result['trial'], result['status'], result['steps'],
+                                                   result['accuracy'], result['loss'], format_params(result['params'])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from gesturelearner import dedup, scanner
+
+
+SAMPLE_DATA = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'sample_data')
+
+
+def hash_sample_data(with_perceptual_hashes):
+    with scanner.TrainingSetScanner(os.path.join(SAMPLE_DATA, 'data.trainingset')) as training_set:
+        return dedup.hash_records(training_set, with_perceptual_hashes)
+
+
+def test_exact_duplicates():
+    index = dedup.DedupIndex('unused')
+    hashes = np.array([5, 3, 5, 7], dtype=np.uint64)
+    labels = np.zeros(4, dtype=np.int64)
+
+    assert list(index.add(hashes, labels)) == [True, True, False, True]
+    assert list(index.add(np.array([7, 8], dtype=np.uint64), labels[:2])) == [False, True]
+    assert len(index) == 4
+
+
+def test_near_duplicates_keep_their_exact_hashes(tmpdir):
+    hashes, labels, perceptual = hash_sample_data(True)
+    directory = str(tmpdir.join('index'))
+
+    index = dedup.DedupIndex(directory, max_distance=4)
+    is_new = index.add(hashes, labels, perceptual)
+    index.save()
+
+    # Some records are only near duplicates, so fewer survive than have distinct exact hashes.
+    assert is_new.sum() < len(np.unique(hashes))
+    assert len(index) == len(np.unique(hashes))
+    assert len(index.perceptual) == is_new.sum()
+
+    # None of the records are new to the index when it is reopened for exact duplicates only, or with another
+    # distance.
+    for max_distance in [0, 2]:
+        reopened = dedup.DedupIndex(directory, max_distance)
+        assert not reopened.add(hashes, labels, perceptual).any()
+
+
+def test_hash_records_in_chunks():
+    hashes, labels, perceptual = hash_sample_data(True)
+
+    with scanner.TrainingSetScanner(os.path.join(SAMPLE_DATA, 'data.trainingset')) as training_set:
+        chunked = dedup.hash_records(training_set, True, chunk_size=7)
+
+    for expected, array in zip([hashes, labels, perceptual], chunked):
+        assert np.array_equal(array, expected)
+
+
+def test_files_already_added(tmpdir):
+    directory = str(tmpdir.join('index'))
+    index = dedup.DedupIndex(directory)
+    index.add(np.array([9, 1, 5], dtype=np.uint64), np.zeros(3, dtype=np.int64), file_checksum='abc')
+    index.add(np.array([3], dtype=np.uint64), np.zeros(1, dtype=np.int64))
+    index.save()
+
+    reopened = dedup.DedupIndex(directory)
+    assert list(reopened.hashes) == [1, 3, 5, 9]
+    assert reopened.has_file('abc')
+    assert not reopened.has_file('def')
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+import pytest
+
+from gesturelearner import framed, records
+
+
+def write_framed_file(file_name, count, close=True, write_index=True):
+    writer = framed.FramedWriter(file_name, write_index)
+
+    for i in range(count):
+        writer.write(i % 5, 2, 3, bytes(bytearray(range(i, i + 6))))
+
+    if close:
+        writer.close()
+    else:
+        writer.flush()
+
+    return writer
+
+
+def check_records(scanned_images, count):
+    scanned_images = list(scanned_images)
+
+    assert [record.label for record in scanned_images] == [i % 5 for i in range(count)]
+    assert [bytes(record.values) for record in scanned_images] == [bytes(bytearray(range(i, i + 6)))
+                                                                   for i in range(count)]
+    assert all(record.height == 2 and record.width == 3 for record in scanned_images)
+
+    return scanned_images
+
+
+@pytest.mark.parametrize('write_index', [True, False])
+def test_round_trip(tmpdir, write_index):
+    file_name = str(tmpdir.join('data.framed'))
+    write_framed_file(file_name, 10, write_index=write_index)
+
+    assert framed.is_framed_file(file_name)
+
+    with records.open_records(file_name) as reader:
+        scanned_images = check_records(reader, 10)
+
+        offsets, labels = reader.index()
+        assert list(offsets) == [record.offset for record in scanned_images]
+        assert (reader.footer_offsets() is not None) == write_index
+
+        assert reader.record_at(scanned_images[3].offset).label == 3
+        del scanned_images
+
+    check_records(framed.follow(file_name, timeout=1), 10)
+
+
+def test_unfinished_file(tmpdir):
+    file_name = str(tmpdir.join('data.framed'))
+    writer = write_framed_file(file_name, 4, close=False)
+
+    # A reader stops at the last complete frame. A follower waits for more until it times out.
+    with framed.FramedReader(file_name) as reader:
+        check_records(reader, 4)
+
+    with pytest.raises(framed.FollowTimeoutError):
+        list(framed.follow(file_name, poll_interval=0.01, timeout=0.1))
+
+    writer.close()
+
+
+def test_follow_while_writing(tmpdir):
+    file_name = str(tmpdir.join('data.framed'))
+
+    def write():
+        time.sleep(0.1)
+        writer = framed.FramedWriter(file_name)
+
+        for i in range(framed.FLUSH_INTERVAL * 2 + 10):
+            writer.write(i % 5, 2, 3, bytes(bytearray(range(i % 250, i % 250 + 6))))
+
+            if i == framed.FLUSH_INTERVAL:
+                time.sleep(0.1)
+
+        writer.close()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+
+    try:
+        scanned_images = list(framed.follow(file_name, poll_interval=0.01, timeout=5))
+    finally:
+        thread.join()
+
+    assert len(scanned_images) == framed.FLUSH_INTERVAL * 2 + 10
+
+
+def test_missing_and_empty_files(tmpdir):
+    file_name = str(tmpdir.join('missing.framed'))
+
+    with pytest.raises(framed.FollowTimeoutError):
+        list(framed.follow(file_name, poll_interval=0.01, timeout=0.05))
+
+    open(file_name, 'wb').close()
+
+    with framed.FramedReader(file_name) as reader:
+        assert list(reader) == []
+        assert len(reader.index()[0]) == 0
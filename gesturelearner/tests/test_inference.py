@@ -0,0 +1,53 @@
+import numpy as np
+
+from gesturelearner import inference
+
+
+def reference_conv3x3_relu(x, W, b):
+    padded = np.pad(x, ((0, 0), (1, 1), (1, 1), (0, 0)), mode='constant')
+    count, height, width, _ = x.shape
+    y = np.zeros((count, height, width, W.shape[3]))
+
+    for row in range(height):
+        for column in range(width):
+            patch = padded[:, row:row + 3, column:column + 3, :]
+            y[:, row, column, :] = np.tensordot(patch, W, axes=([1, 2, 3], [0, 1, 2]))
+
+    return np.maximum(y + b, 0)
+
+
+def reference_max_pool_2x2(x):
+    count, height, width, channels = x.shape
+    y = np.zeros((count, (height + 1) // 2, (width + 1) // 2, channels))
+
+    for row in range(y.shape[1]):
+        for column in range(y.shape[2]):
+            y[:, row, column, :] = x[:, 2 * row:2 * row + 2, 2 * column:2 * column + 2, :].max(axis=(1, 2))
+
+    return y
+
+
+def reference_logits(weights, images):
+    weights = dict((name, value.astype(np.float64)) for name, value in weights.items())
+    x = images.astype(np.float64)
+
+    for layer in ['conv1', 'conv2', 'conv3']:
+        x = reference_max_pool_2x2(reference_conv3x3_relu(x, weights['W_' + layer], weights['b_' + layer]))
+
+    x = np.maximum(np.dot(x.reshape(len(x), -1), weights['W_fc1']) + weights['b_fc1'], 0)
+    return np.dot(x, weights['W_fc2']) + weights['b_fc2']
+
+
+def test_matches_reference(weights, images):
+    expected = reference_logits(weights, images)
+
+    assert np.abs(inference.Network(weights).logits(images) - expected).max() < 5e-6
+
+
+def test_batches(weights, images):
+    # Running the images two at a time gives the same result as all at once.
+    network = inference.Network(weights, batch_size=2)
+    assert np.allclose(network.logits(images), inference.Network(weights).logits(images), atol=1e-5)
+
+    probabilities = network.predict(images)
+    assert np.allclose(probabilities.sum(axis=1), 1)
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+from gesturelearner import label_index, scanner
+
+
+SAMPLE_DATA = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'sample_data')
+
+
+def test_index_matches_scan(tmpdir):
+    file_name = str(tmpdir.join('data.trainingset'))
+    shutil.copy(os.path.join(SAMPLE_DATA, 'data.trainingset'), file_name)
+
+    index = label_index.load_or_build(file_name)
+
+    with scanner.TrainingSetScanner(file_name) as training_set:
+        records = [(record.offset, record.label) for record in training_set.scan()]
+
+    assert [(int(offset), int(label)) for offset, label in zip(index.offsets, index.labels)] == records
+    assert label_index.load(file_name) is not None
+
+    label = records[0][1]
+    assert list(index.offsets_for([label])) == [offset for offset, record_label in records if record_label == label]
+
+
+def test_same_size_edit_invalidates_index(tmpdir):
+    file_name = str(tmpdir.join('data.trainingset'))
+    shutil.copy(os.path.join(SAMPLE_DATA, 'data.trainingset'), file_name)
+    label_index.load_or_build(file_name)
+
+    stat = os.stat(file_name)
+
+    # Change one byte in the middle of the file and restore its modification time, like cp -p or rsync would.
+    with open(file_name, 'r+b') as f:
+        f.seek(stat.st_size // 2)
+        byte = f.read(1)
+        f.seek(stat.st_size // 2)
+        f.write(bytes(bytearray([ord(byte) ^ 1])))
+
+    os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    # Only the checksum catches it.
+    assert os.path.getsize(file_name) == stat.st_size
+    assert label_index.load(file_name) is not None
+    assert label_index.load(file_name, verify=True) is None
+
+
+def test_appended_record_invalidates_index(tmpdir):
+    file_name = str(tmpdir.join('data.trainingset'))
+    shutil.copy(os.path.join(SAMPLE_DATA, 'data.trainingset'), file_name)
+    index = label_index.load_or_build(file_name)
+
+    assert not os.path.exists(label_index.index_file_name(file_name) + '.tmp')
+
+    with open(file_name, 'rb') as f:
+        first_record = f.read(int(index.offsets[1]))
+
+    with open(file_name, 'ab') as f:
+        f.write(first_record)
+
+    assert label_index.load(file_name) is None
+    assert len(label_index.load_or_build(file_name)) == len(index) + 1
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from gesturelearner import packed
+from gesturelearner.constants import *
+
+
+def write_packed_file(file_name, count):
+    images = np.random.RandomState(0).randint(0, 256, (count, IMAGE_HEIGHT, IMAGE_WIDTH)).astype(np.uint8)
+    label_indexes = np.arange(count) % NUM_LABEL_INDEXES
+
+    with packed.PackedWriter(file_name) as writer:
+        writer.write_arrays(images, label_indexes)
+
+    return images, label_indexes
+
+
+def test_round_trip(tmpdir):
+    file_name = str(tmpdir.join('data.packed'))
+    images, label_indexes = write_packed_file(file_name, 10)
+
+    dataset = packed.PackedDataset(file_name)
+    assert packed.is_packed_file(file_name)
+    assert np.array_equal(dataset.images, images)
+    assert np.array_equal(dataset.label_indexes, label_indexes)
+
+
+def test_epoch_batches_resume():
+    batches = packed.epoch_batches(10, 3, seed=7)
+    first = [next(batches) for _ in range(7)]
+
+    # 3 batches of 3 per epoch, the last example of each epoch left over.
+    assert all(len(np.unique(np.concatenate(first[epoch * 3:epoch * 3 + 3]))) == 9 for epoch in range(2))
+
+    resumed = packed.epoch_batches(10, 3, seed=7, start_batch=4)
+    assert all(np.array_equal(next(resumed), batch) for batch in first[4:])
+
+
+def test_empty_dataset(tmpdir):
+    with pytest.raises(ValueError):
+        packed.epoch_batches(0, 50)
+
+    file_name = str(tmpdir.join('empty.packed'))
+    write_packed_file(file_name, 0)
+
+    with pytest.raises(ValueError):
+        packed.PackedDataset(file_name).batches(50)
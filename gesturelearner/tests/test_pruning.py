@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from gesturelearner import inference, pruning, weights as weights_module
+from gesturelearner.constants import *
+
+
+def zero_filters(weights, fraction, random_state):
+    """Return a copy of weights in which a fraction of the filters of each convolutional layer never activate, and
+    the indexes of the other filters."""
+    result = dict(weights)
+    live = {}
+
+    for layer in weights_module.CONV_LAYERS:
+        channels = weights['W_' + layer].shape[3]
+        dead = random_state.choice(channels, int(fraction * channels), replace=False)
+
+        result['W_' + layer] = weights['W_' + layer].copy()
+        result['W_' + layer][..., dead] = 0
+        result['b_' + layer] = weights['b_' + layer].copy()
+        result['b_' + layer][dead] = -1
+        live[layer] = np.setdiff1d(np.arange(channels), dead)
+
+    return result, live
+
+
+def test_keeping_every_filter_changes_nothing(weights, images):
+    keep = dict((layer, np.arange(channels)) for layer, channels in zip(weights_module.CONV_LAYERS, CONV_CHANNELS))
+    pruned = pruning.prune_weights(weights, keep)
+
+    assert np.array_equal(inference.Network(pruned).logits(images), inference.Network(weights).logits(images))
+
+
+@pytest.mark.parametrize('fc1_rank', [None, 128])
+def test_pruning_dead_filters_changes_nothing(weights, images, fc1_rank):
+    weights, live = zero_filters(weights, 0.25, np.random.RandomState(2))
+    weights = weights_module.factorize_weights(weights, fc1_rank)
+
+    keep = pruning.keep_strongest(pruning.filter_scores(weights, 'magnitude'), 0.75)
+    assert all(np.array_equal(keep[layer], live[layer]) for layer in live)
+
+    pruned = pruning.prune_weights(weights, keep)
+    assert weights_module.network_options(pruned) == {
+        'fc1_rank': fc1_rank, 'fc2_rank': None,
+        'conv_channels': tuple(len(live[layer]) for layer in weights_module.CONV_LAYERS)}
+
+    expected = inference.Network(weights).logits(images)
+    assert np.abs(inference.Network(pruned).logits(images) - expected).max() < 1e-5
+
+    assert pruning.flops(pruned) < pruning.flops(weights)
+    assert weights_module.parameter_count(pruned) < weights_module.parameter_count(weights)
+
+
+def test_activation_scores(weights, images):
+    weights, live = zero_filters(weights, 0.25, np.random.RandomState(3))
+    scores = pruning.filter_scores(weights, 'activation', images)
+
+    for layer in weights_module.CONV_LAYERS:
+        dead = np.setdiff1d(np.arange(len(scores[layer])), live[layer])
+        assert np.all(scores[layer][dead] == 0)
+        assert np.all(scores[layer] >= 0)
+
+    with pytest.raises(ValueError):
+        pruning.filter_scores(weights, 'activation')
+
+
+def test_flops_of_full_network(weights):
+    conv = 45 * 45 * 9 * 1 * 32 + 23 * 23 * 9 * 32 * 64 + 12 * 12 * 9 * 64 * 64
+    fc = 6 * 6 * 64 * 1024 + 1024 * NUM_LABEL_INDEXES
+    assert pruning.flops(weights) == 2 * (conv + fc)
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from gesturelearner import inference, quantization
+
+
+def test_linear_quantize_round_trip():
+    rows = np.random.RandomState(2).randn(4, 50).astype(np.float32)
+    rows[3] = 0.5
+
+    q, scale, bias = quantization.linear_quantize(rows)
+
+    assert q.dtype == np.uint8
+    assert q.min() == 0 and q[:3].max() == 255
+    # Each value is rounded to the nearest of its row's levels, and a constant row is stored exactly.
+    errors = np.abs(q * scale[:, np.newaxis] + bias[:, np.newaxis] - rows).max(axis=1)
+    assert np.all(errors[:3] <= scale[:3] / 2 + 1e-6)
+    assert errors[3] == 0
+
+
+def test_quantize_spec_matches_quantize_weights(weights):
+    Model_pb2 = pytest.importorskip('coremltools.proto.Model_pb2')
+
+    # A convolution and an inner product layer, with the weights in Core ML's (output, input, height, width) and
+    # (output, input) orders.
+    spec = Model_pb2.Model()
+    conv = spec.neuralNetwork.layers.add().convolution
+    conv.outputChannels = weights['W_conv2'].shape[3]
+    conv.weights.floatValue.extend(weights['W_conv2'].transpose(3, 2, 0, 1).ravel())
+    inner_product = spec.neuralNetwork.layers.add().innerProduct
+    inner_product.outputChannels = weights['W_fc2'].shape[1]
+    inner_product.weights.floatValue.extend(weights['W_fc2'].T.ravel())
+
+    quantization.quantize_spec(spec, 'linear8')
+    expected = quantization.quantize_weights(weights, 'linear8')
+
+    assert spec.specificationVersion == quantization.SPECIFICATION_VERSIONS['linear8']
+
+    for params, name, order in [(conv, 'W_conv2', (3, 2, 0, 1)), (inner_product, 'W_fc2', (1, 0))]:
+        assert len(params.weights.floatValue) == 0
+        q = np.frombuffer(params.weights.rawValue, dtype=np.uint8).reshape(params.outputChannels, -1)
+        linear = params.weights.quantization.linearQuantization
+        rows = q * np.array(linear.scale)[:, np.newaxis] + np.array(linear.bias)[:, np.newaxis]
+        assert np.allclose(rows, expected[name].transpose(order).reshape(params.outputChannels, -1), atol=1e-6)
+
+
+def test_integer_dot_is_exact():
+    # The largest products in every term, in a sum long enough to need several blocks.
+    x = np.full((2, 3 * quantization.EXACT_TERMS + 7), 255, dtype=np.uint8)
+    W = np.full((x.shape[1], 3), -127, dtype=np.int8)
+    W[::2, 1] = 127
+
+    y = quantization.integer_dot(x, W)
+
+    assert y.dtype == np.int32
+    assert np.array_equal(y, np.dot(x.astype(np.int64), W.astype(np.int64)))
+
+
+def test_quantized_network_matches_float_network(weights, images):
+    ranges = quantization.calibrate(weights, images, percentile=100)
+    network = quantization.QuantizedNetwork(weights, ranges)
+
+    assert all(network.weights['W_' + layer].dtype == np.int8 for layer in quantization.LAYERS)
+
+    expected = inference.Network(weights).logits(images)
+    logits = network.logits(images)
+    assert np.abs(logits - expected).max() < 0.05 * np.abs(expected).max()
+    assert np.array_equal(np.argmax(logits, 1), np.argmax(expected, 1))
+
+
+def test_save_and_load_quantized(weights, images, tmpdir):
+    file_name = str(tmpdir.join('model-int8.npz'))
+    ranges = quantization.calibrate(weights, images)
+    quantization.save_quantized(file_name, weights, ranges)
+
+    expected = quantization.QuantizedNetwork(weights, ranges).logits(images)
+    assert np.allclose(quantization.load_quantized(file_name).logits(images), expected, atol=1e-5)
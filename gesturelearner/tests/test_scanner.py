@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+
+from gesturelearner import scanner
+import protobuf.touches_pb2 as touches_pb2
+
+
+SAMPLE_DATA = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'sample_data')
+
+
+def read_training_set(file_name):
+    training_set = touches_pb2.TrainingSet()
+
+    with open(file_name, 'rb') as f:
+        training_set.ParseFromString(f.read())
+
+    return training_set
+
+
+def test_scan_matches_protobuf():
+    file_name = os.path.join(SAMPLE_DATA, 'data_filtered.trainingset')
+    expected = read_training_set(file_name).labelledImages
+
+    with scanner.TrainingSetScanner(file_name) as training_set:
+        records = list(training_set)
+
+        assert len(records) == len(expected)
+
+        for record, labelled_image in zip(records, expected):
+            assert record.label == labelled_image.label
+            assert record.height == labelled_image.image.height
+            assert record.width == labelled_image.image.width
+            assert bytes(record.values) == labelled_image.image.values
+
+            parsed = touches_pb2.LabelledImage()
+            parsed.ParseFromString(bytes(training_set.record_bytes(record.offset)))
+            assert parsed == labelled_image
+
+            assert training_set.record_at(record.offset) == record
+
+        offsets, labels = training_set.index()
+        assert list(offsets) == [record.offset for record in records]
+        assert list(labels) == [labelled_image.label for labelled_image in expected]
+
+        del records
+
+
+def test_encode_matches_protobuf():
+    labelled_image = touches_pb2.LabelledImage()
+    labelled_image.label = 3
+    labelled_image.image.height = 2
+    labelled_image.image.width = 300
+    labelled_image.image.values = np.arange(600, dtype=np.uint8).tobytes()
+
+    assert scanner.encode_labelled_image(3, 2, 300, labelled_image.image.values) == \
+        labelled_image.SerializeToString()
+
+    # proto3 leaves out fields with default values.
+    assert scanner.encode_labelled_image(0, 0, 0, b'') == touches_pb2.LabelledImage().SerializeToString()
+
+
+def test_writer_round_trip(tmpdir):
+    file_name = str(tmpdir.join('out.trainingset'))
+    values = [np.full(4, i, dtype=np.uint8).tobytes() for i in range(3)]
+
+    with scanner.TrainingSetWriter(file_name) as writer:
+        for i, value in enumerate(values):
+            writer.write(i, 2, 2, value)
+
+    training_set = read_training_set(file_name)
+
+    assert [labelled_image.label for labelled_image in training_set.labelledImages] == [0, 1, 2]
+    assert [labelled_image.image.values for labelled_image in training_set.labelledImages] == values
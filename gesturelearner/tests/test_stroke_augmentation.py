@@ -0,0 +1,52 @@
+import itertools
+import os
+
+import numpy as np
+
+from gesturelearner import stroke_augmentation
+import protobuf.touches_pb2 as touches_pb2
+
+
+SAMPLE_DATASET = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir, 'sample_data', 'data.dataset')
+
+
+def write_subset(file_name, count):
+    raw_data_set = touches_pb2.RawDataSet()
+
+    with open(SAMPLE_DATASET, 'rb') as f:
+        raw_data_set.ParseFromString(f.read())
+
+    subset = touches_pb2.RawDataSet()
+    subset.drawingList.drawings.extend(raw_data_set.drawingList.drawings[:count])
+    subset.labels.extend(raw_data_set.labels[:count])
+
+    with open(file_name, 'wb') as f:
+        f.write(subset.SerializeToString())
+
+
+def take(file_name, count, workers, seed, start_batch=0):
+    batches = stroke_augmentation.parallel_batches(file_name, 8, workers, seed, start_batch)
+
+    try:
+        return list(itertools.islice(batches, count))
+    finally:
+        batches.close()
+
+
+def assert_same_batches(first, second):
+    assert len(first) == len(second)
+
+    for (images, labels), (other_images, other_labels) in zip(first, second):
+        assert np.array_equal(images, other_images)
+        assert np.array_equal(labels, other_labels)
+
+
+def test_parallel_batches_are_reproducible(tmpdir):
+    file_name = str(tmpdir.join('data.dataset'))
+    write_subset(file_name, 20)
+    batches = take(file_name, 6, 1, 3)
+
+    # The same batches whatever the number of workers, and when resuming in the middle of a run.
+    assert_same_batches(batches, take(file_name, 6, 3, 3))
+    assert_same_batches(batches[4:], take(file_name, 2, 2, 3, start_batch=4))
+    assert not np.array_equal(batches[0][0], take(file_name, 1, 1, 4)[0][0])
@@ -0,0 +1,35 @@
+import numpy as np
+
+from gesturelearner import inference, weights as weights_module
+from gesturelearner.constants import *
+
+
+def test_full_rank_factorization_is_exact(weights, images):
+    factorized = weights_module.factorize_weights(weights, 1024, NUM_LABEL_INDEXES)
+
+    assert weights_module.ranks(factorized) == (1024, NUM_LABEL_INDEXES)
+    assert weights_module.names_of(factorized) == weights_module.weight_names(1024, NUM_LABEL_INDEXES)
+
+    expected = inference.Network(weights).logits(images)
+    assert np.abs(inference.Network(factorized).logits(images) - expected).max() < 1e-5
+
+
+def test_low_rank_factorization(weights):
+    factorized = weights_module.factorize_weights(weights, 32)
+
+    assert factorized['W_fc1_u'].shape == (6 * 6 * CONV_CHANNELS[2], 32)
+    assert factorized['W_fc1_v'].shape == (32, 1024)
+    assert 'W_fc1' not in factorized
+    assert weights_module.parameter_count(factorized) < weights_module.parameter_count(weights)
+    assert weights_module.network_options(factorized) == {'fc1_rank': 32, 'fc2_rank': None,
+                                                          'conv_channels': CONV_CHANNELS}
+
+
+def test_save_and_load(weights, tmpdir):
+    file_name = str(tmpdir.join('weights.npz'))
+    factorized = weights_module.factorize_weights(weights, 64)
+    weights_module.save(file_name, factorized)
+
+    loaded = weights_module.load(file_name)
+    assert sorted(loaded) == sorted(factorized)
+    assert all(np.array_equal(loaded[name], factorized[name]) for name in loaded)
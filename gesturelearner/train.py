@@ -1,40 +1,149 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+
 import click
 import numpy as np
 import tensorflow as tf
 
-from gesturelearner import graph
+from gesturelearner import (checkpointing, data, evaluation, graph, image_augmentation, packed, profiler, schedule,
+                            weights)
 from gesturelearner.constants import IMAGE_HEIGHT, IMAGE_WIDTH, NUM_LABEL_INDEXES
 
 
+# The number of steps train.py always ran before it could stop early, for reporting the savings.
+FIXED_SCHEDULE_STEPS = 20000
+
+
 @click.command()
 @click.argument('training-file')
 @click.option('--test-file')
 @click.option('--model-in')
 @click.option('--model-out')
-def main(training_file, test_file, model_in, model_out):
+@click.option('--input-mode', type=click.Choice(['dataset', 'queue']), default='dataset')
+@click.option('--batch-size', default=50)
+@click.option('--shuffle-buffer', default=1000)
+@click.option('--cache', help='"memory" or the path of a file to cache decoded images in (dataset mode only).')
+@click.option('--num-parallel-calls', type=int)
+@click.option('--augment-workers', type=int,
+              help='Number of processes augmenting drawings when training on a .dataset file. Defaults to one per CPU.')
+@click.option('--augment-images', is_flag=True,
+              help='Randomly translate, rotate, scale, thicken or thin and distort every training batch.')
+@click.option('--eval-batch-size', default=500, help='Number of test images evaluated at a time.')
+@click.option('--inline-eval/--no-inline-eval', default=True,
+              help='Whether to evaluate the test set in the training loop. Turn this off when evaluate.py scores '
+                   'the checkpoints instead.')
+@click.option('--async-checkpoints', is_flag=True,
+              help='Write checkpoints (as model_out-STEP) from a background thread instead of the training loop.')
+@click.option('--keep-checkpoints', default=5,
+              help='With --async-checkpoints, the number of recent checkpoints to keep besides the most accurate one. '
+                   'Without --test-file or with --no-inline-eval, the accuracies are unknown and only the recent '
+                   'checkpoints are kept.')
+@click.option('--learning-rate', default=1e-4, help='The initial learning rate. A restored model keeps its own.')
+@click.option('--keep-prob', default=0.5, help='The probability of keeping each unit of the dropout layer in training.')
+@click.option('--max-steps', default=FIXED_SCHEDULE_STEPS, help='Stop at this global step.')
+@click.option('--max-seconds', type=float, help='Stop after training for this long.')
+@click.option('--early-stopping', is_flag=True,
+              help='Lower the learning rate when the test metric plateaus and stop when it stops improving.')
+@click.option('--monitor', type=click.Choice(['loss', 'accuracy']), default='loss',
+              help='The test metric followed by --early-stopping.')
+@click.option('--patience', default=10, help='Evaluations without improvement before stopping.')
+@click.option('--decay-patience', default=4, help='Evaluations without improvement before lowering the learning rate.')
+@click.option('--decay-factor', default=0.5)
+@click.option('--profile', help='Write the time spent in each phase of every step to PROFILE.profile.jsonl and a '
+                                'Chrome trace to PROFILE.trace.json.')
+@click.option('--timeline-steps', type=int,
+              help='With --profile, also write an op-level timeline of every this many steps to '
+                   'PROFILE.timeline-STEP.json.')
+def main(training_file, test_file, model_in, model_out, input_mode, batch_size, shuffle_buffer, cache,
+         num_parallel_calls, augment_workers, augment_images, eval_batch_size, inline_eval, async_checkpoints,
+         keep_checkpoints, learning_rate, keep_prob, max_steps, max_seconds, early_stopping, monitor, patience,
+         decay_patience, decay_factor, profile, timeline_steps):
     if model_in is None:
         model_in = "model.ckpt"
 
     if model_out is None:
         model_out = model_in
 
-    train_images, train_labels = read_train_file(training_file)
+    if early_stopping and (test_file is None or not inline_eval):
+        print('--early-stopping needs a --test-file evaluated in the training loop.', file=sys.stderr)
+        return
+
+    if async_checkpoints and (test_file is None or not inline_eval):
+        print('Warning: without inline evaluation, only the last %d checkpoints are kept, not the most accurate one.'
+              % keep_checkpoints, file=sys.stderr)
+
+    # Either file may be a glob matching several shards.
+    training_files = data.expand_file_pattern(training_file)
+
+    if training_files[0].endswith('.dataset'):
+        # Raw drawings are augmented and rasterized on the fly.
+        input_mode = 'drawings'
+    elif packed.is_packed_file(training_files[0]):
+        input_mode = 'packed'
+
+    augmenter = image_augmentation.ImageAugmenter() if augment_images else None
+
+    # Resume from the step and input position the model was saved at. The data seed decides the order of the
+    # training examples, so continuing with the same seed and skipping the batches already trained on picks the input
+    # up where it stopped.
+    checkpoint = checkpointing.latest(model_in)
+    start_step, data_seed = checkpointing.training_position(checkpoint)
+
+    if data_seed is None:
+        data_seed = np.random.randint(2 ** 31 - 1)
+
+    if augmenter is not None:
+        augmenter.random_state.seed((data_seed + start_step) % 2 ** 32)
+
+    train_images, train_labels = read_train_file(training_files, input_mode, batch_size, shuffle_buffer, cache,
+                                                 num_parallel_calls, augment_workers, augmenter, data_seed,
+                                                 start_step)
 
     is_testing = False
-    if test_file is not None:
+    if test_file is not None and inline_eval:
         is_testing = True
-        test_images, test_labels = read_test_file(test_file)
+        test_images, test_labels = data.read_test_file(test_file)
 
-    images_input = tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
-    labels_input = tf.placeholder(tf.float32, [None, NUM_LABEL_INDEXES])
+    if input_mode == 'queue':
+        images_input = tf.placeholder(tf.float32, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        labels_input = tf.placeholder(tf.float32, [None, NUM_LABEL_INDEXES])
+    else:
+        # The network reads training batches straight from the pipeline. Feeding these only overrides them for
+        # evaluation on the test set.
+        images_input = tf.placeholder_with_default(train_images, [None, IMAGE_HEIGHT, IMAGE_WIDTH, 1])
+        labels_input = tf.placeholder_with_default(train_labels, [None, NUM_LABEL_INDEXES])
 
-    predicted_labels, variables = graph.make_network(images_input)
+    # A model factorized by factorize.py or pruned by prune.py keeps its shape when training continues.
+    network_options = weights.checkpoint_network_options(checkpoint) if checkpoint is not None else {}
+    predicted_labels, variables = graph.make_network(images_input, **network_options)
+
+    # Saved with the model so that evaluate.py knows which step a checkpoint is from and training can resume.
+    global_step = tf.train.get_or_create_global_step()
+    tf.Variable(data_seed, dtype=tf.int64, trainable=False, name='data_seed')
+
+    # A variable, so that the schedule can lower it and a restored model continues with the rate it was saved with.
+    learning_rate_variable = tf.Variable(learning_rate, dtype=tf.float32, trainable=False, name='learning_rate')
 
     cross_entropy = tf.reduce_mean(
         tf.nn.softmax_cross_entropy_with_logits(labels=labels_input, logits=predicted_labels))
-    train_step = tf.train.AdamOptimizer(1e-4).minimize(cross_entropy)
+    train_step = tf.train.AdamOptimizer(learning_rate_variable).minimize(cross_entropy, global_step=global_step)
     correct_prediction = tf.equal(tf.argmax(predicted_labels, 1), tf.argmax(labels_input, 1))
-    accuracy = tf.reduce_mean(tf.cast(correct_prediction, tf.float32))
+
+    # Running averages over the batches trained on since the last log, updated by the same run as train_step. They
+    # are measured with dropout, so the accuracy is lower than that of the network used for prediction.
+    with tf.variable_scope('training_metrics') as scope:
+        training_loss, update_training_loss = tf.metrics.mean(cross_entropy)
+        training_accuracy, update_training_accuracy = tf.metrics.mean(tf.cast(correct_prediction, tf.float32))
+        update_training_metrics = tf.group(update_training_loss, update_training_accuracy)
+        reset_training_metrics = tf.variables_initializer(tf.get_collection(tf.GraphKeys.LOCAL_VARIABLES,
+                                                                            scope.name))
+
+    if is_testing:
+        evaluator = evaluation.Evaluator(images_input, labels_input, predicted_labels, test_images, test_labels,
+                                         eval_batch_size)
 
     # misclassified = tf.where(tf.logical_not(correct_prediction))
 
@@ -43,121 +152,152 @@ def main(training_file, test_file, model_in, model_out):
 
     saver = tf.train.Saver()
 
+    # Only queue mode has queues. The other input pipelines' buffers can't be inspected.
+    queue_sizes = profiler.queue_sizes()
+    step_profiler = profiler.StepProfiler(profile, timeline_steps)
+
+    if async_checkpoints:
+        checkpoint_writer = checkpointing.CheckpointWriter(model_out, keep_checkpoints)
+
     with tf.Session() as sess:
         sess.run(init_op)
 
-        if tf.train.checkpoint_exists(model_in):
-            saver.restore(sess, model_in)
-            print("Restored model from file: %s" % model_in)
+        if checkpoint is not None:
+            # Models saved before the global step existed are restored without it.
+            checkpointing.restore(sess, checkpoint)
+            print("Restored model from file: %s at step %d" % (checkpoint, start_step))
         else:
             print("Couldn't find model \"%s\". Training a new model from scratch." % model_in)
 
         coord = tf.train.Coordinator()
         threads = tf.train.start_queue_runners(coord=coord)
 
+        test_accuracy = None
+        budget = schedule.Budget(max_steps, max_seconds)
+
+        if early_stopping:
+            plateau = schedule.PlateauSchedule(float(sess.run(learning_rate_variable)),
+                                               mode='min' if monitor == 'loss' else 'max', patience=patience,
+                                               decay_patience=decay_patience, decay_factor=decay_factor)
+
+        def save_checkpoint(step):
+            if async_checkpoints:
+                checkpoint_writer.save(sess, step, test_accuracy)
+            else:
+                save_path = saver.save(sess, model_out)
+                print("Saved model in file: %s" % save_path)
+
         try:
             # wrong_indexes, labels = sess.run([misclassified, tf.argmax(predicted_labels, 1)], {variables['keep_prob']: 1.0, images_input: test_images, labels_input: test_labels})
             #
             # for value in wrong_indexes:
             #     print('Wrong prediction at %s. Predicted label: %s' % (value[0], labels[value[0]]))
 
-            for i in range(20000):
-                next_images, next_labels = sess.run([train_images, train_labels])
+            for i in range(start_step, max_steps):
+                if budget.is_exhausted(i):
+                    print('step %d, stopping: the time budget of %g seconds is used up' % (i, max_seconds))
+                    break
 
-                if i % 10 == 0:
-                    train_accuracy = accuracy.eval({variables['keep_prob']: 1.0, images_input: next_images, labels_input: next_labels})
-                    print('step %d, training accuracy %g' % (i, train_accuracy))
+                step_profiler.start_step(i)
 
-                if i % 50 == 0 and is_testing:
-                    test_accuracy = accuracy.eval({variables['keep_prob']: 1.0, images_input: test_images, labels_input: test_labels})
-                    print('step %d, testing accuracy %g' % (i, test_accuracy))
+                if input_mode == 'queue':
+                    with step_profiler.span('input'):
+                        next_images, next_labels = sess.run([train_images, train_labels])
 
-                if i % 100 == 0:
-                    save_path = saver.save(sess, model_out)
-                    print("Saved model in file: %s" % save_path)
+                    if augmenter is not None:
+                        with step_profiler.span('augment'):
+                            next_images = augmenter.augment(next_images)
 
-                train_step.run(feed_dict={variables['keep_prob']: 0.5, images_input: next_images, labels_input: next_labels})
-        finally:
-            coord.request_stop()
-            coord.join(threads)
+                    batch_feed = {images_input: next_images, labels_input: next_labels}
+                else:
+                    batch_feed = {}
+
+                if i % 50 == 0 and is_testing:
+                    with step_profiler.span('evaluation'):
+                        result = evaluator.evaluate(sess, {variables['keep_prob']: 1.0})
 
+                    test_accuracy = float(result.accuracy)
+                    print('step %d, testing accuracy %g, testing loss %g' % (i, result.accuracy, result.loss))
 
-def read_train_file(file_name):
-    images, labels = read(tf.train.string_input_producer([file_name]))
+                    if early_stopping:
+                        if plateau.update(i, result.loss if monitor == 'loss' else result.accuracy):
+                            learning_rate_variable.load(plateau.learning_rate, sess)
+                            print('step %d, lowered the learning rate to %g' % (i, plateau.learning_rate))
 
-    images, labels = tf.train.shuffle_batch(
-        [images, labels],
-         batch_size=50,
-         capacity=200,
-         num_threads=2,
-         min_after_dequeue=0
-    )
+                        if plateau.should_stop:
+                            print('step %d, stopping: the testing %s hasn\'t improved since step %d'
+                                  % (i, monitor, plateau.best_step))
+                            break
 
-    return images, labels
+                if i % 100 == 0:
+                    # The most recent test accuracy is from this step, since 100 is a multiple of 50.
+                    with step_profiler.span('checkpoint'):
+                        save_checkpoint(i)
 
+                feed_dict = dict(batch_feed)
+                feed_dict[variables['keep_prob']] = keep_prob
+                run_options, run_metadata = step_profiler.run_options(i)
 
-def read_test_file(file_name):
-    record_iterator = tf.python_io.tf_record_iterator(path=file_name)
-    images = []
-    labels = []
+                # In dataset, packed and drawings mode, this includes taking the batch from the input pipeline.
+                with step_profiler.span('train'):
+                    _, _, queue_fill = sess.run([train_step, update_training_metrics, queue_sizes], feed_dict,
+                                                options=run_options, run_metadata=run_metadata)
 
-    for string_record in record_iterator:
-        example = tf.train.Example()
-        example.ParseFromString(string_record)
+                step_profiler.save_timeline(i, run_metadata)
 
-        height = int(example.features.feature['height'].int64_list.value[0])
-        width = int(example.features.feature['width'].int64_list.value[0])
-        label_index = np.int64(example.features.feature['label'].int64_list.value[0])
-        image = example.features.feature['image'].bytes_list.value[0]
+                if (i + 1) % 10 == 0:
+                    with step_profiler.span('fetch'):
+                        loss_value, accuracy_value = sess.run([training_loss, training_accuracy])
+                        sess.run(reset_training_metrics)
 
-        label = np.zeros(NUM_LABEL_INDEXES, dtype=np.float32)
-        label[label_index] = 1.0
+                    print('step %d, training accuracy %g, training loss %g' % (i + 1, accuracy_value, loss_value))
 
-        image = np.fromstring(image, dtype=np.uint8)
-        image = image * (1. / 255) - 0.5
-        image = np.reshape(image, (height, width, 1))
+                step_profiler.end_step(batch_size, dict((name, int(size)) for name, size in queue_fill.items()))
 
-        images.append(image)
-        labels.append(label)
+            final_step = tf.train.global_step(sess, global_step)
+            save_checkpoint(final_step)
 
-    return images, labels
+            steps_saved, seconds_saved = schedule.savings(start_step, final_step, budget.elapsed,
+                                                          FIXED_SCHEDULE_STEPS)
+            if steps_saved > 0:
+                print('Stopped at step %d, saving %d steps (about %.0f seconds) compared with training for %d steps.'
+                      % (final_step, steps_saved, seconds_saved, FIXED_SCHEDULE_STEPS))
+        finally:
+            coord.request_stop()
+            coord.join(threads)
 
+            if async_checkpoints:
+                checkpoint_writer.close()
 
-def read(file_name_queue):
-    reader = tf.TFRecordReader()
+            step_profiler.close()
 
-    _, serialized_example = reader.read(file_name_queue)
+            if profile is not None:
+                print(step_profiler.summary())
 
-    features = tf.parse_single_example(
-      serialized_example,
-      features={
-        'height': tf.FixedLenFeature([], tf.int64),
-        'width': tf.FixedLenFeature([], tf.int64),
-        'label': tf.FixedLenFeature([], tf.int64),
-        'image': tf.FixedLenFeature([], tf.string)
-    })
 
-    height = tf.cast(features['height'], tf.int32)
-    width = tf.cast(features['width'], tf.int32)
-    label = tf.cast(features['label'], tf.int64)
-    image = tf.decode_raw(features['image'], tf.uint8)
+def read_train_file(file_names, input_mode='dataset', batch_size=50, shuffle_buffer=1000, cache=None,
+                    num_parallel_calls=None, augment_workers=None, augmenter=None, seed=None, skip_batches=0):
+    if input_mode == 'queue':
+        # Queue batches are fetched into Python, where the training loop augments them. The queues can't be
+        # positioned, so a resumed run starts a new pass over the data.
+        return data.queue_input(file_names, batch_size)
 
-    label_index = tf.reshape(label, [1, 1])
+    if input_mode == 'drawings':
+        if len(file_names) > 1:
+            raise ValueError('The drawings input reads a single file, not %d.' % len(file_names))
 
-    sparse_tensor = tf.SparseTensor(label_index, [1.0], [NUM_LABEL_INDEXES])
-    label = tf.sparse_tensor_to_dense(sparse_tensor)
+        return data.drawings_input(file_names[0], batch_size, augment_workers, augmenter=augmenter, seed=seed,
+                                   skip_batches=skip_batches)
 
-    image = tf.cast(image, tf.float32)
-    image = image * (1. / 255) - 0.5
-    image = tf.reshape(image, [height, width, 1])
+    if input_mode == 'packed':
+        if len(file_names) > 1:
+            raise ValueError('The packed input reads a single file, not %d.' % len(file_names))
 
-    resized_image = tf.image.resize_image_with_crop_or_pad(
-        image=image,
-        target_height=IMAGE_HEIGHT,
-        target_width=IMAGE_WIDTH
-    )
+        return data.packed_input(file_names[0], batch_size, augmenter=augmenter, seed=seed,
+                                 skip_batches=skip_batches)
 
-    return resized_image, label
+    return data.dataset_input(file_names, batch_size, shuffle_buffer, cache, num_parallel_calls,
+                              augmenter=augmenter, seed=seed, skip_batches=skip_batches)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,217 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import tensorflow as tf
+
+from gesturelearner import data, graph, weights
+
+
+# Lines starting with this report a worker's throughput to the launcher.
+THROUGHPUT_PREFIX = 'throughput: '
+
+
+@click.command()
+@click.argument('training-file')
+@click.option('--model-out', default='model.ckpt')
+@click.option('--job-name', type=click.Choice(['ps', 'worker']))
+@click.option('--task-index', default=0)
+@click.option('--ps-hosts', help='Comma-separated host:port list of the parameter servers.')
+@click.option('--worker-hosts', help='Comma-separated host:port list of the workers.')
+@click.option('--local', 'local_workers', type=int,
+              help='Start a parameter server and this many workers on this machine and wait for them to finish.')
+@click.option('--sync/--async', 'synchronous', default=True,
+              help='Average the gradients of all workers at every step, or let each worker update the parameters '
+                   'on its own.')
+@click.option('--batch-size', default=50, help='The batch size of each worker.')
+@click.option('--learning-rate', default=1e-4)
+@click.option('--max-steps', default=20000, help='Stop at this global step.')
+@click.option('--save-steps', default=100, help='Steps between checkpoints.')
+@click.option('--threads-per-worker', type=int,
+              help='Limit the threads of each process, e.g. to the number of cores divided by the number of workers.')
+@click.option('--warmup-steps', default=20, help='Steps before a worker starts measuring its throughput.')
+def main(training_file, model_out, job_name, task_index, ps_hosts, worker_hosts, local_workers, synchronous,
+         batch_size, learning_rate, max_steps, save_steps, threads_per_worker, warmup_steps):
+    """Data-parallel training of the network of train.py over a cluster of parameter servers and workers.
+
+    Each worker trains on its own shard of the TFRecords files. Checkpoints are written by the first worker as
+    model_out-STEP, so they can be followed by evaluate.py and restored by train.py and save_mlmodel.py.
+    """
+    options = dict(model_out=model_out, synchronous=synchronous, batch_size=batch_size, learning_rate=learning_rate,
+                   max_steps=max_steps, save_steps=save_steps, threads_per_worker=threads_per_worker,
+                   warmup_steps=warmup_steps)
+
+    if local_workers is not None:
+        throughputs = launch_local(training_file, local_workers, **options)
+        print('%d workers: %.0f examples/sec in total' % (local_workers, sum(throughputs)))
+        return
+
+    if job_name is None or ps_hosts is None or worker_hosts is None:
+        print('Pass --job-name, --ps-hosts and --worker-hosts, or --local.', file=sys.stderr)
+        return
+
+    cluster = tf.train.ClusterSpec({'ps': ps_hosts.split(','), 'worker': worker_hosts.split(',')})
+    config = session_config(threads_per_worker)
+    server = tf.train.Server(cluster, job_name=job_name, task_index=task_index, config=config)
+
+    if job_name == 'ps':
+        server.join()
+        return
+
+    run_worker(server, cluster, task_index, training_file, config, **options)
+
+
+def session_config(threads_per_worker):
+    if threads_per_worker is None:
+        return tf.ConfigProto()
+
+    return tf.ConfigProto(intra_op_parallelism_threads=threads_per_worker,
+                          inter_op_parallelism_threads=threads_per_worker)
+
+
+def run_worker(server, cluster, task_index, training_file, config, model_out, synchronous, batch_size,
+               learning_rate, max_steps, save_steps, threads_per_worker, warmup_steps):
+    num_workers = cluster.num_tasks('worker')
+    is_chief = task_index == 0
+
+    # MonitoredTrainingSession restores the latest checkpoint in the directory of model_out, which can be a factorized
+    # or pruned model, so the network takes its shapes.
+    checkpoint_directory = os.path.dirname(os.path.abspath(model_out))
+    checkpoint = tf.train.latest_checkpoint(checkpoint_directory)
+    network_options = weights.checkpoint_network_options(checkpoint) if checkpoint is not None else {}
+
+    # Variables go to the parameter servers and everything else stays on this worker.
+    with tf.device(tf.train.replica_device_setter(worker_device='/job:worker/task:%d' % task_index,
+                                                  cluster=cluster)):
+        train_images, train_labels = data.dataset_input(data.expand_file_pattern(training_file), batch_size,
+                                                        num_parallel_calls=threads_per_worker,
+                                                        num_shards=num_workers, shard_index=task_index)
+
+        predicted_labels, variables = graph.make_network(train_images, **network_options)
+        global_step = tf.train.get_or_create_global_step()
+
+        cross_entropy = tf.reduce_mean(
+            tf.nn.softmax_cross_entropy_with_logits(labels=train_labels, logits=predicted_labels))
+
+        optimizer = tf.train.AdamOptimizer(learning_rate)
+
+        if synchronous:
+            # Every step averages one batch from each worker, so a step covers num_workers * batch_size examples.
+            optimizer = tf.train.SyncReplicasOptimizer(optimizer, replicas_to_aggregate=num_workers,
+                                                       total_num_replicas=num_workers)
+
+        train_step = optimizer.minimize(cross_entropy, global_step=global_step)
+
+    hooks = [tf.train.StopAtStepHook(last_step=max_steps)]
+
+    if synchronous:
+        hooks.append(optimizer.make_session_run_hook(is_chief))
+
+    chief_only_hooks = [tf.train.CheckpointSaverHook(checkpoint_directory, save_steps=save_steps,
+                                                     checkpoint_basename=os.path.basename(model_out))]
+
+    # Only talk to the parameter servers and this worker, so that workers don't wait for each other to start.
+    config.device_filters.extend(['/job:ps', '/job:worker/task:%d' % task_index])
+
+    local_steps = 0
+    start_time = None
+
+    with tf.train.MonitoredTrainingSession(master=server.target, is_chief=is_chief,
+                                           checkpoint_dir=checkpoint_directory, hooks=hooks,
+                                           chief_only_hooks=chief_only_hooks, save_checkpoint_secs=None,
+                                           save_summaries_steps=None, save_summaries_secs=None,
+                                           config=config) as sess:
+        while not sess.should_stop():
+            _, loss, step = sess.run([train_step, cross_entropy, global_step], {variables['keep_prob']: 0.5})
+            local_steps += 1
+
+            if local_steps == warmup_steps:
+                start_time = time.time()
+
+            if local_steps % 100 == 0:
+                print('worker %d, step %d, training loss %g' % (task_index, step, loss))
+                sys.stdout.flush()
+
+    if start_time is not None and local_steps > warmup_steps:
+        examples_per_second = (local_steps - warmup_steps) * batch_size / (time.time() - start_time)
+        print('%s%f' % (THROUGHPUT_PREFIX, examples_per_second))
+        sys.stdout.flush()
+
+
+def free_ports(count):
+    sockets = [socket.socket() for _ in range(count)]
+
+    for s in sockets:
+        s.bind(('localhost', 0))
+
+    ports = [s.getsockname()[1] for s in sockets]
+
+    for s in sockets:
+        s.close()
+
+    return ports
+
+
+def launch_local(training_file, num_workers, model_out, synchronous, batch_size, learning_rate, max_steps,
+                 save_steps, threads_per_worker, warmup_steps):
+    """Run a parameter server and num_workers workers on localhost and return the throughput of each worker.
+
+    The workers' output goes to this process's output once they finish.
+    """
+    ports = free_ports(num_workers + 1)
+    ps_hosts = 'localhost:%d' % ports[0]
+    worker_hosts = ','.join('localhost:%d' % port for port in ports[1:])
+
+    arguments = [sys.executable, os.path.abspath(__file__), training_file, '--model-out', model_out,
+                 '--ps-hosts', ps_hosts, '--worker-hosts', worker_hosts,
+                 '--sync' if synchronous else '--async', '--batch-size', str(batch_size),
+                 '--learning-rate', str(learning_rate), '--max-steps', str(max_steps),
+                 '--save-steps', str(save_steps), '--warmup-steps', str(warmup_steps)]
+
+    if threads_per_worker is not None:
+        arguments += ['--threads-per-worker', str(threads_per_worker)]
+
+    ps = subprocess.Popen(arguments + ['--job-name', 'ps', '--task-index', '0'])
+    workers = []
+    throughputs = []
+
+    try:
+        for task_index in range(num_workers):
+            # Output goes to files rather than pipes, which would block the workers once full.
+            output = tempfile.TemporaryFile(mode='w+')
+            process = subprocess.Popen(arguments + ['--job-name', 'worker', '--task-index', str(task_index)],
+                                       stdout=output)
+            workers.append((process, output))
+
+        for process, output in workers:
+            process.wait()
+            output.seek(0)
+
+            for line in output:
+                if line.startswith(THROUGHPUT_PREFIX):
+                    throughputs.append(float(line[len(THROUGHPUT_PREFIX):]))
+                else:
+                    sys.stdout.write(line)
+
+            output.close()
+    finally:
+        for process, _ in workers:
+            if process.poll() is None:
+                process.terminate()
+
+        ps.terminate()
+        ps.wait()
+
+    return throughputs
+
+
+if __name__ == '__main__':
+    main()